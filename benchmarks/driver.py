@@ -0,0 +1,121 @@
+"""
+Runs a single benchmark in a prepared copy of `src` (the current directory), see `run.py`.
+
+Usage: python driver.py stress|create_problem <result.json>
+
+`Stresser` and `ProblemCreator` are run as they are by their scripts, each phase being timed
+from the call to the method starting it (see `Phases.before()`). The result is written as JSON
+to `result.json`.
+"""
+
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.getcwd())  # for the config files and ASIMON's modules
+
+
+class Phases:
+    """
+    Wall time (in seconds) of each phase of a run: `begin("name")` ends the current phase and
+    starts the next one, `end()` ends the last one.
+    """
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+        self.current: str | None = None
+        self.start = 0.0
+
+    def begin(self, name: str | None):
+        now = time.perf_counter()
+        if self.current is not None:
+            self.seconds[self.current] = self.seconds.get(self.current, 0) + now - self.start
+        self.current, self.start = name, now
+
+    def end(self):
+        self.begin(None)
+
+    def before(self, obj, method: str, name: str):
+        """Make calls to `obj.method()` begin the phase `name`."""
+        wrapped = getattr(obj, method)
+
+        def hook(*args, **kwargs):
+            self.begin(name)
+            return wrapped(*args, **kwargs)
+
+        setattr(obj, method, hook)
+
+
+def usage() -> dict | None:
+    """
+    CPU time (in seconds) and peak resident set size (in megabytes) of this process and of its
+    reaped children (worker processes, and the processes they ran), or `None` on Windows.
+    """
+    if resource is None:
+        return None
+    rss_unit = 2**20 if sys.platform == "darwin" else 2**10  # bytes on macOS, else kilobytes
+    result = {}
+    for name, who in [("main", resource.RUSAGE_SELF), ("children", resource.RUSAGE_CHILDREN)]:
+        rusage = resource.getrusage(who)
+        result[name] = {
+            "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+            "peak_rss_mb": rusage.ru_maxrss / rss_unit,
+        }
+    return result
+
+
+def bench_stress(phase: Phases) -> int:
+    from stress import Stresser
+
+    phase.begin("setup")
+    stresser = Stresser()
+    # compilation goes on in the background: "compile" is the wait for the executables the
+    # tests need, and the solutions compiled later are part of "tests" (see `Stresser.__call__()`)
+    phase.before(stresser, "start_compilation", "compile")
+    phase.before(stresser, "init_workers", "init_workers")
+    phase.before(stresser, "run_tests", "tests")
+    phase.before(stresser, "print_final_verdict", "report")
+    stresser()
+    phase.end()
+    return stresser.processed_tests
+
+
+def bench_create_problem(phase: Phases) -> int:
+    from create_problem import ProblemCreator
+
+    phase.begin("setup")
+    creator = ProblemCreator()
+    phase.before(creator, "compiler", "compile")
+    phase.before(creator, "generate_tests", "tests")
+    phase.before(creator, "organize_test_folder", "report")
+    creator()
+    phase.end()
+    return creator.total_test_count
+
+
+BENCHMARKS = {"stress": bench_stress, "create_problem": bench_create_problem}
+
+
+if __name__ == "__main__":
+    tool, result_path = sys.argv[1], sys.argv[2]
+    phases = Phases()
+    tests = BENCHMARKS[tool](phases)
+
+    with open(result_path, "w") as result_file:
+        json.dump(
+            {
+                "tests": tests,
+                "tests_per_second": tests / max(phases.seconds["tests"], 1e-9),
+                "seconds": sum(phases.seconds.values()),
+                "phases": phases.seconds,
+                "usage": usage(),
+            },
+            result_file,
+            indent=4,
+        )
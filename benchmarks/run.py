@@ -0,0 +1,336 @@
+"""
+ASIMON benchmark suite: throughput of `stress.py` and `create_problem.py` on synthetic workloads.
+
+Each benchmark runs in a fresh copy of `src` with the example config files, overridden for the
+workload (see `WORKLOADS`), so that results do not depend on the local configuration or caches.
+Results are written as JSON, and can be compared against a previous result file (the baseline).
+
+Usage examples (from the repository's root):
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --workloads aplusb,large_io --workers 1,4 --baseline baseline.json
+    python benchmarks/run.py --tools stress --set execution_engine='"spawn"'
+
+Exits with code 1 if some benchmark failed or regressed against the baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from tabulate import tabulate
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCHMARKS_DIR.parent
+SRC_DIR = ROOT_DIR / "src"
+EXAMPLE_CONFIG_DIR = ROOT_DIR / "example" / "config"
+WORKLOADS_DIR = BENCHMARKS_DIR / "workloads"
+DRIVER = BENCHMARKS_DIR / "driver.py"
+
+TOOLS = ["stress", "create_problem"]
+
+
+@dataclass
+class Workload:
+    """A solution from `workloads`, used as both the judge and the contestant, and its tests."""
+
+    solution: str
+    testgen_script: str
+    test_count: int
+    description: str
+
+
+WORKLOADS = {
+    "aplusb": Workload("aplusb.cpp", "gen pair", 400, "trivial a+b, i.e. process overhead"),
+    "large_io": Workload("sort.cpp", "gen array 200000", 60, "2 MB of input and output"),
+    "cpu_heavy": Workload("cpu_heavy.cpp", "gen pair", 100, "tens of milliseconds of CPU"),
+    "near_tl": Workload("near_tl.cpp", "gen pair", 8, "0.7 s of CPU, with a 1 s time limit"),
+}
+
+
+def prepare_tree(root: Path, workload: Workload) -> Path:
+    """Copy `src` into `root`, with the workload's sources in its workspace. Returns the copy."""
+    src = root / "src"
+    shutil.copytree(
+        SRC_DIR,
+        src,
+        ignore=shutil.ignore_patterns(
+            "__pycache__", "bin", "log", "cache", "answer_cache", "problem", "workspace"
+        ),
+    )
+    for config_file in src.glob("config_*.py"):
+        config_file.unlink()
+
+    workspace = src / "workspace"
+    if (SRC_DIR / "workspace" / "lib").is_dir():  # ASIMON's testlib.h
+        shutil.copytree(SRC_DIR / "workspace" / "lib", workspace / "lib")
+    workspace.mkdir(exist_ok=True)
+    for source in WORKLOADS_DIR.glob("*.cpp"):
+        shutil.copy(source, workspace)
+    shutil.copy(WORKLOADS_DIR / workload.solution, workspace / "contestant.cpp")
+    return src
+
+
+def write_config(src: Path, tool: str, overrides: dict, extra: list[str]):
+    """
+    Write the config file of `tool` in `src`: the example one, followed by `overrides` and the
+    `extra` assignments (`--set`), which take precedence.
+    """
+    name = f"config_{tool}.py"
+    lines = [(EXAMPLE_CONFIG_DIR / name).read_text(), "\n# benchmark settings"]
+    lines += [f"{key} = {value!r}" for key, value in overrides.items()]
+    lines += extra
+    (src / name).write_text("\n".join(lines) + "\n")
+
+
+def config_overrides(tool: str, workload: Workload, test_count: int, cpu_workers: int) -> dict:
+    if tool == "stress":
+        return {
+            "problem_name": "",
+            "main_correct_solution": workload.solution,
+            "other_solutions": ["contestant.cpp"],
+            "checker_type": "token",
+            "testgen_script": workload.testgen_script,
+            "test_count": test_count,
+            "time_limit": 1,
+            "cpu_workers": cpu_workers,
+            "answer_cache_size": 0,  # a warm cache would skip the judge
+        }
+    return {
+        "problem_name": "benchmark",
+        "main_correct_solution": workload.solution,
+        "other_solutions": [],
+        "external_checker": "",
+        "subtasks": [(test_count, workload.testgen_script)],
+        "testlib_seed": "from0",
+        "make_test_folders": False,
+        "make_zip": False,
+        "bundle_source": False,
+        "time_limit": 1,
+        "cpu_workers": cpu_workers,
+    }
+
+
+def run_benchmark(
+    tool: str, workload_name: str, cpu_workers: int, scale: float, extra: list[str]
+) -> dict:
+    """Run one benchmark in a temporary directory, and return its result."""
+    workload = WORKLOADS[workload_name]
+    test_count = max(1, round(workload.test_count * scale))
+    result = {"tool": tool, "workload": workload_name, "cpu_workers": cpu_workers}
+
+    with tempfile.TemporaryDirectory(prefix="asimon-benchmark-") as root:
+        src = prepare_tree(Path(root), workload)
+        write_config(src, tool, config_overrides(tool, workload, test_count, cpu_workers), extra)
+        result_path = Path(root) / "result.json"
+        log_path = Path(root) / "output.log"
+        with open(log_path, "wb") as log:
+            proc = subprocess.run(
+                [sys.executable, DRIVER, tool, result_path],
+                cwd=src,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        if proc.returncode != 0 or not result_path.exists():
+            result["error"] = log_path.read_text(errors="replace")[-2000:]
+            return result
+        result.update(json.loads(result_path.read_text()))
+    return result
+
+
+def key_of(result: dict) -> str:
+    return f"{result['tool']}/{result['workload']}/{result['cpu_workers']}"
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[dict]:
+    """
+    Compare the throughput of `results` with that of `baseline`. A benchmark regressed if its
+    throughput dropped by more than `tolerance` (e.g. 0.1 for 10%).
+    """
+    baseline_by_key = {key_of(result): result for result in baseline if "error" not in result}
+    comparison = []
+    for result in results:
+        if "error" in result:
+            continue
+        entry = {"benchmark": key_of(result), "tests_per_second": result["tests_per_second"]}
+        previous = baseline_by_key.get(key_of(result))
+        if previous is None:
+            entry["status"] = "new"
+        else:
+            entry["baseline_tests_per_second"] = previous["tests_per_second"]
+            entry["change"] = result["tests_per_second"] / previous["tests_per_second"] - 1
+            entry["status"] = "regression" if entry["change"] < -tolerance else "ok"
+        comparison.append(entry)
+    return comparison
+
+
+def git_revision() -> str | None:
+    try:
+        proc = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return proc.stdout.decode().strip()
+
+
+def parse_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main() -> int:
+    cpu_count = os.cpu_count() or 1
+    default_workers = [2**i for i in range(cpu_count.bit_length()) if 2**i <= cpu_count]
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tools", type=parse_list, default=TOOLS, help="default: all")
+    parser.add_argument(
+        "--workloads",
+        type=parse_list,
+        default=list(WORKLOADS),
+        help="default: all of " + ", ".join(WORKLOADS),
+    )
+    parser.add_argument(
+        "--workers",
+        type=lambda value: [int(item) for item in parse_list(value)],
+        default=default_workers,
+        help="values of cpu_workers to run with (default: powers of 2 up to the CPU count)",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiplies the number of tests of workloads"
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="extra config assignment, e.g. cpu_workers=4 (may be repeated)",
+    )
+    parser.add_argument("--output", type=Path, help="where to write the results (JSON)")
+    parser.add_argument("--baseline", type=Path, help="results (JSON) to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="throughput drop past which a benchmark regressed (default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    for tool in args.tools:
+        if tool not in TOOLS:
+            parser.error(f"unknown tool {tool!r}, must be one of: {', '.join(TOOLS)}")
+    for workload in args.workloads:
+        if workload not in WORKLOADS:
+            parser.error(f"unknown workload {workload!r}, must be one of: {', '.join(WORKLOADS)}")
+
+    results = []
+    for tool in args.tools:
+        for workload in args.workloads:
+            for cpu_workers in args.workers:
+                print(f"Running {tool}/{workload} with {cpu_workers} worker(s)...", flush=True)
+                results.append(run_benchmark(tool, workload, cpu_workers, args.scale, args.set))
+
+    # scaling: throughput relative to the fewest workers of the same tool and workload
+    for result in results:
+        if "error" in result:
+            continue
+        reference = min(
+            (
+                other
+                for other in results
+                if "error" not in other
+                and (other["tool"], other["workload"]) == (result["tool"], result["workload"])
+            ),
+            key=lambda other: other["cpu_workers"],
+        )
+        result["scaling"] = result["tests_per_second"] / reference["tests_per_second"]
+
+    report = {
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": cpu_count,
+        },
+        "revision": git_revision(),
+        "settings": {"scale": args.scale, "set": args.set},
+        "results": results,
+    }
+
+    table = []
+    for result in results:
+        if "error" in result:
+            table.append([key_of(result), "failed"])
+            continue
+        usage = result["usage"] or {}
+        table.append(
+            [
+                key_of(result),
+                result["tests"],
+                result["tests_per_second"],
+                result["scaling"],
+                result["phases"]["compile"],
+                result["phases"]["tests"],
+                usage.get("main", {}).get("peak_rss_mb"),
+                usage.get("children", {}).get("peak_rss_mb"),
+            ]
+        )
+    print()
+    print(
+        tabulate(
+            table,
+            headers=[
+                "benchmark",
+                "tests",
+                "tests/s",
+                "scaling",
+                "compile (s)",
+                "tests (s)",
+                "peak RSS (MB)",
+                "children peak RSS (MB)",
+            ],
+            floatfmt=".2f",
+        )
+    )
+
+    regressed = False
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        report["baseline_revision"] = json.loads(args.baseline.read_text()).get("revision")
+        report["comparison"] = compare(results, baseline, args.tolerance)
+        regressed = any(entry["status"] == "regression" for entry in report["comparison"])
+        print()
+        print(
+            tabulate(
+                [
+                    [
+                        entry["benchmark"],
+                        entry.get("baseline_tests_per_second"),
+                        entry["tests_per_second"],
+                        f"{entry['change']:+.1%}" if "change" in entry else "",
+                        entry["status"],
+                    ]
+                    for entry in report["comparison"]
+                ],
+                headers=["benchmark", "baseline tests/s", "tests/s", "change", "status"],
+                floatfmt=".2f",
+            )
+        )
+
+    for result in results:
+        if "error" in result:
+            print(f"\n{key_of(result)} failed:\n{result['error']}", file=sys.stderr)
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=4) + "\n")
+    return 1 if regressed or any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+// Trivial workload: the cost of a test is almost only the cost of running processes.
+#include <iostream>
+
+int main() {
+    long long a, b;
+    std::cin >> a >> b;
+    std::cout << a + b << '\n';
+}
@@ -0,0 +1,11 @@
+// CPU-heavy workload: 3 * 10^7 dependent operations on the input, i.e. tens of miliseconds.
+#include <cstdint>
+#include <iostream>
+
+int main() {
+    uint64_t a, b;
+    std::cin >> a >> b;
+    uint64_t x = a ^ (b << 32);
+    for (int i = 0; i < 30000000; i++) x = x * 6364136223846793005ULL + (b | 1);
+    std::cout << (x >> 33) << '\n';
+}
@@ -0,0 +1,31 @@
+// Test generator of the benchmark workloads.
+// Usage: gen pair         -> "a b", two random integers
+//        gen array <n>    -> "n" then n random integers
+// A seed may be given as "--seed X" (one argument, as in stress.py) or "--seed" "X".
+#include <cstdlib>
+#include <cstring>
+#include <iostream>
+#include <random>
+#include <string>
+
+int main(int argc, char* argv[]) {
+    std::ios::sync_with_stdio(false);
+    unsigned long long seed = 0;
+    for (int i = 1; i < argc; i++) {
+        if (std::strncmp(argv[i], "--seed", 6) == 0) {
+            const char* value = argv[i][6] == ' ' ? argv[i] + 7 : (i + 1 < argc ? argv[i + 1] : "0");
+            seed = std::strtoull(value, nullptr, 10);
+        }
+    }
+    std::mt19937_64 rng(seed);
+    std::uniform_int_distribution<int> value(0, 1000000000);
+
+    std::string mode = argc > 1 ? argv[1] : "pair";
+    if (mode == "array") {
+        int n = argc > 2 ? std::atoi(argv[2]) : 100000;
+        std::cout << n << '\n';
+        for (int i = 0; i < n; i++) std::cout << value(rng) << (i + 1 < n ? ' ' : '\n');
+    } else {
+        std::cout << value(rng) << ' ' << value(rng) << '\n';
+    }
+}
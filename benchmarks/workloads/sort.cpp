@@ -0,0 +1,15 @@
+// Large I/O workload: reads and writes an array of a few megabytes.
+#include <algorithm>
+#include <iostream>
+#include <vector>
+
+int main() {
+    std::ios::sync_with_stdio(false);
+    std::cin.tie(nullptr);
+    int n;
+    std::cin >> n;
+    std::vector<int> a(n);
+    for (int& x : a) std::cin >> x;
+    std::sort(a.begin(), a.end());
+    for (int i = 0; i < n; i++) std::cout << a[i] << (i + 1 < n ? ' ' : '\n');
+}
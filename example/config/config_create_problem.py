@@ -91,7 +91,26 @@ and the rest as arguments.
 
 For compiler arguments, see your C++ compiler's documentation. Do note that:
 - some arguments are platform-specific (e.g. `-Wl,--stack=<windows_stack_size>`)
-- if you have any precompiled header (e.g. `stdc++.h.gch`), use the exact set of arguments 
-you compiled it with to save time.
+- `bits/stdc++.h` and `testlib.h` are precompiled automatically, with these arguments, for
+sources including them before anything else (in the `cache/pch` folder). Other precompiled
+headers of yours (e.g. `stdc++.h.gch`) are only used if compiled with the exact same arguments.
+"""
+
+compiler_cache_size = 512
+"""
+In megabytes, or 0 for no limit. Size of the cache of compiled executables (in the `cache`
+folder), shared by stress.py and create_problem.py. Least recently used executables are
+evicted after each compilation; see `python cache.py stats` and `python cache.py prune`.
+"""
+
+compiler_cache_entries = 64
+"""Maximum number of executables in the cache, or 0 for no limit."""
+
+compiler_cache_dir = ""
+"""
+Folder of the cache of compiled executables, relative to `src` (or absolute), or an empty string
+for `src/cache`. It can be shared by several copies of ASIMON, e.g. on a common file system:
+concurrent runs then wait for each other's compilations instead of duplicating them. Cached
+executables are only found by sources at the same location (and with the same compiler).
 """
 
@@ -19,11 +19,30 @@ if problem_name == "":
         - "token"       : Check if every tokens of the output matches the answer. Recommended for most use cases.
         - "byte"        : Check if the output is exactly the same (down to single bytes) as the answer.
         - "line"        : Check if every line of the output match. Lines with no content or just whitespaces are ignored.
+        - "float"       : Like "token", but numbers only need to match within a tolerance (see `checker_options`).
         - "external"    : External checker using a C++ file from the `workspace` folder.
     """
 
+    checker_options = {}
+    """
+    Keyword arguments given to the checker. For instance, the "float" checker accepts an absolute
+    and a relative tolerance: `{"abs_eps": 1e-6, "rel_eps": 1e-6}`.
+    """
+
     external_checker = "checker.cpp"
-    """If `checker` is `external`, this is the name of the C++ file."""
+    """
+    If `checker` is `external`, this is the name of the C++ file.
+
+    The checker must be deterministic: its verdicts are memoized, so that it is not run again
+    on an input, answer and output it already checked.
+    """
+
+    external_checker_batch = False
+    """
+    POSIX only. If set to True, the external checker is started once per worker and fed all the
+    tests to check, instead of being run once per test. This is supported by checkers using the
+    `testlib.h` from the `workspace/lib` folder; other checkers are run once per test anyway.
+    """
 
 # testgen_script = "testgen_testlib --lo 0 --hi 1000"
 testgen_script = "testgen 0 1000"
@@ -36,13 +55,84 @@ For `testlib.h` users: each time this script is run, it will have been appended
 This will make outputs unique even though there is only one script.
 """
 
+testgen_batch = False
+"""
+If set to True, and the test generator includes ASIMON's `testlib.h` (from the `workspace/lib`
+folder), each worker starts the generator once and has it generate every test, instead of running
+it once per test. Each test is still generated in a fresh copy of the generator with its own
+"--seed X", so that tests are the same as without this option, and the next tests are generated
+while the solutions run. Not supported on Windows.
+"""
+
 time_limit = 1
 """
 In seconds, can be decimal (e.g. 0.25).
+
+Except on Windows, this limits the CPU time (user + system) of solutions, which is less affected
+by the load of the machine than the wall time. A solution is still killed if its wall time
+exceeds twice this limit (e.g. if it is sleeping or waiting for input).
+"""
+
+memory_limit = 256
+"""
+In megabytes, or `None` for no limit. Only applies to solutions other than the main correct one.
+
+A solution exceeds this limit if its peak memory (maximum resident set size) does, or if it is
+killed by the kernel for exceeding it (with `use_cgroups`). To keep them from exhausting the
+memory of the machine, the address space of solutions is also capped to twice this limit, so
+that allocating more makes them fail. Not supported on Windows.
+"""
+
+output_limit = 64
+"""
+In megabytes, or `None` for no limit. Only applies to solutions other than the main correct one.
+
+Solutions are killed as soon as their output exceeds this limit, except on Windows where it is
+only checked once they exit.
 """
 
 test_count = 1024
 
+test_packing = 1
+"""
+Number of tests run together as a single multi-test input, for problems whose input holds several
+test cases. 1 disables packing. For tiny tests, packing saves most of the time spent starting
+solutions, since the main correct solution and the other solutions run once per pack.
+
+The test generator must then generate a single test case (without the number of test cases),
+and each test's output must end with `test_packing_delimiter`. When a solution fails a pack,
+it is run on halves of the pack until the failing test is found. The time, memory and output
+limits apply to each run, so packs should be small enough to run well within them; only the
+main correct solution is given `time_limit` for each packed test.
+"""
+
+test_packing_header = "{count}\n"
+"""First line(s) of packed inputs, where `{count}` is replaced by the number of tests."""
+
+test_packing_delimiter = "\n"
+"""Ends the output of each packed test, e.g. "\\n" if each test's output is a single line."""
+
+skip_duplicate_inputs = False
+"""
+If set to True, a test whose input was already generated during this run is skipped: neither the
+main correct solution nor the other solutions are run on it. `test_count` still counts every
+generated test; the number of skipped tests is reported next to it, during the run and in the
+result file.
+
+Inputs are remembered in a Bloom filter, so about one in ten thousand new inputs may be wrongly
+skipped.
+"""
+
+answer_cache_size = 0
+"""
+In megabytes, or 0 to disable. Size of the on-disk cache (in the `answer_cache` folder) of the
+main correct solution's answers, keyed on its executable and the input. On a cache hit, the
+main correct solution is not run again, which helps with slow solutions and generators that
+often produce the same input.
+
+Least recently used answers are evicted as new answers are cached.
+"""
+
 failed_test_data = True
 """
 If set to False, no test data of failed tests will be given in the `log` directory,
@@ -56,6 +146,54 @@ For the best balance between various CPU and IO factors (see documentation for m
 this number should be HALF your CPU's physical core count.
 """
 
+parallel_solutions = False
+"""
+If set to True, the main correct solution and all other solutions are run at the same time
+on each test (each using its own CPU), and each output is checked as soon as it is available.
+Otherwise they are run one after another.
+
+Useful when stressing many solutions against a slow main correct solution.
+"""
+
+execution_engine = "process"
+"""
+How child processes (test generator, solutions, checker) are run. Must be one of:
+    - "process"     : Each of the `cpu_workers` Python worker processes runs one test at a time,
+                      blocking on each of its children.
+    - "spawn"       : Same as "process", but the output of children is captured without pipes.
+                      Linux only.
+    - "asyncio"     : All children are driven by a single event loop in the main process, at most
+                      `cpu_workers` of them at a time. Saves the memory and inter-process
+                      communication overhead of the worker processes.
+
+On Linux, whatever the engine, children are started by a small native spawn server, compiled along
+with the sources, rather than forked from Python: the peak memory of a process forked from Python
+cannot be told apart from that of Python itself. Elsewhere, the peak memory of solutions is only
+known when it exceeds that of the Python process starting them.
+"""
+
+use_cgroups = False
+"""
+Linux only. If set to True, each process is run in its own cgroup v2, pinned to its own CPU and
+with `memory_limit` enforced by the kernel. Time and memory are then measured by the kernel
+for that process alone, at the cost of creating a cgroup per process.
+
+This requires a delegated cgroup, e.g. by running:
+    systemd-run --user --scope -p Delegate=yes python stress.py
+If unavailable, ASIMON falls back to the default limits and measurements.
+"""
+
+tracing = False
+"""
+If set to True, the time spent in each phase of each test (test generation, solutions, checker,
+sending results to the main process, result handling...) is traced. A summary is added to the
+result file, and the trace is written to `log/trace.json`, which can be opened in Perfetto
+(https://ui.perfetto.dev) to see where time goes, worker by worker.
+"""
+
+tracing_capacity = 100000
+"""Maximum number of spans kept for the trace file; the oldest ones are dropped past it."""
+
 compilation_command = "$default"
 """
 This argument can be either:
@@ -69,6 +207,25 @@ and the rest as arguments.
 
 For compiler arguments, see your C++ compiler's documentation. Do note that:
 - some arguments are platform-specific (e.g. `-Wl,--stack=<windows_stack_size>`)
-- if you have any precompiled header (e.g. `stdc++.h.gch`), use the exact set of arguments 
-you compiled it with to save time.
+- `bits/stdc++.h` and `testlib.h` are precompiled automatically, with these arguments, for
+sources including them before anything else (in the `cache/pch` folder). Other precompiled
+headers of yours (e.g. `stdc++.h.gch`) are only used if compiled with the exact same arguments.
+"""
+
+compiler_cache_size = 512
+"""
+In megabytes, or 0 for no limit. Size of the cache of compiled executables (in the `cache`
+folder), shared by stress.py and create_problem.py. Least recently used executables are
+evicted after each compilation; see `python cache.py stats` and `python cache.py prune`.
+"""
+
+compiler_cache_entries = 64
+"""Maximum number of executables in the cache, or 0 for no limit."""
+
+compiler_cache_dir = ""
+"""
+Folder of the cache of compiled executables, relative to `src` (or absolute), or an empty string
+for `src/cache`. It can be shared by several copies of ASIMON, e.g. on a common file system:
+concurrent runs then wait for each other's compilations instead of duplicating them. Cached
+executables are only found by sources at the same location (and with the same compiler).
 """
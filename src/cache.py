@@ -0,0 +1,115 @@
+"""
+src/cache.py - Inspect and prune the cache of compiled executables.
+
+Usage:
+    python cache.py stats
+    python cache.py prune [--max-size MB] [--max-entries N]
+
+Without options, `prune` uses the budget of config_stress.py (`compiler_cache_size` and
+`compiler_cache_entries`), or the default one if there is no such file. The cache is the one
+of config_stress.py too (`compiler_cache_dir`).
+"""
+
+import argparse
+import time
+
+from tabulate import tabulate
+
+from lib.models.compile_cache import (
+    CompileCache,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_MAX_ENTRIES,
+    MAX_PRECOMPILED_HEADERS,
+)
+from lib.utils.formatting import send_message, text_colors
+
+from lib.config.paths import cache_dir, rootdir
+from lib.utils.system import get_dir
+
+try:
+    import config_stress as config
+
+    MAX_SIZE = config.compiler_cache_size * 2**20 or None
+    MAX_ENTRIES = config.compiler_cache_entries or None
+    CACHE_DIR = get_dir(rootdir / config.compiler_cache_dir) if config.compiler_cache_dir else None
+except (ImportError, AttributeError):
+    MAX_SIZE, MAX_ENTRIES = DEFAULT_MAX_SIZE, DEFAULT_MAX_ENTRIES
+    CACHE_DIR = None
+
+
+def format_size(size: int | None) -> str:
+    return "no limit" if size is None else f"{size / 2**20:.1f} MB"
+
+
+def stats(cache: CompileCache):
+    accesses = cache.hits + cache.misses
+    print(f"Cache folder: {cache.cache_dir}")
+    print(f"Entries: {len(cache.entries)} (limit: {MAX_ENTRIES or 'no limit'})")
+    print(f"Total size: {format_size(cache.total_size())} (limit: {format_size(MAX_SIZE)})")
+    print(
+        f"Hits: {cache.hits} of {accesses} compilation(s) "
+        + f"({cache.hits / max(1, accesses):.1%}), misses: {cache.misses}"
+    )
+    pch_entries = cache.pch_entries()
+    print(
+        f"Precompiled headers: {len(pch_entries)} (limit: {MAX_PRECOMPILED_HEADERS}), "
+        + format_size(sum(cache.folder_size(folder) for folder in pch_entries))
+    )
+    if not cache.entries:
+        return
+
+    now = time.time()
+    rows = [
+        [
+            key[:12],
+            metadata["source"] or "?",
+            metadata["size"] / 2**20,
+            (now - metadata["last_access"]) / 86400,
+        ]
+        for key, metadata in sorted(
+            cache.entries.items(), key=lambda item: item[1]["last_access"], reverse=True
+        )
+    ]
+    print()
+    print(
+        tabulate(
+            rows,
+            headers=["entry", "source", "size (MB)", "last used (days ago)"],
+            floatfmt=".2f",
+        )
+    )
+
+
+def prune(cache: CompileCache, max_size: int | None, max_entries: int | None):
+    with cache.lock_index():
+        cache.refresh()
+        size_before = cache.total_size()
+        evicted = cache.prune(max_size, max_entries)
+        cache.save()
+    send_message(
+        f"Evicted {len(evicted)} executable(s), freeing "
+        + f"{format_size(size_before - cache.total_size())}.",
+        text_colors.GREEN,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and prune the cache of executables.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="show the entries of the cache, and its hit rate")
+    prune_parser = commands.add_parser("prune", help="evict least recently used entries")
+    prune_parser.add_argument(
+        "--max-size", type=float, help="in megabytes (0 empties the cache, and precompiled headers)"
+    )
+    prune_parser.add_argument("--max-entries", type=int, help="maximum number of entries")
+    args = parser.parse_args()
+
+    cache = CompileCache(CACHE_DIR or cache_dir, MAX_SIZE, MAX_ENTRIES)
+    if args.command == "stats":
+        stats(cache)
+    else:
+        prune(
+            cache,
+            int(args.max_size * 2**20) if args.max_size is not None else None,
+            args.max_entries,
+        )
@@ -39,7 +39,13 @@ class ProblemCreator:
         self.current_problem = Problem(problems_dir / config.problem_name)
         self.subtasks = []
         self.cumulative = 0
-        self.compiler = CppCompiler(config.compilation_command, config.cpu_workers)
+        self.compiler = CppCompiler(
+            config.compilation_command,
+            config.cpu_workers,
+            cache_max_size=config.compiler_cache_size * 2**20 or None,
+            cache_max_entries=config.compiler_cache_entries or None,
+            cache_root=config.compiler_cache_dir,
+        )
 
         for _ in range(config.cpu_workers):
             self.workers.append(TestGenerator(timeout=config.time_limit))
@@ -13,7 +13,11 @@ logdir = rootdir / "log"
 # Log folder.
 result_file_location = logdir / "result.txt"
 # Reports on generic informations about the run.
+trace_file_location = logdir / "trace.json"
+# Spans traced during the run (see `tracing` in config_stress.py), loadable in Perfetto.
 problems_dir = rootdir / "problem"
 # Where we store problems.
 cache_dir = get_dir(rootdir / "cache")
 # Store pair of .c/.cpp files and its binary. Enables skipping of repeated compilation.
+answer_cache_dir = get_dir(rootdir / "answer_cache")
+# Store the judge's answers, keyed on the judge's executable and the input.
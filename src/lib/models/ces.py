@@ -5,7 +5,7 @@ class ContestantExecutionStatus(Enum):
     """
     Represents the correctness of the contestant's solution.
 
-    Note that, for `TLE` and `RTE`, the contestant's solution's output is ignored,
+    Note that, for `TLE`, `MLE`, `RTE` and `OLE`, the contestant's solution's output is ignored,
     and thus the Worker doesn't need to invoke the checker.
     """
 
@@ -25,8 +25,9 @@ class ContestantExecutionStatus(Enum):
 
     # Cases where the solution doesn't produce meaningful output:
     TLE = 400  # Contestant's solution timed out ...
-    MLE = 401  # ... or used too much memory (not yet supported) ...
-    RTE = 402  # ... or exited with an error code.
+    MLE = 401  # ... or used too much memory ...
+    RTE = 402  # ... or exited with an error code ...
+    OLE = 403  # ... or wrote too much output.
 
     def pc(self, point: int) -> int:
         """Partial point (between 0 and 200)."""
@@ -45,5 +46,6 @@ class ContestantExecutionStatus(Enum):
             self.TLE: "time limit exceeded",
             self.MLE: "memory limit exceeded",
             self.RTE: "runtime error",
+            self.OLE: "output limit exceeded",
         }
         return CES_to_string[self]
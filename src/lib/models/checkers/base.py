@@ -1,21 +1,39 @@
-""" 
+"""
 Checker abstract class and CheckerResult.
 """
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from threading import Lock
 from lib.models.ces import ContestantExecutionStatus
+from lib.utils.hashing import digest
+from lib.utils.memfile import MemFile
+from lib.utils.tracing import tracer
 
 
 @dataclass
 class CheckerResult:
-    """The result of the evaluation process."""
+    """
+    The result of the evaluation process. `memoized` is True if the verdict was taken from the
+    checker's memo instead of being computed (see `Checker.evaluate()`).
+    """
 
     status: ContestantExecutionStatus
     comment: str
+    memoized: bool = False
 
 
 class Checker(ABC):
+    memoizable = False
+    """
+    Whether verdicts may be memoized, i.e. `check()` is a pure function of its arguments (and of
+    `fingerprint()`). Worth enabling for checkers more expensive than hashing their arguments.
+    """
+
+    memo_size = 4096
+    """Maximum number of verdicts memoized, per Python process."""
+
     @abstractmethod
     def __str__():
         """The alias of the checker. Used in the `checker` argument in config files."""
@@ -25,5 +43,81 @@ class Checker(ABC):
     def check(self, input: bytes, answer: bytes, output: bytes) -> CheckerResult:
         """Evaluate the test result and return a `CheckerResult`.
         See concrete `checker` classes for the specific comments.
+
+        `input` may be any bytes-like object (e.g. an `mmap`); use `input[:]` if actual `bytes`
+        are needed.
         """
         pass
+
+    def check_files(self, input: MemFile, answer: MemFile, output: MemFile) -> CheckerResult:
+        """
+        Same as `check()`, with the test data held in `MemFile`s. Checkers able to work on the
+        files themselves (e.g. by handing them to a child process) may override this to avoid
+        copying the data.
+        """
+        return self.check(input.view(), answer.contents(), output.contents())
+
+    def close(self):
+        """Release the resources held by the checker in the current Python process, if any."""
+        pass
+
+    def fingerprint(self) -> str:
+        """Identifies the checker's behaviour in memo keys. Defaults to the checker's alias."""
+        return type(self).__str__()
+
+    def evaluate(
+        self,
+        input: MemFile,
+        answer: MemFile,
+        output: MemFile,
+        input_digest: str | None = None,
+        output_digest: str | None = None,
+    ) -> CheckerResult:
+        """
+        Same as `check_files()`, but if the checker is `memoizable`, verdicts are memoized under
+        the SHA256 of `input`, `answer` and `output` (`input_digest` and `output_digest` may be
+        given if already known). The least recently used verdicts are evicted past `memo_size`.
+        """
+        with tracer.span("check", "checker"):
+            return self._evaluate(input, answer, output, input_digest, output_digest)
+
+    def _evaluate(
+        self,
+        input: MemFile,
+        answer: MemFile,
+        output: MemFile,
+        input_digest: str | None,
+        output_digest: str | None,
+    ) -> CheckerResult:
+        if not self.memoizable:
+            return self.check_files(input, answer, output)
+
+        if "_memo" not in self.__dict__:
+            self._memo: OrderedDict[str, CheckerResult] = OrderedDict()
+            self._memo_lock = Lock()
+        key = digest(
+            self.fingerprint().encode(),
+            (input_digest or digest(input.view())).encode(),
+            digest(answer.view()).encode(),
+            (output_digest or digest(output.view())).encode(),
+        )
+
+        with self._memo_lock:
+            result = self._memo.get(key)
+            if result is not None:
+                self._memo.move_to_end(key)
+                return replace(result, memoized=True)
+
+        result = self.check_files(input, answer, output)
+        with self._memo_lock:
+            self._memo[key] = result
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return result
+
+    def __getstate__(self):
+        # the memo is per Python process
+        state = self.__dict__.copy()
+        state.pop("_memo", None)
+        state.pop("_memo_lock", None)
+        return state
@@ -1,32 +1,95 @@
 from .base import *
 from pathlib import Path
 from os import access, X_OK
-from subprocess import run, PIPE, CompletedProcess
-from lib.utils.system import terminate_proc
+from hashlib import file_digest
+from select import select
+from threading import Lock
+from subprocess import run, Popen, PIPE, DEVNULL, CompletedProcess, SubprocessError, TimeoutExpired
+import os
+import time
+from lib.utils.system import terminate_proc, is_windows
+from lib.utils.formatting import send_message, text_colors
+from lib.utils.memfile import MemFile
+
+BATCH_HANDSHAKE = b"ASIMON-BATCH 1\n"
+"""First line written by a checker started in batch mode (see `ExternalChecker`)."""
+
+BATCH_MAX_TEST_SIZE = 2**20
+"""
+In bytes. Test cases larger than this (input, answer and output included) are not piped to a
+checker running in batch mode, but handed to a fresh checker as file descriptors if possible:
+for them the startup cost is negligible, and passing file descriptors saves copying the data.
+"""
 
 
 class ExternalChecker(Checker):
     """
     Checker using an external binary file.
+
+    Verdicts are memoized (see `Checker.evaluate()`), keyed on the binary's contents: the checker
+    must be deterministic.
     """
 
+    memoizable = True
+
     def __str__():
         return "external"
 
-    def __init__(self, checker_path: Path, timeout=5) -> None:
+    def __init__(self, checker_path: Path, timeout=5, batch: bool = False) -> None:
         """
         Initialize the checker. `checker_path` is the path to the external binary checker.
 
+        If `batch` is True (and the platform is not Windows), the checker is started once and
+        fed every test case in a loop instead of being run once per test case (see
+        `check_batch()`).
+
         Will check for the path's executability; will terminate the entire Python interpreter
         if this check fails.
         """
         self.path = checker_path
         self.timeout = timeout
+        self.batch = batch and not is_windows()
 
         if not access(self.path, X_OK):
             terminate_proc(
                 f"Internal critical error: external checker {self.path} isn't executable."
             )
+        with open(self.path, "rb") as binary:
+            self.binary_digest = file_digest(binary, "sha256").hexdigest()
+        self.capabilities = self.probe_capabilities()
+        if self.batch and "batch" not in self.capabilities:
+            self.warn_no_batch()
+
+    def probe_capabilities(self) -> list[str]:
+        """
+        Ask the checker which extensions of the protocol it supports, by running it with the
+        `--_asimon_capabilities` argument. A checker supporting them writes `ASIMON` followed by
+        their names (`fds`, `batch`) on a single line of `stdout` and exits.
+        """
+        if is_windows():  # file descriptors cannot be handed to children
+            return []
+        try:
+            proc = run(
+                [self.path, "--_asimon_capabilities"],
+                stdin=DEVNULL,
+                stdout=PIPE,
+                stderr=DEVNULL,
+                timeout=self.timeout,
+            )
+        except (OSError, SubprocessError):
+            return []
+        words = proc.stdout.decode(errors="replace").split()
+        return words[1:] if words[:1] == ["ASIMON"] else []
+
+    def fingerprint(self) -> str:
+        return self.binary_digest
+
+    def __getstate__(self):
+        # running checkers belong to the current Python process
+        state = super().__getstate__()
+        state.pop("_idle_servers", None)
+        state.pop("_servers_lock", None)
+        return state
 
     def check(self, input: bytes, answer: bytes, output: bytes) -> CheckerResult:
         """Check result using external checker in `checker_path`.
@@ -46,12 +109,16 @@ class ExternalChecker(Checker):
 
         Any message from the C++ checker must be passed to `stderr`; this method will not check `stdout`'s content.
         """
+        if self.batch:
+            return self.check_batch(input, answer, output)
+        return self.check_once(input, answer, output)
 
+    def check_once(self, input: bytes, answer: bytes, output: bytes) -> CheckerResult:
+        """Run the checker on a single test case, piped to its `stdin` (see `check()`)."""
         input_buffer = b"".join([input, answer, output])  # no tangible overhead ???
 
-        proc: CompletedProcess = run(
+        return self.run_once(
             [
-                self.path,
                 "--_asimon_sz_input",
                 str(len(input)),
                 "--_asimon_sz_answer",
@@ -61,23 +128,187 @@ class ExternalChecker(Checker):
             ],
             input=input_buffer,
             stdout=PIPE,
-            stderr=PIPE,
         )
 
+    def check_files(self, input: MemFile, answer: MemFile, output: MemFile) -> CheckerResult:
+        """
+        Hand the test data to the checker as file descriptors if it supports it (the `fds`
+        capability), unless the test case is small enough to be piped to a checker running in
+        batch mode.
+
+        The checker is then supplemented with the arguments `--_asimon_fd_input X`,
+        `--_asimon_fd_answer Y` and `--_asimon_fd_output Z`, `X`, `Y` and `Z` being
+        file descriptors open for reading at the start of `input`, `answer` and `output`.
+        """
+        test_size = input.size() + answer.size() + output.size()
+        if "fds" not in self.capabilities or (self.batch and test_size <= BATCH_MAX_TEST_SIZE):
+            return self.check(input.view(), answer.contents(), output.contents())
+
+        with (
+            input.reader() as input_fd,
+            answer.reader() as answer_fd,
+            output.reader() as output_fd,
+        ):
+            return self.run_once(
+                [
+                    "--_asimon_fd_input",
+                    str(input_fd),
+                    "--_asimon_fd_answer",
+                    str(answer_fd),
+                    "--_asimon_fd_output",
+                    str(output_fd),
+                ],
+                stdin=DEVNULL,
+                stdout=DEVNULL,
+                pass_fds=(input_fd, answer_fd, output_fd),
+            )
+
+    def run_once(self, args: list[str], **run_args) -> CheckerResult:
+        """
+        Run the checker with the arguments `args` (and other `subprocess.run()` arguments) and
+        return its verdict. Terminates the Python interpreter if it runs for more than `timeout`
+        seconds.
+        """
+        try:
+            proc: CompletedProcess = run(
+                [self.path] + args, stderr=PIPE, timeout=self.timeout, **run_args
+            )
+        except TimeoutExpired:
+            terminate_proc(f"Fatal error: external checker timed out after {self.timeout} seconds.")
+        return self.verdict(proc.returncode, proc.stderr)
+
+    def verdict(self, returncode: int, comment: bytes) -> CheckerResult:
         try:
-            status = ContestantExecutionStatus(proc.returncode)
+            status = ContestantExecutionStatus(returncode)
         except ValueError:  # e.g if checker MLEd
             terminate_proc(
-                f"Fatal error: external checker terminated with unknown code {proc.returncode}."
+                f"Fatal error: external checker terminated with unknown code {returncode}."
             )
 
         if status == ContestantExecutionStatus.FAIL:
             terminate_proc(
                 "Fatal error: external checker reported unexpected failure.\n"
-                + f"Error message: {proc.stderr.decode()}"
+                + f"Error message: {comment.decode()}"
             )
 
         return CheckerResult(
             status,
-            proc.stderr.decode(),  # testlib outputs its comment here
+            comment.decode(),  # testlib outputs its comment here
+        )
+
+    def check_batch(self, input: bytes, answer: bytes, output: bytes) -> CheckerResult:
+        """
+        Check result using a long-running instance of the checker, started with the
+        `--_asimon_batch` argument.
+
+        The checker first writes `BATCH_HANDSHAKE` to `stdout`. Then, for each test case, it
+        reads from `stdin` a header line `X Y Z` followed by the `X + Y + Z` bytes of `input`,
+        `answer` and `output`, and writes to `stdout` a header line `code N` followed by the `N`
+        bytes of its comment, `code` being the exit code it would have had when run on its own.
+
+        The ASIMON-testlib compatibility layer implements this by forking a fresh copy of the
+        checker for each test case, which skips the `exec()` and startup costs. A checker is
+        started per concurrent caller and kept for the next calls. If the checker does not
+        answer the handshake, this falls back to running it once per test case.
+
+        A checker which does not reply within `timeout` seconds is killed, and the test case is
+        checked again by running the checker once (which terminates the Python interpreter if
+        it times out again); the next calls start a new checker.
+        """
+        server = self.acquire_server()
+        if server is None:
+            return self.check_once(input, answer, output)
+
+        header = b"%d %d %d\n" % (len(input), len(answer), len(output))
+        try:
+            reply = self.exchange(server, b"".join([header, input, answer, output]))
+        except (OSError, ValueError, EOFError):
+            terminate_proc("Fatal error: external checker exited in batch mode.")
+        if reply is None:
+            server.kill()
+            server.wait()
+            return self.check_once(input, answer, output)
+
+        self.release_server(server)
+        return self.verdict(*reply)
+
+    def exchange(self, server: Popen, request: bytes) -> tuple[int, bytes] | None:
+        """
+        Write `request` to the `stdin` of a checker running in batch mode, and read its reply,
+        i.e. its return code and comment. Returns `None` if it did not reply within `timeout`
+        seconds. Raises `ValueError` on a malformed reply, `EOFError` if the checker exited.
+        """
+        deadline = time.monotonic() + self.timeout
+        stdin, stdout = server.stdin.fileno(), server.stdout.fileno()
+        pending = memoryview(request)
+        reply = bytearray()
+        while True:
+            header_end = reply.find(b"\n")
+            if header_end >= 0:
+                returncode, comment_size = map(int, reply[:header_end].split())
+                if len(reply) >= header_end + 1 + comment_size:
+                    return returncode, bytes(reply[header_end + 1 : header_end + 1 + comment_size])
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, writable, _ = select([stdout], [stdin] if pending else [], [], remaining)
+            if writable:  # stdin is non-blocking, see acquire_server()
+                pending = pending[os.write(stdin, pending) :]
+            if readable:
+                chunk = os.read(stdout, 2**16)
+                if not chunk:
+                    raise EOFError
+                reply += chunk
+
+    def acquire_server(self) -> Popen | None:
+        """Take an idle checker running in batch mode, or start one."""
+        if "_servers_lock" not in self.__dict__:
+            self._idle_servers: list[Popen] = []
+            self._servers_lock = Lock()
+        with self._servers_lock:
+            if self._idle_servers:
+                return self._idle_servers.pop()
+            if not self.batch:  # the handshake failed earlier
+                return None
+
+        server = Popen(
+            [self.path, "--_asimon_batch"], stdin=PIPE, stdout=PIPE, stderr=DEVNULL, bufsize=0
         )
+        ready, _, __ = select([server.stdout], [], [], self.timeout)
+        if ready and server.stdout.readline() == BATCH_HANDSHAKE:
+            os.set_blocking(server.stdin.fileno(), False)
+            return server
+
+        server.kill()
+        server.communicate()
+        with self._servers_lock:
+            if self.batch:
+                self.warn_no_batch()
+        return None
+
+    def warn_no_batch(self):
+        self.batch = False
+        send_message(
+            f"External checker {self.path.name} does not support batch mode, "
+            + "running it once per test instead.",
+            text_colors.YELLOW,
+        )
+
+    def release_server(self, server: Popen):
+        with self._servers_lock:
+            self._idle_servers.append(server)
+
+    def close(self):
+        """Stop the checkers running in batch mode, which exit once their `stdin` is closed."""
+        if "_servers_lock" not in self.__dict__:
+            return
+        with self._servers_lock:
+            servers, self._idle_servers = self._idle_servers, []
+        for server in servers:
+            server.stdin.close()
+            try:
+                server.wait(self.timeout)
+            except TimeoutExpired:
+                server.kill()
+                server.wait()
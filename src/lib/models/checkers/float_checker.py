@@ -0,0 +1,72 @@
+import re
+
+from .base import *
+from .streams import ordinal
+
+
+class FloatChecker(Checker):
+    """
+    Test whether the token lists of `answer` and `output` match, numbers being compared with a
+    tolerance: an output number `y` matches an answer number `x` if `|x - y| <= abs_eps` or
+    `|x - y| <= rel_eps * |x|`. Other tokens must match exactly.
+
+    Tokens are only parsed as numbers when they differ, so that exact outputs cost about as much
+    as with the token checker. Only plain decimal numbers (e.g. `-12`, `3.`, `.5`, `1.5e-3`) are
+    numbers: unlike with `float()`, spellings such as `1_000`, `inf` or `0x1p3` must match
+    exactly. So must `nan`, up to its case and sign.
+    """
+
+    NUMBER = re.compile(rb"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?")
+    NAN = re.compile(rb"[+-]?nan", re.IGNORECASE)
+
+    def __str__():
+        return "float"
+
+    def __init__(self, abs_eps: float = 1e-6, rel_eps: float = 1e-6) -> None:
+        self.abs_eps = abs_eps
+        self.rel_eps = rel_eps
+
+    def matches(self, expected: bytes, found: bytes) -> bool:
+        """Whether the token `found` matches `expected`."""
+        if expected == found:
+            return True
+        if self.NAN.fullmatch(expected):
+            return self.NAN.fullmatch(found) is not None
+        if not (self.NUMBER.fullmatch(expected) and self.NUMBER.fullmatch(found)):
+            return False
+        x, y = float(expected), float(found)
+        return x == y or abs(x - y) <= max(self.abs_eps, self.rel_eps * abs(x))
+
+    def first_mismatch(self, answer_tokens: list[bytes], output_tokens: list[bytes]) -> int | None:
+        """Index of the first non-matching tokens, or `None` if all of them match."""
+        if answer_tokens == output_tokens:
+            return None
+        for i, (answer_token, output_token) in enumerate(zip(answer_tokens, output_tokens)):
+            if not self.matches(answer_token, output_token):
+                return i
+        return None
+
+    def check(self, input: bytes, answer: bytes, output: bytes) -> CheckerResult:
+        answer_tokens = answer.split()
+        output_tokens = output.split()
+
+        if len(answer_tokens) != len(output_tokens):
+            return CheckerResult(
+                status=ContestantExecutionStatus.WA,
+                comment="The answer contains %d tokens while the contestant's output contains %d tokens."
+                % (len(answer_tokens), len(output_tokens)),
+            )
+
+        i = self.first_mismatch(answer_tokens, output_tokens)
+        if i is not None:
+            return CheckerResult(
+                status=ContestantExecutionStatus.WA,
+                comment="%s token is different: answer is: '%s', contestant outputs: '%s'."
+                % (ordinal(i + 1), answer_tokens[i].decode(), output_tokens[i].decode()),
+            )
+
+        return CheckerResult(
+            status=ContestantExecutionStatus.AC,
+            comment="%d token(s) all matches (absolute tolerance %g, relative tolerance %g)."
+            % (len(answer_tokens), self.abs_eps, self.rel_eps),
+        )
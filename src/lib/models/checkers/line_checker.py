@@ -1,4 +1,5 @@
 from .base import *
+from .streams import split_chunks, compare_streams, ordinal, NEWLINE
 
 
 class LineChecker(Checker):
@@ -8,50 +9,35 @@ class LineChecker(Checker):
         return "line"
 
     @staticmethod
-    def ordinal(n: int) -> str:
-        """
-        Returns `n` in ordinal form.
-        Source: https://stackoverflow.com/questions/9647202/ordinal-numbers-replacement.
-        """
-        if 11 <= (n % 100) <= 13:
-            suffix = "th"
-        else:
-            suffix = ["th", "st", "nd", "rd", "th"][min(n % 10, 4)]
-        return str(n) + suffix
+    def split_lines(chunk: bytes) -> list[bytes]:
+        return [line for line in chunk.splitlines() if not line.isspace()]
 
     def check(self, input: bytes, answer: bytes, output: bytes) -> CheckerResult:
-        answer_tokens = answer.splitlines()
-        output_tokens = output.splitlines()
-
-        lanswer = len(answer_tokens)
-        loutput = len(output_tokens)
-        answer_lines = []
-        output_lines = []
-
-        for i in range(lanswer):
-            if not answer_tokens[i].isspace():
-                answer_lines.append(i)
-
-        for j in range(loutput):
-            if not output_tokens[j].isspace():
-                output_lines.append(j)
+        # `answer` and `output` are split one chunk at a time (see `streams.py`), so they may
+        # be arbitrarily large bytes-like objects.
+        answer_count, output_count, mismatch = compare_streams(
+            split_chunks(answer, NEWLINE, self.split_lines),
+            split_chunks(output, NEWLINE, self.split_lines),
+        )
 
-        if len(answer_lines) != len(output_lines):
+        if answer_count != output_count:
             return CheckerResult(
                 status=ContestantExecutionStatus.WA,
                 comment="The answer contains %d non-empty lines while the contestant's output contains %d non-empty lines."
-                % (len(answer_lines), len(output_lines)),
+                % (answer_count, output_count),
             )
 
-        llines = len(answer_lines)
-        for i in range(llines):
-            if answer_tokens[answer_lines[i]] != output_tokens[output_lines[i]]:
-                return CheckerResult(
-                    status=ContestantExecutionStatus.WA,
-                    comment=f"{self.ordinal(i + 1)} line is different.",
-                )
+        if mismatch is not None:
+            index, _, __ = mismatch
+            return CheckerResult(
+                status=ContestantExecutionStatus.WA,
+                comment=f"{ordinal(index + 1)} line is different.",
+            )
 
         return CheckerResult(
             status=ContestantExecutionStatus.AC,
-            comment=f"{llines} line(s) all match.",
+            comment=f"{answer_count} line(s) all match.",
         )
+
+    def check_files(self, input: MemFile, answer: MemFile, output: MemFile) -> CheckerResult:
+        return self.check(input.view(), answer.view(), output.view())
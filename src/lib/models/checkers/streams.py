@@ -0,0 +1,94 @@
+"""
+Chunked comparison of token or line streams, shared by the token and line checkers, and other
+helpers of the built-in checkers.
+
+Checked data is split one chunk (of about `CHUNK_SIZE` bytes) at a time instead of as a whole,
+so that the memory used by a checker does not depend on the size of the output.
+"""
+
+import re
+from itertools import chain
+from typing import Callable, Iterator
+
+CHUNK_SIZE = 2**20
+"""Approximate size of the chunks (in bytes) split at a time."""
+
+WHITESPACE = re.compile(rb"[ \t\n\r\x0b\x0c]")
+"""Whitespace, as understood by `bytes.split()`."""
+
+NEWLINE = re.compile(rb"\n")
+
+
+def split_chunks(
+    data, boundary: re.Pattern, split: Callable[[bytes], list[bytes]]
+) -> Iterator[list[bytes]]:
+    """
+    Split `data` (any bytes-like object, e.g. an `mmap`) one chunk at a time. Chunks end right
+    after an occurrence of `boundary`, so that `split` gives the same items on the chunks as it
+    would on the whole `data`.
+    """
+    start = 0
+    while start < len(data):
+        end = start + CHUNK_SIZE
+        if end < len(data):
+            match = boundary.search(data, end)
+            end = match.end() if match is not None else len(data)
+        yield split(data[start:end])
+        start = end
+
+
+def compare_streams(
+    answer_chunks: Iterator[list[bytes]], output_chunks: Iterator[list[bytes]]
+) -> tuple[int, int, tuple[int, bytes, bytes] | None]:
+    """
+    Compare two streams of items, given as chunks of items.
+
+    Returns the number of items of each stream, and the index and values of the first differing
+    items (`None` if there is none). Once a difference is found, the rest of the streams is only
+    counted.
+    """
+    answer_items: list[bytes] = []
+    output_items: list[bytes] = []
+    answer_index = output_index = 0  # of the first item of `answer_items`, `output_items`
+    answer_offset = output_offset = 0  # first uncompared item of `answer_items`, `output_items`
+
+    while True:
+        if answer_offset == len(answer_items):
+            answer_index += len(answer_items)
+            answer_items, answer_offset = next(answer_chunks, None), 0
+        if output_offset == len(output_items):
+            output_index += len(output_items)
+            output_items, output_offset = next(output_chunks, None), 0
+        if answer_items is None or output_items is None:
+            break
+
+        count = min(len(answer_items) - answer_offset, len(output_items) - output_offset)
+        answer_slice = answer_items[answer_offset : answer_offset + count]
+        output_slice = output_items[output_offset : output_offset + count]
+        if answer_slice != output_slice:
+            for i, (answer_item, output_item) in enumerate(zip(answer_slice, output_slice)):
+                if answer_item != output_item:
+                    mismatch = (answer_index + answer_offset + i, answer_item, output_item)
+                    break
+            answer_count = answer_index + sum(map(len, chain([answer_items], answer_chunks)))
+            output_count = output_index + sum(map(len, chain([output_items], output_chunks)))
+            return answer_count, output_count, mismatch
+        answer_offset += count
+        output_offset += count
+
+    # at least one of the streams is exhausted, without any difference so far
+    answer_count = answer_index + sum(map(len, chain([answer_items or []], answer_chunks)))
+    output_count = output_index + sum(map(len, chain([output_items or []], output_chunks)))
+    return answer_count, output_count, None
+
+
+def ordinal(n: int) -> str:
+    """
+    Returns `n` in ordinal form.
+    Source: https://stackoverflow.com/questions/9647202/ordinal-numbers-replacement.
+    """
+    if 11 <= (n % 100) <= 13:
+        suffix = "th"
+    else:
+        suffix = ["th", "st", "nd", "rd", "th"][min(n % 10, 4)]
+    return str(n) + suffix
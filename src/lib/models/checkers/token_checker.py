@@ -1,4 +1,5 @@
 from .base import *
+from .streams import split_chunks, compare_streams, ordinal, WHITESPACE
 
 
 class TokenChecker(Checker):
@@ -7,39 +8,33 @@ class TokenChecker(Checker):
     def __str__():
         return "token"
 
-    @staticmethod
-    def ordinal(n: int) -> str:
-        """
-        Returns `n` in ordinal form.
-        Source: https://stackoverflow.com/questions/9647202/ordinal-numbers-replacement.
-        """
-        if 11 <= (n % 100) <= 13:
-            suffix = "th"
-        else:
-            suffix = ["th", "st", "nd", "rd", "th"][min(n % 10, 4)]
-        return str(n) + suffix
-
     def check(self, input: bytes, answer: bytes, output: bytes) -> CheckerResult:
-        answer_tokens = answer.split()  # not much perf overhead somehow?
-        output_tokens = output.split()
+        # `answer` and `output` are split one chunk at a time (see `streams.py`), so they may
+        # be arbitrarily large bytes-like objects.
+        answer_count, output_count, mismatch = compare_streams(
+            split_chunks(answer, WHITESPACE, bytes.split),
+            split_chunks(output, WHITESPACE, bytes.split),
+        )
 
-        if len(answer_tokens) != len(output_tokens):
+        if answer_count != output_count:
             return CheckerResult(
                 status=ContestantExecutionStatus.WA,
                 comment="The answer contains %d tokens while the contestant's output contains %d tokens."
-                % (len(answer_tokens), len(output_tokens)),
+                % (answer_count, output_count),
             )
 
-        ltokens = len(answer_tokens)
-        for i in range(ltokens):
-            if answer_tokens[i] != output_tokens[i]:
-                return CheckerResult(
-                    status=ContestantExecutionStatus.WA,
-                    comment="%s token is different: answer is: '%s', contestant outputs: '%s'."
-                    % (self.ordinal(i + 1), answer_tokens[i], output_tokens[i]),
-                )
+        if mismatch is not None:
+            index, answer_token, output_token = mismatch
+            return CheckerResult(
+                status=ContestantExecutionStatus.WA,
+                comment="%s token is different: answer is: '%s', contestant outputs: '%s'."
+                % (ordinal(index + 1), answer_token, output_token),
+            )
 
         return CheckerResult(
             status=ContestantExecutionStatus.AC,
-            comment="%d token(s) all matches." % len(answer_tokens),
+            comment="%d token(s) all matches." % answer_count,
         )
+
+    def check_files(self, input: MemFile, answer: MemFile, output: MemFile) -> CheckerResult:
+        return self.check(input.view(), answer.view(), output.view())
@@ -0,0 +1,362 @@
+"""
+On-disk cache of compiled executables.
+"""
+
+import json
+import os
+import re
+import shutil
+import time
+from hashlib import file_digest
+from pathlib import Path
+from threading import get_ident
+
+from lib.utils.system import FileLock, clone_file, delete_file, get_dir
+
+DEFAULT_MAX_SIZE = 512 * 2**20
+"""Default size (in bytes) above which `CompileCache.prune()` evicts entries."""
+
+DEFAULT_MAX_ENTRIES = 64
+"""Default number of entries above which `CompileCache.prune()` evicts entries."""
+
+MAX_MANIFEST_CANDIDATES = 8
+"""Number of dependency sets remembered per manifest, e.g. for headers edited back and forth."""
+
+MAX_PRECOMPILED_HEADERS = 4
+"""Number of precompiled headers (about 100 MB each for `bits/stdc++.h`) kept by `prune()`."""
+
+
+def parse_depfile(text: str) -> list[str]:
+    """The dependencies listed in a Makefile rule written by the compiler's `-MD` option."""
+    text = text.replace("\\\n", " ")
+    rule = re.split(r":(?:\s|$)", text, maxsplit=1)
+    if len(rule) < 2:
+        return []
+    return [dep.replace("\\ ", " ") for dep in re.findall(r"(?:\\ |\S)+", rule[1])]
+
+
+def file_hash(path: str) -> str | None:
+    """The SHA256 of the file at `path`, or `None` if it cannot be read."""
+    try:
+        with open(path, "rb") as file:
+            return file_digest(file, "sha256").hexdigest()
+    except OSError:
+        return None
+
+
+def hash_deps(deps: list[str], since: int) -> dict[str, str] | None:
+    """
+    The SHA256 of each of `deps`, by absolute path, or `None` if some of them cannot be read or
+    was modified at or after `since` (in nanoseconds since the epoch), as it may have changed
+    after the compiler read it.
+    """
+    digests = {}
+    for dep in deps:
+        path = os.path.abspath(dep)
+        try:
+            if os.stat(path).st_mtime_ns >= since:
+                return None
+        except OSError:
+            return None
+        digests[path] = file_hash(path)
+        if digests[path] is None:
+            return None
+    return digests
+
+
+def write_atomically(path: Path, content: str):
+    """Write `content` to `path` through a temporary file, so readers never see a partial file."""
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}-{get_ident()}.tmp")
+    try:
+        temp_path.write_text(content)
+        os.replace(temp_path, path)
+    except OSError:
+        delete_file(temp_path)
+
+
+class CompileCache:
+    """
+    Content-addressed cache of executables, keyed on the SHA256 of their preprocessed source,
+    compilation arguments and compiler version (see `CppCompiler.compile_file()`).
+
+    Entries are files named `<key>.exe`. An index (`index.json`) records the size, last access
+    time and source file of each entry, along with the number of hits and misses; entries are
+    evicted in least recently used order by `prune()`. Executables are taken out of the cache
+    with `clone_file()`, i.e. by reflink or hardlink where possible, so a hit copies nothing.
+
+    Keys can also be looked up without preprocessing (as ccache's "direct mode" does), from
+    manifests named `<direct key>.manifest`, where the direct key only depends on the source
+    file itself and on the compiler. A manifest lists sets of dependencies (the headers the
+    source included), with the SHA256 of each of them, and the key of the executable they led
+    to (see `lookup_manifest()` and `record_manifest()`).
+
+    Precompiled headers live in `pch/<key>/` (see `CppCompiler.precompile_header()`): a wrapper
+    header `pch.h` including the precompiled one, the precompiled header itself next to it, and
+    the SHA256 of the headers it was built from (`deps.json`), without which it is not used.
+    They are evicted in least recently used order past `MAX_PRECOMPILED_HEADERS`.
+
+    The cache may be shared by several runs (e.g. on a common file system). Entries and
+    manifests are written to a temporary file then renamed, so they are never seen half-written,
+    and `lock()` serializes the work on a key, e.g. so that concurrent runs compile a source
+    once. Within a run, `get()` and `put()` may be called from any process, but only one process
+    (e.g. the one running `CppCompiler.__call__()`) should `record()` accesses and save them;
+    see `lock_index()`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_size: int | None = DEFAULT_MAX_SIZE,
+        max_entries: int | None = DEFAULT_MAX_ENTRIES,
+    ):
+        """
+        `max_size` (in bytes) and `max_entries` are the budgets enforced by `prune()`; `None`
+        means no limit.
+        """
+        self.cache_dir = cache_dir
+        self.index_path = cache_dir / "index.json"
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.entries: dict[str, dict] = {}  # key -> {"size", "last_access", "source"}
+        self.hits = 0
+        self.misses = 0
+        self.saved_counts = (0, 0)  # hits and misses as of the last load() or save()
+        get_dir(cache_dir / "locks")
+        self.load()
+
+    def lock(self, key: str) -> FileLock:
+        """
+        Lock shared by the runs using this cache, to hold while producing the entry `key` (or
+        any other key, e.g. of a precompiled header). Keys are locked by their first 3 digits,
+        so there are at most 4096 lock files, and they never need to be deleted.
+        """
+        return FileLock(self.cache_dir / "locks" / f"{key[:3]}.lock")
+
+    def lock_index(self) -> FileLock:
+        """
+        Lock to hold while updating the index, as other runs may update it too:
+        ```
+        with cache.lock_index():
+            cache.refresh()
+            cache.prune()
+            cache.save()
+        ```
+        """
+        return FileLock(self.cache_dir / "locks" / "index.lock")
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.exe"
+
+    def manifest_path(self, direct_key: str) -> Path:
+        return self.cache_dir / f"{direct_key}.manifest"
+
+    def read_manifest(self, direct_key: str) -> list[dict]:
+        try:
+            return json.loads(self.manifest_path(direct_key).read_text())
+        except (OSError, ValueError):
+            return []
+
+    def lookup_manifest(self, direct_key: str) -> str | None:
+        """
+        The key of the executable of the source with `direct_key`, if its dependencies are
+        unchanged since it was recorded, and it is still cached.
+        """
+        for candidate in self.read_manifest(direct_key):
+            if not self.entry_path(candidate["key"]).exists():
+                continue
+            if all(file_hash(dep) == digest for dep, digest in candidate["deps"].items()):
+                return candidate["key"]
+        return None
+
+    def record_manifest(self, direct_key: str, deps: list[str], key: str, since: int):
+        """
+        Record that the source with `direct_key`, with the dependencies `deps`, compiles to the
+        executable cached under `key`. Nothing is recorded if some dependency was modified at or
+        after `since` (in nanoseconds since the epoch, e.g. when preprocessing started), as it
+        may have changed after it was read.
+        """
+        digests = hash_deps(deps, since)
+        if digests is None:
+            return
+
+        candidates = [{"deps": digests, "key": key}]
+        for candidate in self.read_manifest(direct_key):
+            if candidate["deps"] != digests and len(candidates) < MAX_MANIFEST_CANDIDATES:
+                candidates.append(candidate)
+
+        write_atomically(self.manifest_path(direct_key), json.dumps(candidates))
+
+    def pch_dir(self, key: str) -> Path:
+        return self.cache_dir / "pch" / key
+
+    def lookup_pch(self, key: str) -> Path | None:
+        """
+        The folder of the precompiled header `key`, if the headers it was built from are
+        unchanged since.
+        """
+        folder = self.pch_dir(key)
+        try:
+            deps = json.loads((folder / "deps.json").read_text())
+        except (OSError, ValueError):
+            return None
+        if not all(file_hash(dep) == digest for dep, digest in deps.items()):
+            return None
+        try:
+            os.utime(folder)  # for least recently used eviction
+        except OSError:
+            pass
+        return folder
+
+    def record_pch(self, key: str, deps: list[str], since: int) -> bool:
+        """
+        Record the headers `deps` the precompiled header `key` was built from, which makes it
+        usable. Returns `False` (and records nothing) if some of them was modified at or after
+        `since` (see `hash_deps()`).
+        """
+        digests = hash_deps(deps, since)
+        if digests is None:
+            return False
+        write_atomically(self.pch_dir(key) / "deps.json", json.dumps(digests))
+        return True
+
+    def pch_entries(self) -> list[Path]:
+        """The folders of the precompiled headers, least recently used first."""
+        entries = []
+        for folder in (self.cache_dir / "pch").glob("*"):
+            try:
+                entries.append((folder.stat().st_mtime, folder))
+            except OSError:
+                continue
+        return [folder for _, folder in sorted(entries)]
+
+    @staticmethod
+    def folder_size(folder: Path) -> int:
+        size = 0
+        for path in folder.glob("*"):
+            try:
+                size += path.stat().st_size
+            except OSError:
+                continue
+        return size
+
+    def load(self):
+        """
+        Read the index. Entries missing from the index (e.g. cached by older versions) are
+        added, as of their modification time, and indexed entries whose file is gone are dropped.
+        """
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            index = {}
+        indexed = index.get("entries", {})
+        self.hits = index.get("hits", 0)
+        self.misses = index.get("misses", 0)
+
+        self.entries = {}
+        for entry in self.cache_dir.glob("*.exe"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            metadata = indexed.get(entry.stem, {})
+            self.entries[entry.stem] = {
+                "size": stat.st_size,
+                "last_access": metadata.get("last_access", stat.st_mtime),
+                "source": metadata.get("source", ""),
+            }
+        self.saved_counts = (self.hits, self.misses)
+
+    def refresh(self):
+        """
+        Reload the index, e.g. as updated by other runs since it was loaded, keeping the
+        accesses recorded since then.
+        """
+        entries = self.entries
+        new_hits = self.hits - self.saved_counts[0]
+        new_misses = self.misses - self.saved_counts[1]
+        self.load()
+        for key, metadata in entries.items():
+            if key in self.entries and metadata["last_access"] > self.entries[key]["last_access"]:
+                self.entries[key] = metadata
+        self.hits += new_hits
+        self.misses += new_misses
+
+    def save(self):
+        index = {"hits": self.hits, "misses": self.misses, "entries": self.entries}
+        # write then rename, so that concurrent readers never see a partial index
+        write_atomically(self.index_path, json.dumps(index, indent=1))
+        self.saved_counts = (self.hits, self.misses)
+
+    def get(self, key: str, output_path: Path) -> bool:
+        """
+        Materialize the executable cached under `key` as `output_path`, which must not exist.
+        Returns whether it was cached.
+        """
+        entry = self.entry_path(key)
+        if not entry.exists():
+            return False
+        try:
+            clone_file(entry, output_path)
+        except OSError:
+            return False
+        return True
+
+    def put(self, key: str, executable: Path):
+        """Cache `executable` under `key`. `executable` must not be modified in place afterwards."""
+        entry = self.entry_path(key)
+        temp_entry = entry.with_name(f"{entry.name}.{os.getpid()}-{get_ident()}.tmp")
+        try:
+            clone_file(executable, temp_entry)
+            os.replace(temp_entry, entry)
+        except OSError:
+            delete_file(temp_entry)
+
+    def record(self, key: str, source: str, hit: bool):
+        """Record in the index an access to the entry `key`, the executable of `source`."""
+        try:
+            size = self.entry_path(key).stat().st_size
+        except OSError:
+            return
+        self.entries[key] = {"size": size, "last_access": time.time(), "source": source}
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def total_size(self) -> int:
+        return sum(metadata["size"] for metadata in self.entries.values())
+
+    def prune(self, max_size: int | None = None, max_entries: int | None = None) -> list[str]:
+        """
+        Evict least recently used entries until the cache fits in `max_size` bytes and
+        `max_entries` entries (by default, the budgets given at instantiation). Returns the keys
+        of the evicted entries. Manifests left without any cached executable are deleted too, as
+        are precompiled headers past `MAX_PRECOMPILED_HEADERS` (all of them if `max_size` is 0).
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_entries is None:
+            max_entries = self.max_entries
+
+        pch_entries = self.pch_entries()
+        max_pch = 0 if max_size == 0 else MAX_PRECOMPILED_HEADERS
+        for folder in pch_entries[: max(0, len(pch_entries) - max_pch)]:
+            shutil.rmtree(folder, ignore_errors=True)
+
+        total_size = self.total_size()
+        evicted = []
+        for key in sorted(self.entries, key=lambda key: self.entries[key]["last_access"]):
+            over_size = max_size is not None and total_size > max_size
+            over_entries = max_entries is not None and len(self.entries) > max_entries
+            if not (over_size or over_entries):
+                break
+            delete_file(self.entry_path(key))
+            total_size -= self.entries.pop(key)["size"]
+            evicted.append(key)
+
+        if evicted:
+            for manifest in self.cache_dir.glob("*.manifest"):
+                candidates = self.read_manifest(manifest.stem)
+                if not any(candidate["key"] in self.entries for candidate in candidates):
+                    delete_file(manifest)
+        return evicted
@@ -4,18 +4,34 @@ C/C++ compiler wrapper with caching.
 
 from hashlib import sha256, file_digest
 from pathlib import Path
-from shutil import copy2
 from subprocess import run
-
-from lib.config.paths import cache_dir, workspace
-from lib.utils.system import is_windows
+from typing import Callable
+import os
+import re
+import sys
+import time
+
+from lib.config.paths import cache_dir, rootdir, workspace
+from lib.models.compile_cache import (
+    CompileCache,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_MAX_ENTRIES,
+    parse_depfile,
+    write_atomically,
+)
+from lib.utils.system import is_windows, delete_file, get_dir
 from lib.utils.formatting import send_message, text_colors
 from lib.utils.system import terminate_proc
+from lib.utils.tracing import tracer, enable_tracing
 
-from concurrent.futures import ProcessPoolExecutor, Future
-
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    Future,
+    as_completed,
+    wait,
+    FIRST_COMPLETED,
+)
 
-MAX_CACHE_FILES = 64  # TODO: implements this
 SUPPORTED_COMPILERS = ["g++", "clang++"]
 
 DEFAULT_COMPILER_ARGS = {
@@ -33,6 +49,39 @@ if is_windows():
 
 DEFAULT_COMPILER_ARGS["clang++"] = DEFAULT_COMPILER_ARGS["g++"]  # thanks Clang team
 
+PRECOMPILABLE_HEADERS = ["bits/stdc++.h", "testlib.h"]
+"""
+Headers worth precompiling: a source including one of them (or a header whose path ends with
+one of them, e.g. `lib/testlib.h`) first is compiled with it precompiled. They must be safe to
+include twice, since the source still includes them after the precompiled header.
+"""
+
+MIN_PCH_USERS = 2
+"""
+Number of sources to compile that must include a header for it to be precompiled, as doing so
+takes about as long as compiling two or three of them. Once precompiled, it is used by any source.
+"""
+
+_COMMENT_REGEX = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_INCLUDE_REGEX = re.compile(r'\s*#\s*include\s*([<"])([^>"]+)[>"]\s*')
+
+
+def leading_include(source_path: Path) -> tuple[str, str] | None:
+    """
+    The header `source_path` includes before any other directive or code, as `(delimiter,
+    name)` where `delimiter` is `<` or `"`, or `None`.
+    """
+    try:
+        with open(source_path, errors="replace") as source:
+            text = source.read(2**16)
+    except OSError:
+        return None
+    for line in _COMMENT_REGEX.sub("", text).splitlines():
+        if line.strip():
+            match = _INCLUDE_REGEX.fullmatch(line)
+            return (match[1], match[2]) if match else None
+    return None
+
 
 class CppCompiler:
     @staticmethod
@@ -60,7 +109,14 @@ class CppCompiler:
         """TODO: find and run MSVC init batch file."""
         pass
 
-    def __init__(self, compilation_command: str | None = None, cpu_workers: int = 1):
+    def __init__(
+        self,
+        compilation_command: str | None = None,
+        cpu_workers: int = 1,
+        cache_max_size: int | None = DEFAULT_MAX_SIZE,
+        cache_max_entries: int | None = DEFAULT_MAX_ENTRIES,
+        cache_root: str = "",
+    ):
         """
         Initialize the compiler.
 
@@ -76,8 +132,19 @@ class CppCompiler:
         and the rest as arguments.
 
         `cpu_workers` is the number of concurrent compilation process.
+
+        `cache_max_size` (in bytes) and `cache_max_entries` bound the cache of executables,
+        pruned after each compilation (see `CompileCache`); `None` means no limit.
+
+        `cache_root` is the folder of the cache (relative to `src`), which may be shared by
+        several runs; an empty string means `src/cache`.
         """
         self.cpu_workers = max(4, cpu_workers)  # what can go wrong?
+        self.cache = CompileCache(
+            get_dir(rootdir / cache_root) if cache_root else cache_dir,
+            cache_max_size,
+            cache_max_entries,
+        )
 
         def autodetect_compiler():
             for compiler in SUPPORTED_COMPILERS:
@@ -113,9 +180,134 @@ class CppCompiler:
         if self.compiler_args == "$default" and self.compiler in SUPPORTED_COMPILERS:
             self.compiler_args = DEFAULT_COMPILER_ARGS[self.compiler]
 
-    def compile_file(self, source_path: Path, output_path: Path):
+    def direct_key(self, source_path: Path) -> str:
+        """
+        Key of the manifest of `source_path` (see `CompileCache`): the SHA256 of its location,
+        the compilation args and the compiler version.
         """
-        Call the compiler. The caching process is done here.
+        hash_obj = sha256(str(source_path.resolve()).encode())
+        hash_obj.update(bytearray(self.compiler_args, "utf-8"))
+        hash_obj.update(self.compiler_ver)
+        return hash_obj.hexdigest()
+
+    def precompilable_header(self, source_path: Path) -> tuple[str, str] | None:
+        """
+        If `source_path` includes one of `PRECOMPILABLE_HEADERS` before anything else, returns
+        its name and the content of the wrapper header to precompile for it (see
+        `precompile_header()`). Sources including it later are left alone, as whatever comes
+        before (e.g. `#define _GLIBCXX_DEBUG`) may change what the header means.
+        """
+        if self.compiler == "cl":
+            return None
+        include = leading_include(source_path)
+        if include is None:
+            return None
+        delimiter, name = include
+        if not any(
+            name == header or name.endswith(f"/{header}") for header in PRECOMPILABLE_HEADERS
+        ):
+            return None
+
+        if delimiter == '"' and (source_path.parent / name).is_file():
+            # the wrapper lives in the cache, so it must not look the header up from its folder
+            return name, f'#include "{(source_path.parent / name).resolve().as_posix()}"\n'
+        closing = ">" if delimiter == "<" else '"'
+        return name, f"#include {delimiter}{name}{closing}\n"
+
+    def pch_key(self, wrapper: str) -> str:
+        """
+        Key of the precompiled header of `wrapper` (see `CompileCache`): the SHA256 of the
+        wrapper, the compilation args and the compiler version.
+        """
+        hash_obj = sha256(wrapper.encode())
+        hash_obj.update(bytearray(self.compiler_args, "utf-8"))
+        hash_obj.update(self.compiler_ver)
+        return hash_obj.hexdigest()
+
+    def precompile_header(self, key: str, wrapper: str) -> bool:
+        """
+        Precompile the header `wrapper` into the folder of `key` in the cache, as `pch.h.gch`
+        (`pch.h.pch` with Clang) next to `pch.h`, the wrapper itself. Compiling with
+        `-include <folder>/pch.h` then loads the precompiled header instead of parsing the
+        headers again. Returns whether it succeeded (or another run did it meanwhile).
+        """
+        with self.cache.lock(key):  # concurrent runs precompile it once
+            if self.cache.lookup_pch(key) is not None:
+                return True
+            folder = self.cache.pch_dir(key)
+            folder.mkdir(parents=True, exist_ok=True)
+            delete_file(folder / "deps.json")  # unusable until rebuilt
+
+            # Clang checks that the wrapper is not modified after precompilation, so it is only
+            # written once.
+            header = folder / "pch.h"
+            if not header.is_file() or header.read_text() != wrapper:
+                write_atomically(header, wrapper)
+
+            suffix = ".pch" if self.compiler == "clang++" else ".gch"
+            pch = folder / f"pch.h{suffix}"
+            temp_pch = folder / f"pch.h{suffix}.{os.getpid()}.tmp"
+            depfile = folder / f"pch.{os.getpid()}.d"
+            precompilation_start = time.time_ns()
+            proc = run(
+                (
+                    f"{self.compiler} {self.compiler_args} -x c++-header {header} -o {temp_pch} "
+                    f"-MD -MF {depfile}"
+                ).split(),
+                capture_output=True,
+            )
+            try:
+                deps = parse_depfile(depfile.read_text())
+            except OSError:
+                deps = []
+            delete_file(depfile)
+            if proc.returncode != 0 or not deps:
+                delete_file(temp_pch)
+                return False
+            os.replace(temp_pch, pch)
+            return self.cache.record_pch(key, deps, precompilation_start)
+
+    def precompile_headers(
+        self, source_paths: list[Path], worker_pool: ProcessPoolExecutor
+    ) -> tuple[dict[Path, Path], dict[Future, tuple[str, str, list[Path]]]]:
+        """
+        Returns the folder of the precompiled header to compile each of `source_paths` with, for
+        those whose header is already precompiled, and the precompilations started in
+        `worker_pool` (see `precompile_header()`), along with their key, the name of their
+        header and the sources waiting for them. Headers that are not precompiled yet (or whose
+        headers changed since) are precompiled if at least `MIN_PCH_USERS` of `source_paths`
+        include them.
+        """
+        users: dict[str, list[Path]] = {}  # key -> source paths
+        headers: dict[str, tuple[str, str]] = {}  # key -> (name, wrapper)
+        for source_path in source_paths:
+            header = self.precompilable_header(source_path)
+            if header is None:
+                continue
+            key = self.pch_key(header[1])
+            headers[key] = header
+            users.setdefault(key, []).append(source_path)
+
+        pch_dirs: dict[Path, Path] = {}
+        precompilations: dict[Future, tuple[str, str, list[Path]]] = {}
+        for key, key_users in users.items():
+            if self.cache.lookup_pch(key) is not None:
+                pch_dirs.update((source_path, self.cache.pch_dir(key)) for source_path in key_users)
+            elif len(key_users) >= MIN_PCH_USERS:
+                name, wrapper = headers[key]
+                send_message(
+                    f"Precompiling {name} for {len(key_users)} source file(s)...",
+                    text_colors.YELLOW,
+                )
+                result_obj = worker_pool.submit(
+                    _traced, f"precompile {name}", self.precompile_header, key, wrapper
+                )
+                precompilations[result_obj] = (key, name, key_users)
+        return pch_dirs, precompilations
+
+    def lookup(self, source_path: Path, output_path: Path) -> tuple[str, bool]:
+        """
+        Look the executable of `source_path` up in the cache. The caching process is done here.
 
         First preprocess the file in `source_path`. Then create a SHA256 from:
         - the content of the preprocessed source code
@@ -124,49 +316,150 @@ class CppCompiler:
 
         If these three things stay the same then the resulting binary file will also does.
         The rest are just paperwork.
+
+        Except with MSVC, the preprocessor also lists the headers the source includes, which
+        are recorded in the manifest of the source. As long as neither the source nor these
+        headers change, later calls find the executable from the manifest without running the
+        compiler at all.
+
+        Returns the SHA256 (the key of the executable in the cache), and whether the executable
+        was found, in which case it is now at `output_path`. Otherwise, see `compile_file()`.
         """
 
+        # The previous executable may be a hardlink to a cached one, which must not be
+        # overwritten in place.
+        delete_file(output_path)
+
+        direct_key = None
+        if self.compiler != "cl":
+            direct_key = self.direct_key(source_path)
+            key = self.cache.lookup_manifest(direct_key)
+            if key is not None and self.cache.get(key, output_path):
+                send_message(
+                    f"Cached executable for {source_path.name} found (unchanged source and "
+                    + "headers), skipping compilation...",
+                    text_colors.YELLOW,
+                )
+                return key, True
+
         # Preprocess source code (since included libs can change)
         prep_flag = "/P" if self.compiler == "cl" else "-E"
         prep_output_flag = "/Fi" if self.compiler == "cl" else "-o"
-        run(
-            f"{self.compiler} {self.compiler_args} {prep_flag} {source_path} {prep_output_flag} {output_path}".split(),
-            check=True,
-        )
+        # named after the process, as other runs may compile the same source (in the same folder)
+        preprocessed_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.i")
+        depfile = output_path.with_name(f"{output_path.name}.{os.getpid()}.d")
+        dep_flags = f" -MD -MF {depfile}" if direct_key is not None else ""
+        preprocessing_start = time.time_ns()
+        try:
+            run(
+                (
+                    f"{self.compiler} {self.compiler_args} {prep_flag} {source_path} "
+                    f"{prep_output_flag} {preprocessed_path}{dep_flags}"
+                ).split(),
+                check=True,
+            )
 
-        hash_obj = sha256()
-        with open(output_path, "rb") as preprocessed_source:
-            hash_obj = file_digest(preprocessed_source, "sha256")
+            hash_obj = sha256()
+            with open(preprocessed_path, "rb") as preprocessed_source:
+                hash_obj = file_digest(preprocessed_source, "sha256")
+        finally:
+            delete_file(preprocessed_path)
 
         hash_obj.update(bytearray(self.compiler_args, "utf-8"))
         hash_obj.update(self.compiler_ver)
 
-        cache_path = cache_dir / f"{hash_obj.hexdigest()}.exe"
-        if cache_path.exists():
+        key = hash_obj.hexdigest()
+        if direct_key is not None:
+            try:
+                deps = parse_depfile(depfile.read_text())
+            except OSError:
+                deps = []
+            delete_file(depfile)
+            if deps:
+                self.cache.record_manifest(direct_key, deps, key, preprocessing_start)
+        # The executable is a reflink or hardlink of the cached one where possible, else a
+        # copy; if the metadata is not properly carried over then Microsoft Security will
+        # engage thinking that output_path is a trojan.
+        if self.cache.get(key, output_path):
             send_message(
                 f"Cached executable for {source_path.name} found, skipping compilation...",
                 text_colors.YELLOW,
             )
-            # If the metadata is not properly carried over then Microsoft Security will engage thinking that
-            # output_path is a trojan.
-            copy2(cache_path, output_path)
-        else:
+            return key, True
+        return key, False
+
+    def compile_file(
+        self, source_path: Path, output_path: Path, key: str, pch_dir: Path | None = None
+    ) -> bool:
+        """
+        Compile `source_path` into `output_path`, and cache the executable under `key` (see
+        `lookup()`). With `pch_dir`, the source is compiled with the precompiled header there
+        (see `precompile_header()`), or without it if the compiler rejects it.
+
+        Runs sharing the cache compile a given executable one at a time, so if another run
+        compiled it meanwhile, it is taken from the cache instead; returns whether it was.
+        """
+        with self.cache.lock(key):
+            delete_file(output_path)
+            if self.cache.get(key, output_path):
+                send_message(
+                    f"Cached executable for {source_path.name} found (compiled by another run), "
+                    + "skipping compilation...",
+                    text_colors.YELLOW,
+                )
+                return True
+            self._compile(source_path, output_path, pch_dir)
+            self.cache.put(key, output_path)
+        return False
+
+    def _compile(self, source_path: Path, output_path: Path, pch_dir: Path | None):
+        if pch_dir is not None:
+            proc = run(
+                (
+                    f"{self.compiler} {self.compiler_args} -include {pch_dir / 'pch.h'} "
+                    f"{source_path} -o {output_path}"
+                ).split(),
+                capture_output=True,
+            )
+            if proc.returncode == 0:
+                sys.stdout.buffer.write(proc.stdout)  # warnings
+                sys.stdout.flush()
+                sys.stderr.buffer.write(proc.stderr)
+                sys.stderr.flush()
+            else:  # errors are shown by the compilation below
+                pch_dir = None
+
+        if pch_dir is None:
             # MSVC has /Fe instead of /Fi.
             # See: https://learn.microsoft.com/en-us/cpp/build/reference/compiler-options-listed-by-category.
             bin_output_flag = "/Fe" if self.compiler == "cl" else "-o"
             run(
-                f"{self.compiler} {self.compiler_args} {source_path} {bin_output_flag} {output_path}".split(),
+                (
+                    f"{self.compiler} {self.compiler_args} {source_path} "
+                    f"{bin_output_flag} {output_path}"
+                ).split(),
                 check=True,
             )
-            copy2(output_path, cache_path)
 
-    def __call__(self, source_output: list[tuple[Path, Path]]):
+    def __call__(
+        self,
+        source_output: list[tuple[Path, Path]],
+        on_ready: Callable[[Path, Path], None] | None = None,
+    ):
         """
         Call the compiler for all items in `source_output`.
 
         `source_output` must be a list where each item is `(source, output)`,
         corresponding to the locations of the C++ source file
         and its executable, respectively.
+
+        Executables are first looked up in the cache (see `lookup()`). The sources to compile
+        are then compiled in the order of `source_output`, except for those waiting for a header
+        to be precompiled (see `precompile_headers()`). The cache of executables is then pruned
+        to its budget.
+
+        If given, `on_ready(source, output)` is called as soon as each executable is ready, e.g.
+        to start using some of them while the others are being compiled.
         """
 
         send_message(
@@ -174,14 +467,110 @@ class CppCompiler:
             text_colors.GREEN,
         )
 
-        with ProcessPoolExecutor(max_workers=self.cpu_workers) as worker_pool:
-            procs: list[tuple[Path, Future]] = []
-            for source_path, output_path in source_output:
-                procs.append(
-                    (source_path, worker_pool.submit(self.compile_file, source_path, output_path))
+        def collect(source_path: Path, result_obj: Future):
+            if result_obj.exception() is not None:  # compiler fails
+                terminate_proc(
+                    f"Fatal error: C++ source file {source_path.name} cannot be compiled, or doesn't exist.",
+                )
+            result, spans = result_obj.result()
+            tracer.extend(spans)
+            return result
+
+        with ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            initializer=enable_tracing if tracer.enabled else None,
+        ) as worker_pool:
+            lookups: dict[Future, int] = {}  # -> index in source_output
+            for index, (source_path, output_path) in enumerate(source_output):
+                result_obj = worker_pool.submit(
+                    _traced, source_path.name, self.lookup, source_path, output_path
                 )
-            for source_path, result_obj in procs:
-                if result_obj.exception() is not None:  # compiler fails
-                    terminate_proc(
-                        f"Fatal error: C++ source file {source_path.name} cannot be compiled, or doesn't exist.",
-                    )
+                lookups[result_obj] = index
+            misses: list[tuple[int, str]] = []  # (index in source_output, key)
+            for result_obj in as_completed(lookups):
+                source_path, output_path = source_output[lookups[result_obj]]
+                key, hit = collect(source_path, result_obj)
+                if hit:
+                    self.cache.record(key, source_path.name, True)
+                    if on_ready is not None:
+                        on_ready(source_path, output_path)
+                else:
+                    misses.append((lookups[result_obj], key))
+            misses.sort()
+
+            pch_dirs, precompilations = self.precompile_headers(
+                [source_output[index][0] for index, _ in misses], worker_pool
+            )
+            waiting = {
+                source_path
+                for _, _, source_paths in precompilations.values()
+                for source_path in source_paths
+            }
+            compilations: dict[Future, tuple[int, str]] = {}
+
+            def compile(index: int, key: str) -> Future:
+                source_path, output_path = source_output[index]
+                result_obj = worker_pool.submit(
+                    _traced,
+                    source_path.name,
+                    self.compile_file,
+                    source_path,
+                    output_path,
+                    key,
+                    pch_dirs.get(source_path),
+                )
+                compilations[result_obj] = (index, key)
+                return result_obj
+
+            pending = set(precompilations)
+            for index, key in misses:
+                if source_output[index][0] not in waiting:
+                    pending.add(compile(index, key))
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for result_obj in finished:
+                    if result_obj in compilations:
+                        index, key = compilations[result_obj]
+                        source_path, output_path = source_output[index]
+                        hit = collect(source_path, result_obj)
+                        self.cache.record(key, source_path.name, hit)
+                        if on_ready is not None:
+                            on_ready(source_path, output_path)
+                        continue
+
+                    # a precompiled header: the sources waiting for it can be compiled now
+                    pch_key, name, source_paths = precompilations[result_obj]
+                    if result_obj.exception() is None and result_obj.result()[0]:
+                        tracer.extend(result_obj.result()[1])
+                        pch_dirs.update(
+                            (source_path, self.cache.pch_dir(pch_key))
+                            for source_path in source_paths
+                        )
+                    else:
+                        send_message(
+                            f"{name} cannot be precompiled, compiling without it...",
+                            text_colors.YELLOW,
+                        )
+                    for index, key in misses:
+                        if source_output[index][0] in source_paths:
+                            pending.add(compile(index, key))
+
+        with self.cache.lock_index():
+            self.cache.refresh()
+            evicted = self.cache.prune()
+            self.cache.save()
+        if evicted:
+            send_message(
+                f"Evicted {len(evicted)} least recently used executable(s) from the cache.",
+                text_colors.YELLOW,
+            )
+
+
+def _traced(name: str, function, *args):
+    """
+    `function(*args)`, returning its result and the spans traced in the worker process, if any.
+    """
+    with tracer.span(name, "compilation"):
+        result = function(*args)
+    return result, tracer.drain()
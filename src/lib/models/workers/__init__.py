@@ -1,4 +1,17 @@
-from .test_executor import ContestantExecutionResult, WorkerResult, TestExecutor
+from .test_executor import (
+    ContestantExecutionResult,
+    WorkerResult,
+    TestExecutor,
+    init_worker,
+    run_test,
+)
 from .test_generator import TestGenerator
 
-__all__ = ["ContestantExecutionResult", "WorkerResult", "TestExecutor", "TestGenerator"]
+__all__ = [
+    "ContestantExecutionResult",
+    "WorkerResult",
+    "TestExecutor",
+    "init_worker",
+    "run_test",
+    "TestGenerator",
+]
@@ -1,25 +1,355 @@
 """
 Internal wrapper around subprocess's run() method.
+
+By default processes are run with `SubprocessEngine`, blocking the calling thread.
+An alternative engine (e.g. `AsyncEngine`) can be selected per Python process with `set_engine()`.
+
+Processes are run in a sandbox, which enforces memory and output limits and measures resource usage.
+By default (`RlimitSandbox`), on POSIX systems the CPU time and peak memory of each process are
+collected from `wait4()`, and limits are enforced with `setrlimit()`; processes may be spawned by
+a spawn server (see `spawn_server.py`) so that their peak memory is their own.
+Elsewhere, only the wall time is measured. Another sandbox (e.g. `CgroupSandbox`) can be selected
+with `set_sandbox()`.
 """
 
-from subprocess import run, PIPE, TimeoutExpired, CompletedProcess, CalledProcessError
+from subprocess import Popen, PIPE, TimeoutExpired, CompletedProcess, CalledProcessError
 from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path
+from sys import platform
 
+import os
+import signal
 import time
 
-from lib.utils.system import terminate_proc
+from lib.utils.system import terminate_proc, is_windows
+from lib.utils.tracing import tracer
+
+from .spawn_server import SpawnServer, ServedProcess, communicate, spawn_with_pipes
+
+if not is_windows():
+    import resource
+
+WALL_TIMEOUT_FACTOR = 2
+"""
+When CPU time can be measured, `timeout` limits the CPU time of processes, and processes are only
+killed after `WALL_TIMEOUT_FACTOR * timeout` seconds of wall time (e.g. if they are sleeping).
+"""
+
+ADDRESS_SPACE_FACTOR = 2
+"""
+`RlimitSandbox` caps the address space of processes to `ADDRESS_SPACE_FACTOR * memory_limit`, so
+that they can exceed the memory limit (which applies to their measured peak memory) without
+exhausting the machine's memory.
+"""
+
+
+class ProcessFailed(CalledProcessError):
+    """
+    Raised by `anal_process()` when a process exited with an error code. `result` is its
+    `ProcessResult`, with the time and memory it used.
+    """
+
+    def __init__(self, result: "ProcessResult", cmd, stderr: bytes | None = None):
+        super().__init__(result.returncode, cmd, result.stdout, stderr)
+        self.result = result
+
+
+class MemoryLimitExceeded(ProcessFailed):
+    """Raised by `anal_process()` when a process used more memory than allowed."""
+
+
+class OutputLimitExceeded(ProcessFailed):
+    """Raised by `anal_process()` when a process wrote more output than allowed."""
+
+
+@dataclass
+class ResourceUsage:
+    """
+    Resources used by a completed process: `cpu_time` (user + system time) in miliseconds and
+    `peak_memory` in kilobytes (0 if unknown). `memory_exceeded` is `None` if the sandbox cannot
+    tell whether the process hit its memory limit.
+    """
+
+    cpu_time: float
+    peak_memory: int
+    memory_exceeded: bool | None = None
+
+
+def usage_of(rusage, spawned_here: bool = True) -> ResourceUsage | None:
+    """
+    Converts a `resource.struct_rusage` (as returned by `wait4()`) to a `ResourceUsage`.
+
+    If the child was spawned by the current process (`spawned_here`) rather than by a spawn server
+    (see `spawn_server.py`), `ru_maxrss` also accounts the memory the child had before it
+    `exec()`ed its program: the pages it shared with (or copied from) the Python process, up to
+    the latter's peak memory. It is thus the program's own peak memory only if it exceeds the peak
+    memory of the current process; otherwise, the program's peak memory is unknown and reported
+    as 0.
+    """
+    if rusage is None:
+        return None
+    peak_memory = rusage.ru_maxrss
+    if spawned_here and peak_memory <= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+        peak_memory = 0
+    if platform == "darwin":  # bytes instead of kilobytes
+        peak_memory //= 1024
+    return ResourceUsage((rusage.ru_utime + rusage.ru_stime) * 1000, peak_memory)
+
+
+class RlimitSandbox:
+    """
+    Default sandbox: the address space of processes is capped with `RLIMIT_AS` (see
+    `ADDRESS_SPACE_FACTOR`), and the size of the files they write (e.g. their `stdout`, if it is a file) to
+    the output limit with `RLIMIT_FSIZE`, so that writing past it kills them with `SIGXFSZ`.
+    Resource usage is taken from `wait4()`.
+
+    If the executable of a `spawn_server` is given, processes are spawned by it, so that their
+    peak memory is measured (see `usage_of()`) and their limits are set before they `exec()` their
+    program. Its source is `spawn_server.SOURCE`.
+
+    A sandbox creates a context for each process with `run()`. If the context has a `server`,
+    engines must spawn the process with the context's `spawn()`. Otherwise, they must apply its
+    `limit()` to the process, either in the child right before it `exec()`s its program (e.g. as
+    the `preexec_fn` of `Popen`) or to its pid right after spawning it. Either way, they pass its
+    `wait4()` resource usage (or `None`) to the context's `usage()` once it is reaped, before
+    leaving the context.
+    """
+
+    def __init__(self, spawn_server: Path | None = None):
+        self.spawn_server = spawn_server
+
+    class Run:
+        def __init__(
+            self,
+            memory_limit: int | None,
+            output_limit: int | None,
+            server: SpawnServer | None = None,
+        ):
+            self.memory_limit = memory_limit
+            self.output_limit = output_limit
+            self.server = server
+            self.address_space = (
+                memory_limit * ADDRESS_SPACE_FACTOR if memory_limit is not None else None
+            )
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            pass
+
+        def limit(self, pid: int = 0):
+            """
+            Apply the limits to the process `pid`, or to the calling process if 0. A process
+            which already exited is left alone. No-op on Windows.
+            """
+            if is_windows():
+                return
+            for limit, value in [
+                (resource.RLIMIT_AS, self.address_space),
+                (resource.RLIMIT_FSIZE, self.output_limit),
+            ]:
+                if value is None:
+                    continue
+                try:
+                    if pid == 0:
+                        resource.setrlimit(limit, (value, value))
+                    else:
+                        resource.prlimit(pid, limit, (value, value))
+                except ProcessLookupError:
+                    return
+
+        def spawn(self, args: list, fds: list[int]) -> ServedProcess:
+            """Spawn `args` through the `server`, with `fds` as its standard streams."""
+            return self.server.spawn(
+                args, fds, address_space=self.address_space, file_size=self.output_limit
+            )
+
+        def usage(self, rusage) -> ResourceUsage | None:
+            return usage_of(rusage, spawned_here=self.server is None)
+
+    def partition(self, index: int, parts: int) -> "RlimitSandbox":
+        """Same as `CgroupSandbox.partition()`; worker processes share this sandbox as is."""
+        return self
+
+    def run(self, memory_limit: int | None, output_limit: int | None = None) -> Run:
+        server = None
+        if self.spawn_server is not None:
+            server = SpawnServer.get(self.spawn_server)
+        return self.Run(memory_limit, output_limit, server)
+
+
+_sandbox = RlimitSandbox()
+"""Sandbox of the current Python process."""
+
+
+def set_sandbox(sandbox):
+    """
+    Select the sandbox used by the execution engines in the current Python process.
+    `sandbox` must provide the same interface as `RlimitSandbox`, or be `None` to fall back to it.
+    """
+    global _sandbox
+    _sandbox = sandbox if sandbox is not None else RlimitSandbox()
+
+
+def current_sandbox():
+    return _sandbox
+
+
+class _RusagePopen(Popen):
+    """`Popen` which reaps its child with `wait4()`, keeping the child's resource usage."""
+
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, sts, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return (self.pid, 0)  # see Popen._try_wait()
+        if pid == self.pid:
+            self.rusage = rusage
+        return (pid, sts)
+
+
+class SubprocessEngine:
+    """
+    Runs each process with `Popen`, blocking the calling thread until it completes. The
+    sandbox's limits are set in the child by its `preexec_fn`, right before it `exec()`s.
+
+    If the sandbox has a spawn server, processes are spawned by it instead, and the calling
+    thread communicates with them through pipes, as `Popen` does.
+    """
+
+    def run(
+        self,
+        command: str | PathLike | list,
+        input: bytes | None = None,
+        stdin=None,
+        stdout=PIPE,
+        stderr=PIPE,
+        timeout: float | None = None,
+        memory_limit: int | None = None,
+        output_limit: int | None = None,
+    ):
+        """
+        Run `command` in the current sandbox. Arguments have the same meaning as those of
+        `subprocess.run()`; `memory_limit` and `output_limit` are in bytes.
+
+        Returns the completed process, its execution time (in miliseconds), its
+        `ResourceUsage` (`None` if not available) and the time it took to start it (in
+        miliseconds, counted in the execution time). Raises `TimeoutExpired` if the process
+        timed out.
+        """
+        args = [command] if isinstance(command, (str, PathLike)) else list(command)
+        stdin = PIPE if input is not None else stdin
+        with _sandbox.run(memory_limit, output_limit) as box:
+            start = time.perf_counter()
+            run = self._run_served if box.server is not None else self._run_popen
+            returncode, out, err, rusage, spawned = run(
+                box, args, input, stdin, stdout, stderr, timeout
+            )
+            end = time.perf_counter()
+            usage = box.usage(rusage)
+
+        proc = CompletedProcess(args, returncode, out, err)
+        return proc, (end - start) * 1000, usage, (spawned - start) * 1000
+
+    @staticmethod
+    def _run_popen(box, args, input, stdin, stdout, stderr, timeout):
+        popen_class = Popen if is_windows() else _RusagePopen
+        with popen_class(
+            args,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            preexec_fn=None if is_windows() else box.limit,
+        ) as proc:
+            spawned = time.perf_counter()
+            try:
+                out, err = proc.communicate(input, timeout=timeout)
+            except TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                raise TimeoutExpired(args, timeout)
+        return proc.returncode, out, err, getattr(proc, "rusage", None), spawned
+
+    @staticmethod
+    def _run_served(box, args, input, stdin, stdout, stderr, timeout):
+        process, pipes = spawn_with_pipes(box, args, stdin, stdout, stderr)
+        spawned = time.perf_counter()
+        deadline = spawned + timeout if timeout is not None else None
+        try:
+            out, err = communicate(pipes, input, deadline)
+            remaining = max(0, deadline - time.perf_counter()) if timeout is not None else None
+            status, rusage = process.exited.result(remaining)
+        except TimeoutError:
+            process.kill()
+            process.exited.result()
+            raise TimeoutExpired(args, timeout)
+        except BaseException:
+            process.kill()
+            raise
+        return os.waitstatus_to_exitcode(status), out, err, rusage, spawned
+
+
+_engine = SubprocessEngine()
+"""Execution engine of the current Python process."""
+
+
+def set_engine(engine):
+    """
+    Select the execution engine used by `anal_process()` in the current Python process.
+    `engine` must provide a `run()` method with the same signature as `SubprocessEngine.run()`,
+    or be `None` to fall back to `SubprocessEngine`.
+    """
+    global _engine
+    _engine = engine if engine is not None else SubprocessEngine()
 
 
 @dataclass
 class ProcessResult:
     """
     Represents a completed process, returned by `Worker.anal_process()`.
-    Do note that `exec_time` is in miliseconds.
+    Do note that `exec_time` (wall time), `cpu_time` (user + system time) and `spawn_time` (time
+    taken to start the process, counted in `exec_time`) are in miliseconds, and `peak_memory`
+    (maximum resident set size) is in kilobytes.
+
+    `cpu_time` equals `exec_time` and `peak_memory` is 0 if they cannot be measured. Unless
+    processes are spawned by a spawn server, this is also the case of a `peak_memory` not
+    exceeding that of the spawning Python process (see `usage_of()`).
     """
 
     returncode: int
     exec_time: float
     stdout: bytes | None
+    cpu_time: float = 0.0
+    peak_memory: int = 0
+    spawn_time: float = 0.0
+
+
+def memory_exceeded(usage: ResourceUsage, memory_limit: int) -> bool:
+    """
+    Whether a process with resource `usage` exceeded `memory_limit` (in bytes): as told by the
+    sandbox if it knows (e.g. a kill by the cgroup's OOM killer), otherwise whether its measured
+    peak memory did. An unknown peak memory (0) never exceeds the limit.
+    """
+    if usage.memory_exceeded is not None:
+        return usage.memory_exceeded
+    return usage.peak_memory * 1024 > memory_limit
+
+
+def output_exceeded(proc: CompletedProcess, stdout, output_limit: int) -> bool:
+    """
+    Whether `proc` exceeded `output_limit` (in bytes), given the file descriptor `stdout` it
+    wrote to. A process is deemed to have exceeded the limit if it was killed for writing past
+    it, or if it wrote more (where the limit cannot be enforced), or if it faulted after reaching
+    the limit.
+    """
+    if not is_windows() and proc.returncode == -signal.SIGXFSZ:
+        return True
+    output_size = os.fstat(stdout).st_size
+    return output_size > output_limit or (proc.returncode != 0 and output_size >= output_limit)
 
 
 def anal_process(
@@ -29,6 +359,8 @@ def anal_process(
     stdout=PIPE,
     stderr=PIPE,
     timeout=None,
+    memory_limit: int | None = None,
+    output_limit: int | None = None,
     **other_subprocess_args,
 ) -> ProcessResult:
     """
@@ -36,28 +368,77 @@ def anal_process(
 
     `id_string` is the user-friendly identifier of the process (e.g. "test generator", "user's solution", ...).
 
+    `timeout` (in seconds) limits the CPU time of the process if it can be measured, and its
+    wall time otherwise (see `WALL_TIMEOUT_FACTOR`). `memory_limit` (in bytes) is enforced by the
+    current sandbox (see `memory_exceeded()`). `output_limit` (in bytes) limits the size of
+    `stdout`, which must then be a file descriptor (see `output_exceeded()`); outside Windows,
+    the process is killed as soon as it writes past the limit.
+
     If the process timed out or exited with an error code and if `terminate_on_fault` is True,
     attempts to terminate the entire Python interpreter.
 
     Especially, if the process timed out and if `terminate_on_fault` is False, raise the pending `TimeoutExpired` error.
+    Likewise, raise `MemoryLimitExceeded` if the process used too much memory,
+    `OutputLimitExceeded` if it wrote too much output, and
+    `ProcessFailed` (a `CalledProcessError`) if it otherwise exited with an error code; all three
+    carry the `ProcessResult` of the process.
 
     Some `subprocess.run()`/`Popen()` arguments are set by default: `stdout`, `stderr`, `encoding`.
     """
 
     try:
-        start = time.perf_counter()
-        proc: CompletedProcess = run(
-            command,
-            stdout=stdout,
-            stderr=stderr,
-            timeout=timeout,
-            **other_subprocess_args,
-            check=True
+        limits_cpu = timeout is not None and not is_windows()
+        executable = command if isinstance(command, (str, PathLike)) else command[0]
+        with tracer.span(os.path.basename(executable), "process", identity=identity):
+            proc, exec_time, usage, spawn_time = _engine.run(
+                command,
+                stdout=stdout,
+                stderr=stderr,
+                timeout=timeout * WALL_TIMEOUT_FACTOR if limits_cpu else timeout,
+                memory_limit=memory_limit,
+                output_limit=output_limit,
+                **other_subprocess_args,
+            )
+        if usage is None:
+            usage = ResourceUsage(exec_time, 0)
+        result = ProcessResult(
+            returncode=proc.returncode,
+            exec_time=exec_time,
+            stdout=proc.stdout,
+            cpu_time=usage.cpu_time,
+            peak_memory=usage.peak_memory,
+            spawn_time=spawn_time,
         )
-        end = time.perf_counter()
+
+        if output_limit is not None and output_exceeded(proc, stdout, output_limit):
+            raise OutputLimitExceeded(result, proc.args, proc.stderr)
+
+        if timeout is not None and usage.cpu_time > timeout * 1000:
+            raise TimeoutExpired(proc.args, timeout)
+        if memory_limit is not None and memory_exceeded(usage, memory_limit):
+            raise MemoryLimitExceeded(result, proc.args, proc.stderr)
+        if proc.returncode != 0:
+            raise ProcessFailed(result, proc.args, proc.stderr)
+    except MemoryLimitExceeded as mle_error:
+        if terminate_on_fault:
+            terminate_proc(
+                f"Fatal error: {identity} exceeded the memory limit of {memory_limit} bytes."
+            )
+        else:
+            raise mle_error
+    except OutputLimitExceeded as ole_error:
+        if terminate_on_fault:
+            terminate_proc(
+                f"Fatal error: {identity} exceeded the output limit of {output_limit} bytes."
+            )
+        else:
+            raise ole_error
     except CalledProcessError as proc_error:
         if terminate_on_fault:
-            terminate_proc(f"Fatal error: {identity} exited with code {proc.returncode}.\nError message: {proc.stderr.decode()}")
+            terminate_proc(
+                f"Fatal error: {identity} exited with code {proc_error.returncode}.\n"
+                + f"Error message: {(proc_error.stderr or b'').decode()}"
+            )
         else:
             raise proc_error
     except TimeoutExpired as timeout_error:
@@ -65,10 +446,5 @@ def anal_process(
             terminate_proc(f"Fatal error: {identity} timed out after {timeout} seconds.")
         else:
             raise timeout_error
-        
 
-    return ProcessResult(
-        returncode=proc.returncode,
-        exec_time=(end - start) * 1000,
-        stdout=proc.stdout,
-    )
+    return result
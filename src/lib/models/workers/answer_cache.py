@@ -0,0 +1,111 @@
+"""
+On-disk cache of the judge's answers.
+"""
+
+import json
+import os
+from threading import get_ident
+from hashlib import file_digest
+from pathlib import Path
+
+from .anal_process import ProcessResult
+from lib.utils.system import delete_file
+
+PRUNE_FRACTION = 1 / 16
+"""
+Each process prunes the cache whenever it has written this fraction of the cache's `max_size`
+since it last did.
+"""
+
+
+class AnswerCache:
+    """
+    Content-addressed cache mapping `(judge executable, input)` to the judge's answer and
+    resource usage, so that the judge is not run again on an input it has already seen
+    (e.g. generators with small ranges, or replays of stored tests).
+
+    Entries are files named after the SHA256 of the judge executable and of the input. Each
+    file starts with a JSON line holding the judge's times and memory, followed by the answer.
+    Hits refresh the modification time of the entry, so that `prune()` evicts entries in least
+    recently used order.
+
+    The cache is pruned when created, and by `put()` as entries are written (see
+    `PRUNE_FRACTION`), so that several processes sharing it keep it within `max_size` plus
+    `PRUNE_FRACTION * max_size` per process.
+    """
+
+    def __init__(self, cache_dir: Path, judge: Path, max_size: int):
+        """
+        `judge` is the judge's executable, and `max_size` (in bytes) the size above which
+        `prune()` evicts entries.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.written = 0  # bytes written by this process since it last pruned
+        with open(judge, "rb") as judge_binary:
+            self.judge_digest = file_digest(judge_binary, "sha256").hexdigest()
+        self.prune()
+
+    def entry_path(self, input_digest: str) -> Path:
+        return self.cache_dir / f"{self.judge_digest[:32]}-{input_digest[:32]}.ans"
+
+    def get(self, input_digest: str) -> ProcessResult | None:
+        """Returns the judge's result on the input with SHA256 `input_digest`, if cached."""
+        entry = self.entry_path(input_digest)
+        try:
+            with open(entry, "rb") as entry_file:
+                metadata = json.loads(entry_file.readline())
+                answer = entry_file.read()
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+
+        return ProcessResult(
+            returncode=0,
+            exec_time=metadata["exec_time"],
+            stdout=answer,
+            cpu_time=metadata["cpu_time"],
+            peak_memory=metadata["peak_memory"],
+        )
+
+    def put(self, input_digest: str, judge_proc: ProcessResult):
+        """Cache the judge's result on the input with SHA256 `input_digest`."""
+        entry = self.entry_path(input_digest)
+        metadata = {
+            "exec_time": judge_proc.exec_time,
+            "cpu_time": judge_proc.cpu_time,
+            "peak_memory": judge_proc.peak_memory,
+        }
+        # write then rename, so that concurrent readers never see a partial entry
+        header = json.dumps(metadata).encode() + b"\n"
+        temp_entry = entry.with_name(f"{entry.name}.{os.getpid()}-{get_ident()}.tmp")
+        try:
+            with open(temp_entry, "wb") as entry_file:
+                entry_file.write(header)
+                entry_file.write(judge_proc.stdout)
+            os.replace(temp_entry, entry)
+        except OSError:
+            delete_file(temp_entry)
+            return
+
+        self.written += len(header) + len(judge_proc.stdout)
+        if self.written > self.max_size * PRUNE_FRACTION:
+            self.prune()
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits in `max_size` bytes."""
+        self.written = 0
+        entries = []
+        for entry in self.cache_dir.glob("*.ans"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total_size = sum(size for _, size, __ in entries)
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            delete_file(entry)
+            total_size -= size
@@ -0,0 +1,214 @@
+"""
+Execution engine driving child processes from a single asyncio event loop.
+"""
+
+import asyncio
+import os
+import time
+from os import PathLike
+from subprocess import PIPE, CompletedProcess, Popen, TimeoutExpired
+from threading import Thread
+
+from lib.utils.system import is_windows
+
+from .anal_process import current_sandbox
+from .spawn_server import spawn_with_pipes
+
+
+class AsyncEngine:
+    """
+    Runs child processes on one asyncio event loop (living in a background thread), using
+    non-blocking pipes and per-process timeouts.
+
+    Any number of threads may call `run()` concurrently, but at most `max_processes` children
+    are alive at any time. Concurrency is thus bounded by the CPU budget instead of by the number
+    of Python interpreters waiting on their children.
+
+    On Linux, children are watched through a pidfd and reaped with `wait4()`, so that their
+    resource usage is available. No `preexec_fn` is run in them (which is unsafe next to the
+    event loop's thread): the sandbox's limits are applied to their pid right after they are
+    spawned (see `RlimitSandbox`). Elsewhere they are run with
+    `asyncio.create_subprocess_exec()`, and the limits are set by a `preexec_fn`. If the sandbox
+    has a spawn server, children are spawned by it instead, which sets the limits before they
+    start, and the event loop waits for the server to report their exit.
+
+    Usage:
+    ```
+    with AsyncEngine(max_processes=8) as engine:
+        set_engine(engine)  # see anal_process.py
+        ...
+    ```
+    """
+
+    def __init__(self, max_processes: int):
+        self.max_processes = max_processes
+        self.watch_pids = hasattr(os, "pidfd_open")
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread: Thread | None = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.process_slots = asyncio.Semaphore(self.max_processes)
+        self.thread = Thread(target=self.loop.run_forever, name="asimon-async-engine", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    async def _read_pipe(self, pipe) -> bytes | None:
+        if pipe is None:
+            return None
+        reader = asyncio.StreamReader()
+        await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return await reader.read()
+
+    async def _write_pipe(self, pipe, input: bytes | None):
+        if pipe is None:
+            return
+        transport, _ = await self.loop.connect_write_pipe(asyncio.Protocol, pipe)
+        transport.write(input)
+        transport.close()  # once the buffer is flushed, or the child stops reading
+
+    async def _run_watched(self, box, args, input, stdin, stdout, stderr, timeout):
+        """Run with a pidfd watching the child's exit. Returns `None` if pidfds are unavailable."""
+        proc = Popen(
+            args,
+            stdin=PIPE if input is not None else stdin,
+            stdout=stdout,
+            stderr=stderr,
+        )
+        spawned = time.perf_counter()
+        try:
+            box.limit(proc.pid)
+        except BaseException:
+            proc.kill()
+            proc.communicate()
+            raise
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except OSError:  # e.g. kernels older than 5.3
+            self.watch_pids = False
+            proc.kill()
+            proc.communicate()
+            return None
+
+        exited = self.loop.create_future()
+        self.loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            io = asyncio.gather(
+                self._write_pipe(proc.stdin, input),
+                self._read_pipe(proc.stdout),
+                self._read_pipe(proc.stderr),
+                asyncio.shield(exited),
+            )
+            try:
+                _, out, err, _ = await asyncio.wait_for(io, timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await exited
+                raise TimeoutExpired(args, timeout)
+        finally:
+            if not exited.done():  # e.g. cancelled
+                proc.kill()
+            self.loop.remove_reader(pidfd)
+            os.close(pidfd)
+            _, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+
+        return CompletedProcess(args, proc.returncode, out, err), box.usage(rusage), spawned
+
+    async def _run_served(self, box, args, input, stdin, stdout, stderr, timeout):
+        process, pipes = spawn_with_pipes(
+            box, args, PIPE if input is not None else stdin, stdout, stderr
+        )
+        spawned = time.perf_counter()
+        stdin_pipe, stdout_pipe, stderr_pipe = [
+            os.fdopen(pipe, "rb" if fd else "wb", buffering=0) if pipe is not None else None
+            for fd, pipe in enumerate(pipes)
+        ]
+        exited = asyncio.wrap_future(process.exited, loop=self.loop)
+        try:
+            io = asyncio.gather(
+                self._write_pipe(stdin_pipe, input),
+                self._read_pipe(stdout_pipe),
+                self._read_pipe(stderr_pipe),
+                asyncio.shield(exited),
+            )
+            try:
+                _, out, err, _ = await asyncio.wait_for(io, timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await exited
+                raise TimeoutExpired(args, timeout)
+        finally:
+            if not exited.done():  # e.g. cancelled
+                process.kill()
+            status, rusage = await exited
+
+        proc = CompletedProcess(args, os.waitstatus_to_exitcode(status), out, err)
+        return proc, box.usage(rusage), spawned
+
+    async def _run_plain(self, box, args, input, stdin, stdout, stderr, timeout):
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=PIPE if input is not None else stdin,
+            stdout=stdout,
+            stderr=stderr,
+            preexec_fn=None if is_windows() else box.limit,
+        )
+        spawned = time.perf_counter()
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(input), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise TimeoutExpired(args, timeout)
+        return CompletedProcess(args, proc.returncode, out, err), box.usage(None), spawned
+
+    async def _run(self, memory_limit: int | None, output_limit: int | None, *run_args):
+        async with self.process_slots:
+            with current_sandbox().run(memory_limit, output_limit) as box:
+                start = time.perf_counter()
+                result = None
+                if box.server is not None:
+                    result = await self._run_served(box, *run_args)
+                elif self.watch_pids:
+                    result = await self._run_watched(box, *run_args)
+                if result is None:
+                    result = await self._run_plain(box, *run_args)
+                end = time.perf_counter()
+
+        proc, usage, spawned = result
+        return proc, (end - start) * 1000, usage, (spawned - start) * 1000
+
+    def run(
+        self,
+        command: str | PathLike | list,
+        input: bytes | None = None,
+        stdin=None,
+        stdout=PIPE,
+        stderr=PIPE,
+        timeout: float | None = None,
+        memory_limit: int | None = None,
+        output_limit: int | None = None,
+    ):
+        """
+        Run `command` on the event loop and block the calling thread until it completes.
+
+        Arguments and return value are the same as those of `SubprocessEngine.run()`. The
+        execution time does not count the time spent waiting for a free process slot.
+        """
+        args = [command] if isinstance(command, (str, PathLike)) else list(command)
+        return asyncio.run_coroutine_threadsafe(
+            self._run(memory_limit, output_limit, args, input, stdin, stdout, stderr, timeout),
+            self.loop,
+        ).result()
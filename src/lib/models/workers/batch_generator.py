@@ -0,0 +1,174 @@
+"""
+Long-running test generators, fed a stream of seeds.
+"""
+
+import random
+from os import PathLike
+from pathlib import Path
+from queue import Queue, Empty
+from select import select
+from subprocess import run, Popen, PIPE, DEVNULL, SubprocessError
+from threading import Lock, Thread
+
+from lib.utils.system import terminate_proc, is_windows
+
+from .anal_process import WALL_TIMEOUT_FACTOR
+
+BATCH_HANDSHAKE = b"ASIMON-BATCH 1\n"
+"""First line written by a generator started in batch mode (see `BatchGenerator`)."""
+
+BATCH_LOOKAHEAD = 2
+"""
+Number of tests requested from a generator running in batch mode ahead of those being waited for,
+so that it generates them while the solutions run on the previous ones.
+"""
+
+
+class GeneratorServer:
+    """
+    A generator running in batch mode, with a thread reading its framed replies into a queue,
+    so that replies can be waited for with a timeout.
+    """
+
+    def __init__(self, command: list):
+        self.proc = Popen(command + ["--_asimon_batch"], stdin=PIPE, stdout=PIPE)
+        self.replies: Queue[tuple[int, bytes] | None] = Queue()
+        self.requested = 0  # requests not yet replied to (or whose reply was not taken)
+
+    def handshake(self, timeout: float) -> bool:
+        ready, _, __ = select([self.proc.stdout], [], [], timeout)
+        if not ready or self.proc.stdout.readline() != BATCH_HANDSHAKE:
+            self.proc.kill()
+            self.proc.communicate()
+            return False
+        Thread(target=self.read_replies, daemon=True).start()
+        return True
+
+    def read_replies(self):
+        try:
+            while header := self.proc.stdout.readline():
+                returncode, size = map(int, header.split())
+                self.replies.put((returncode, self.proc.stdout.read(size)))
+        except (OSError, ValueError):
+            pass
+        self.replies.put(None)  # the generator exited
+
+    def request(self, args: list[str]):
+        self.proc.stdin.write(b"%d\n" % len(args))
+        for arg in args:
+            self.proc.stdin.write(f"{arg}\n".encode())
+        self.proc.stdin.flush()
+        self.requested += 1
+
+    def close(self):
+        """Stop the generator, discarding the tests generated ahead."""
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class BatchGenerator:
+    """
+    Runs the test generator `command` once per worker in batch mode instead of once per test.
+
+    Each test is requested by writing to the generator's `stdin` the number of arguments it would
+    have been run with in addition to `command`, then these arguments, one per line (e.g. `1`
+    and `--seed 42`). The generator replies on `stdout` with a header line `code N` followed by
+    the `N` bytes of the test, `code` being the exit code it would have had when run on its own.
+
+    The ASIMON-testlib compatibility layer implements this by forking a fresh copy of the
+    generator for each test, with exactly the arguments it would have been run with, so that
+    the test generated for each seed is the same as in normal mode.
+
+    Seeds are drawn here rather than by the caller, so that requests can be pipelined: each
+    generator is kept `BATCH_LOOKAHEAD` tests ahead, and replies are read as they arrive.
+    """
+
+    def __init__(self, command: list[str | PathLike], timeout: float = 5):
+        self.command = [str(arg) for arg in command]
+        self.timeout = timeout
+
+    @staticmethod
+    def supported(command: list[str | PathLike], timeout: float = 5) -> bool:
+        """
+        Whether the generator supports batch mode, i.e. whether it writes `ASIMON` followed by
+        `batch` on a single line of `stdout` when run with the `--_asimon_capabilities` argument.
+        """
+        if is_windows():
+            return False
+        try:
+            proc = run(
+                [str(arg) for arg in command] + ["--_asimon_capabilities"],
+                stdin=DEVNULL,
+                stdout=PIPE,
+                stderr=DEVNULL,
+                timeout=timeout,
+            )
+        except (OSError, SubprocessError):
+            return False
+        words = proc.stdout.decode(errors="replace").split()
+        return words[:1] == ["ASIMON"] and "batch" in words
+
+    def __getstate__(self):
+        # running generators belong to the current Python process
+        state = self.__dict__.copy()
+        state.pop("_idle_servers", None)
+        state.pop("_servers_lock", None)
+        state.pop("_seeds", None)
+        return state
+
+    def __call__(self, testgen_command: list[str | PathLike]) -> bytes:
+        """
+        Generate a test as `testgen_command` (which must be `command`) would with a random
+        `--seed X` argument, and return it. Terminates the Python interpreter if the generator
+        fails.
+        """
+        if [str(arg) for arg in testgen_command] != self.command:
+            terminate_proc("Internal critical error: unexpected test generator command.")
+
+        server = self.acquire_server()
+        while server.requested <= BATCH_LOOKAHEAD:  # the test waited for, and those ahead
+            server.request([f"--seed {self._seeds.getrandbits(31)}"])
+        try:
+            reply = server.replies.get(timeout=self.timeout * WALL_TIMEOUT_FACTOR)
+        except Empty:
+            terminate_proc(f"Fatal error: test generator timed out after {self.timeout} seconds.")
+        server.requested -= 1
+        if reply is None:
+            terminate_proc("Fatal error: test generator exited in batch mode.")
+
+        returncode, test = reply
+        if returncode != 0:
+            terminate_proc(f"Fatal error: test generator exited with code {returncode}.")
+        self.release_server(server)
+        return test
+
+    def acquire_server(self) -> GeneratorServer:
+        """Take an idle generator running in batch mode, or start one."""
+        if "_servers_lock" not in self.__dict__:
+            self._idle_servers: list[GeneratorServer] = []
+            self._servers_lock = Lock()
+            self._seeds = random.Random()  # seeded per process, unlike a pickled one
+        with self._servers_lock:
+            if self._idle_servers:
+                return self._idle_servers.pop()
+
+        server = GeneratorServer(self.command)
+        if not server.handshake(self.timeout):
+            terminate_proc(
+                f"Fatal error: test generator {Path(self.command[0]).name} "
+                + "failed to start in batch mode."
+            )
+        return server
+
+    def release_server(self, server: GeneratorServer):
+        with self._servers_lock:
+            self._idle_servers.append(server)
+
+    def close(self):
+        """Stop the generators running in batch mode, which exit once their `stdin` is closed."""
+        if "_servers_lock" not in self.__dict__:
+            return
+        with self._servers_lock:
+            servers, self._idle_servers = self._idle_servers, []
+        for server in servers:
+            server.close()
@@ -0,0 +1,251 @@
+"""
+Linux cgroup v2 sandbox: isolation and accounting of each process in its own cgroup.
+"""
+
+import os
+from itertools import count
+from pathlib import Path
+from queue import Queue, Empty
+
+from .anal_process import ResourceUsage, RlimitSandbox, usage_of
+from .spawn_server import SpawnServer, ServedProcess
+
+
+def _cgroup2_mount() -> Path | None:
+    try:
+        with open("/proc/self/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if fields[2] == "cgroup2":
+                    return Path(fields[1])
+    except OSError:
+        pass
+    return None
+
+
+def _own_cgroup(mount: Path) -> Path | None:
+    try:
+        with open("/proc/self/cgroup") as cgroups:
+            for line in cgroups:
+                if line.startswith("0::"):
+                    return mount / line.strip()[3:].lstrip("/")
+    except OSError:
+        pass
+    return None
+
+
+def _write(path: Path, content: str):
+    with open(path, "w") as file:
+        file.write(content)
+
+
+def _rmdir(path: Path):
+    try:
+        path.rmdir()
+    except OSError:  # e.g. a process is still alive in it
+        pass
+
+
+def _read_keyed(path: Path) -> dict[str, int]:
+    """Read a flat keyed cgroup file (e.g. `cpu.stat`, `memory.events`)."""
+    with open(path) as file:
+        return {key: int(value) for key, value in (line.split() for line in file)}
+
+
+class CgroupSandbox:
+    """
+    Runs each process in a fresh cgroup below a delegated cgroup v2 subtree, pinned to a CPU of
+    its own (cpuset), with `memory.max` as memory limit and without swap. Output limits are
+    enforced with `setrlimit()`, as in `RlimitSandbox`.
+
+    CPU time is read from `cpu.stat`, peak memory from `memory.peak` and memory limit violations
+    from the `oom_kill` counter of `memory.events`. Unlike `wait4()`, these do not account the
+    memory of the spawning Python process.
+
+    As with `RlimitSandbox`, processes are spawned by the `spawn_server` if one is given; the
+    process then moves itself into its cgroup before it `exec()`s its program.
+
+    Create with `CgroupSandbox.create()`, which returns `None` if delegation is unavailable.
+    Instances can be pickled to worker processes; use `partition()` so that each worker process
+    pins its children to a different set of CPUs.
+    """
+
+    def __init__(
+        self, root: Path, cpus: list[int], pin_cpus: bool, spawn_server: Path | None = None
+    ):
+        self.root = root
+        self.cpus = cpus
+        self.pin_cpus = pin_cpus
+        self.spawn_server = spawn_server
+        self.origin: tuple[Path, Path, list[str]] | None = None  # see create(), main process only
+        self._free_cpus: Queue | None = None
+        self._run_ids = count()
+
+    def __getstate__(self):
+        return {
+            "root": self.root,
+            "cpus": self.cpus,
+            "pin_cpus": self.pin_cpus,
+            "spawn_server": self.spawn_server,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @classmethod
+    def create(
+        cls, cpu_count: int, spawn_server: Path | None = None
+    ) -> tuple["CgroupSandbox | None", str]:
+        """
+        Set up a cgroup subtree for the runs, using at most `cpu_count` CPUs, whose processes
+        are spawned by `spawn_server` if given.
+
+        This requires the current process to own a delegated cgroup containing no other process
+        (e.g. `systemd-run --user --scope -p Delegate=yes python stress.py`): the current process
+        is moved into a leaf cgroup, so that the memory and cpuset controllers can be enabled for
+        the subtree holding the runs.
+
+        Returns `(sandbox, "")` on success and `(None, reason)` otherwise.
+        """
+        mount = _cgroup2_mount()
+        if mount is None:
+            return None, "no cgroup v2 hierarchy is mounted"
+        base = _own_cgroup(mount)
+        if base is None or not os.access(base, os.W_OK):
+            return None, "the cgroup of this process is not delegated to the current user"
+
+        controllers = (base / "cgroup.controllers").read_text().split()
+        if "memory" not in controllers:
+            return None, "the memory controller is not available"
+        enabled = ["memory"] + (["cpuset"] if "cpuset" in controllers else [])
+        subtree_control = " ".join(f"+{controller}" for controller in enabled)
+        already_enabled = (base / "cgroup.subtree_control").read_text().split()
+        added = [controller for controller in enabled if controller not in already_enabled]
+
+        leaf = base / f"asimon-main-{os.getpid()}"
+        root = base / f"asimon-runs-{os.getpid()}"
+        cpus = sorted(os.sched_getaffinity(0))[:cpu_count]
+        sandbox = cls(root, cpus, "cpuset" in enabled, spawn_server)
+        sandbox.origin = (base, leaf, added)
+        try:
+            leaf.mkdir(exist_ok=True)
+            _write(leaf / "cgroup.procs", "0")
+            _write(base / "cgroup.subtree_control", subtree_control)
+            root.mkdir(exist_ok=True)
+            _write(root / "cgroup.subtree_control", subtree_control)
+        except OSError as error:
+            sandbox.cleanup()
+            return None, f"cannot set up the cgroup subtree ({error.strerror})"
+        return sandbox, ""
+
+    def partition(self, index: int, parts: int) -> "CgroupSandbox":
+        """Returns a sandbox pinning processes to the `index`-th of `parts` disjoint CPU sets."""
+        size = max(1, len(self.cpus) // parts)
+        first = index * size % len(self.cpus)
+        cpus = self.cpus[first : first + size]
+        return CgroupSandbox(self.root, cpus, self.pin_cpus, self.spawn_server)
+
+    def cleanup(self):
+        """
+        Remove the cgroups of the runs, then move the current process back to its own cgroup and
+        remove the leaf `create()` moved it into. The worker processes, which are in that leaf
+        too, must have exited.
+        """
+        for run in self.root.glob("run-*"):  # e.g. a grandchild was alive when the run ended
+            _rmdir(run)
+        _rmdir(self.root)
+        if self.origin is None:
+            return
+        base, leaf, added = self.origin
+        try:
+            # processes can only be moved back once no controller is enabled for the subtree
+            if added:
+                _write(base / "cgroup.subtree_control", " ".join(f"-{name}" for name in added))
+            _write(base / "cgroup.procs", "0")
+        except OSError:
+            return
+        _rmdir(leaf)
+
+    def acquire_cpu(self) -> int | None:
+        """Take a CPU no other process of this sandbox runs on, or `None` if all are taken."""
+        if self._free_cpus is None:
+            self._free_cpus = Queue()
+            for cpu in self.cpus:
+                self._free_cpus.put(cpu)
+        try:
+            return self._free_cpus.get_nowait()
+        except Empty:
+            return None
+
+    def release_cpu(self, cpu: int | None):
+        if cpu is not None:
+            self._free_cpus.put(cpu)
+
+    class Run:
+        def __init__(
+            self, sandbox: "CgroupSandbox", memory_limit: int | None, output_limit: int | None
+        ):
+            self.sandbox = sandbox
+            self.memory_limit = memory_limit
+            self.output_limit = output_limit
+            self.path = sandbox.root / f"run-{os.getpid()}-{next(sandbox._run_ids)}"
+            self.server = None
+            if sandbox.spawn_server is not None:
+                self.server = SpawnServer.get(sandbox.spawn_server)
+
+        def __enter__(self):
+            self.path.mkdir()
+            self.cpu = self.sandbox.acquire_cpu()
+            try:
+                if self.memory_limit is not None:
+                    _write(self.path / "memory.max", str(self.memory_limit))
+                if (self.path / "memory.swap.max").exists():
+                    _write(self.path / "memory.swap.max", "0")
+                if self.sandbox.pin_cpus:
+                    # when all CPUs are taken, share all of them rather than wait
+                    cpus = [self.cpu] if self.cpu is not None else self.sandbox.cpus
+                    _write(self.path / "cpuset.cpus", ",".join(map(str, cpus)))
+            except BaseException:
+                self.__exit__()
+                raise
+            return self
+
+        def limit(self, pid: int = 0):
+            """
+            Move the process `pid` (or the calling process, if 0) into the cgroup, and cap the
+            size of its output as `RlimitSandbox` does. A process which already exited is left
+            alone.
+            """
+            try:
+                _write(self.path / "cgroup.procs", str(pid))
+            except ProcessLookupError:
+                return
+            RlimitSandbox.Run(None, self.output_limit).limit(pid)
+
+        def spawn(self, args: list, fds: list[int]) -> ServedProcess:
+            """Spawn `args` through the `server`, with `fds` as its standard streams."""
+            return self.server.spawn(
+                args, fds, file_size=self.output_limit, cgroup_procs=self.path / "cgroup.procs"
+            )
+
+        def usage(self, rusage) -> ResourceUsage:
+            cpu_stat = _read_keyed(self.path / "cpu.stat")
+            peak_memory_path = self.path / "memory.peak"  # Linux 5.19+
+            if peak_memory_path.exists():
+                peak_memory = int(peak_memory_path.read_text()) // 1024
+            else:
+                spawned_here = self.server is None
+                peak_memory = usage_of(rusage, spawned_here).peak_memory if rusage else 0
+            memory_events = _read_keyed(self.path / "memory.events")
+            return ResourceUsage(
+                cpu_time=cpu_stat["usage_usec"] / 1000,
+                peak_memory=peak_memory,
+                memory_exceeded=memory_events.get("oom_kill", 0) > 0,
+            )
+
+        def __exit__(self, *_):
+            self.sandbox.release_cpu(self.cpu)
+            _rmdir(self.path)  # fails if a grandchild is still alive, see cleanup()
+
+    def run(self, memory_limit: int | None, output_limit: int | None = None) -> Run:
+        return self.Run(self, memory_limit, output_limit)
@@ -0,0 +1,159 @@
+"""
+Execution engine starting child processes with `posix_spawn()`.
+"""
+
+import os
+import signal
+import time
+from contextlib import ExitStack
+from os import PathLike
+from select import select
+from subprocess import PIPE, DEVNULL, CompletedProcess, TimeoutExpired
+
+from lib.utils.memfile import MemFile
+
+from .anal_process import current_sandbox
+from .spawn_server import ServedProcess, spawn_with_pipes
+
+RESTORED_SIGNALS = [
+    getattr(signal, name) for name in ["SIGPIPE", "SIGXFZ", "SIGXFSZ"] if hasattr(signal, name)
+]
+"""Signals ignored by Python, reset to their default action in children (as `Popen` does)."""
+
+
+class SpawnEngine:
+    """
+    Runs each process with `os.posix_spawnp()`, blocking the calling thread until it completes.
+
+    `posix_spawn()` starts the child without copying the page tables of the Python process, its
+    standard streams being set up by file actions. `stdout` and `stderr` are captured through
+    in-memory files rather than pipes, and `input` is given the same way, which spares the
+    threads `Popen.communicate()` needs. The child is watched through a pidfd, and reaped with
+    `wait4()` for its resource usage.
+
+    Since `posix_spawn()` runs no code in the child, the sandbox's limits are applied to the
+    child's pid right after it is spawned (see `RlimitSandbox`): with `prlimit()` and by moving
+    it into its cgroup, without any intermediate shell. The program may thus start before its
+    limits apply. If the sandbox has a spawn server, the child is spawned by it instead (with
+    the same file descriptors), which sets the limits before the program starts; it is then
+    watched through the server.
+
+    Linux only, see `supported()`.
+    """
+
+    @staticmethod
+    def supported() -> bool:
+        return hasattr(os, "posix_spawnp") and hasattr(os, "pidfd_open")
+
+    def run(
+        self,
+        command: str | PathLike | list,
+        input: bytes | None = None,
+        stdin=None,
+        stdout=PIPE,
+        stderr=PIPE,
+        timeout: float | None = None,
+        memory_limit: int | None = None,
+        output_limit: int | None = None,
+    ):
+        """
+        Run `command` in the current sandbox. Arguments and return value are the same as those
+        of `SubprocessEngine.run()`.
+        """
+        args = [command] if isinstance(command, (str, PathLike)) else list(command)
+        with current_sandbox().run(memory_limit, output_limit) as box:
+            with ExitStack() as stack:
+
+                def capture(stream, name: str):
+                    if stream == PIPE:
+                        return stack.enter_context(MemFile(name))
+                    if stream == DEVNULL:
+                        return stack.enter_context(open(os.devnull, "r+b"))
+                    return stream
+
+                if input is not None:
+                    stdin = stack.enter_context(MemFile("stdin"))
+                    stdin.write(input)
+                    stdin = stack.enter_context(stdin.reader())
+                stdin = capture(stdin, "stdin")
+                stdout = capture(stdout, "stdout")
+                stderr = capture(stderr, "stderr")
+
+                file_actions = [
+                    (
+                        os.POSIX_SPAWN_DUP2,
+                        stream if isinstance(stream, int) else stream.fileno(),
+                        fd,
+                    )
+                    for fd, stream in enumerate([stdin, stdout, stderr])
+                    if stream is not None
+                ]
+                argv = [os.fspath(arg) for arg in args]
+
+                start = time.perf_counter()
+                if box.server is not None:
+                    process, _ = spawn_with_pipes(box, argv, stdin, stdout, stderr)
+                    spawned = time.perf_counter()
+                    reaped = self.wait_served(process, timeout)
+                else:
+                    pid = os.posix_spawnp(
+                        argv[0],
+                        argv,
+                        os.environ,
+                        file_actions=file_actions,
+                        setsigdef=RESTORED_SIGNALS,
+                    )
+                    spawned = time.perf_counter()
+                    try:
+                        box.limit(pid)
+                    except BaseException:
+                        os.kill(pid, signal.SIGKILL)
+                        os.wait4(pid, 0)
+                        raise
+                    reaped = self.wait(pid, timeout)
+                end = time.perf_counter()
+                if reaped is None:
+                    raise TimeoutExpired(args, timeout)
+                status, rusage = reaped
+
+                out = stdout.contents() if isinstance(stdout, MemFile) else None
+                err = stderr.contents() if isinstance(stderr, MemFile) else None
+            usage = box.usage(rusage)
+
+        proc = CompletedProcess(args, os.waitstatus_to_exitcode(status), out, err)
+        return proc, (end - start) * 1000, usage, (spawned - start) * 1000
+
+    @staticmethod
+    def wait(pid: int, timeout: float | None):
+        """
+        Reap the child `pid`. Returns its wait status and resource usage, or `None` if it ran for
+        more than `timeout` seconds (it is then killed).
+        """
+        try:
+            pidfd = os.pidfd_open(pid)
+            try:
+                exited = bool(select([pidfd], [], [], timeout)[0])
+            finally:
+                os.close(pidfd)
+        except BaseException:
+            os.kill(pid, signal.SIGKILL)
+            os.wait4(pid, 0)
+            raise
+
+        if not exited:
+            os.kill(pid, signal.SIGKILL)
+        _, status, rusage = os.wait4(pid, 0)
+        return (status, rusage) if exited else None
+
+    @staticmethod
+    def wait_served(process: ServedProcess, timeout: float | None):
+        """Same as `wait()`, for a process spawned by a spawn server."""
+        try:
+            return process.exited.result(timeout)
+        except TimeoutError:
+            process.kill()
+            process.exited.result()
+            return None
+        except BaseException:
+            process.kill()
+            raise
@@ -0,0 +1,227 @@
+// Spawn server of ASIMON's workers (see spawn_server.py). Linux only.
+//
+// The Python client talks to the server through a SOCK_SEQPACKET socket, given as its stdin.
+// Fields of messages are separated by '\0' (requests) or spaces (replies):
+//   - "S id address_space file_size cgroup_procs argv..." with 3 file descriptors attached,
+//     spawns `argv` with them as its stdin, stdout and stderr. Limits are in bytes ("-" for no
+//     limit) and applied with setrlimit(), and the child moves itself into the cgroup whose
+//     `cgroup.procs` is given (if not empty), all before it exec()s.
+//     Replies "S id pid" once the program is exec()ed, or "F id errno" if it could not be.
+//   - "K id" kills the child `id`, if it is still alive.
+// Once a child exits, the server replies "X id wait_status utime_us stime_us maxrss_kb".
+//
+// As the children are forked from this small process rather than from Python, their maximum
+// resident set size (which the kernel carries over from the process they are forked from) is
+// their own. The server kills its children and exits when the client closes the socket.
+
+#include <cerrno>
+#include <csignal>
+#include <cstdlib>
+#include <cstring>
+#include <map>
+#include <string>
+#include <vector>
+
+#include <fcntl.h>
+#include <poll.h>
+#include <sys/resource.h>
+#include <sys/signalfd.h>
+#include <sys/socket.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+static const int CLIENT = 0;
+static const size_t MAX_REQUEST = 1 << 16;
+
+static std::map<long long, pid_t> children;  // id -> pid, of children not reaped yet
+static std::map<pid_t, long long> child_ids;
+
+static void reply(const std::string &message) {
+    send(CLIENT, message.data(), message.size(), MSG_NOSIGNAL);
+}
+
+static void reply_failure(const std::string &id, int error) {
+    reply("F " + id + " " + std::to_string(error));
+}
+
+static long long microseconds(const timeval &time) {
+    return time.tv_sec * 1000000LL + time.tv_usec;
+}
+
+// Runs in the child: never returns.
+static void exec_child(const std::vector<std::string> &fields, const int *fds, int error_pipe) {
+    sigset_t signals;
+    sigemptyset(&signals);
+    sigprocmask(SIG_SETMASK, &signals, nullptr);
+    signal(SIGPIPE, SIG_DFL);
+    signal(SIGXFSZ, SIG_DFL);
+
+    for (int fd = 0; fd < 3; fd++) {
+        if (dup2(fds[fd], fd) < 0) goto fail;
+    }
+    for (int field = 2; field <= 3; field++) {
+        if (fields[field] == "-") continue;
+        rlim_t value = strtoull(fields[field].c_str(), nullptr, 10);
+        rlimit limit = {value, value};
+        if (setrlimit(field == 2 ? RLIMIT_AS : RLIMIT_FSIZE, &limit) < 0) goto fail;
+    }
+    if (!fields[4].empty()) {
+        int procs = open(fields[4].c_str(), O_WRONLY | O_CLOEXEC);
+        if (procs < 0 || write(procs, "0", 1) != 1) goto fail;
+        close(procs);
+    }
+    {
+        std::vector<char *> argv;
+        for (size_t field = 5; field < fields.size(); field++) {
+            argv.push_back(const_cast<char *>(fields[field].c_str()));
+        }
+        argv.push_back(nullptr);
+        execvp(argv[0], argv.data());
+    }
+fail:
+    int error = errno;
+    ssize_t written = write(error_pipe, &error, sizeof error);
+    (void)written;
+    _exit(127);
+}
+
+static void spawn(const std::vector<std::string> &fields, const int *fds, int fd_count) {
+    const std::string &id = fields[1];
+    if (fields.size() < 6 || fd_count != 3) {
+        reply_failure(id, EINVAL);
+        return;
+    }
+    int error_pipe[2];
+    if (pipe2(error_pipe, O_CLOEXEC) < 0) {
+        reply_failure(id, errno);
+        return;
+    }
+    pid_t pid = fork();
+    if (pid == 0) exec_child(fields, fds, error_pipe[1]);
+    int fork_error = errno;
+    close(error_pipe[1]);
+    if (pid < 0) {
+        close(error_pipe[0]);
+        reply_failure(id, fork_error);
+        return;
+    }
+
+    // the pipe is closed without being written to once the child exec()s its program
+    int error;
+    ssize_t size;
+    do {
+        size = read(error_pipe[0], &error, sizeof error);
+    } while (size < 0 && errno == EINTR);
+    close(error_pipe[0]);
+    if (size == sizeof error) {
+        waitpid(pid, nullptr, 0);
+        reply_failure(id, error);
+        return;
+    }
+    children[atoll(id.c_str())] = pid;
+    child_ids[pid] = atoll(id.c_str());
+    reply("S " + id + " " + std::to_string(pid));
+}
+
+static void kill_child(const std::vector<std::string> &fields) {
+    if (fields.size() < 2) return;
+    auto child = children.find(atoll(fields[1].c_str()));
+    if (child != children.end()) kill(child->second, SIGKILL);
+}
+
+static void reap_children() {
+    int status;
+    rusage usage;
+    pid_t pid;
+    while ((pid = wait4(-1, &status, WNOHANG, &usage)) > 0) {
+        auto child = child_ids.find(pid);
+        if (child == child_ids.end()) continue;
+        reply("X " + std::to_string(child->second) + " " + std::to_string(status) + " " +
+              std::to_string(microseconds(usage.ru_utime)) + " " +
+              std::to_string(microseconds(usage.ru_stime)) + " " +
+              std::to_string(usage.ru_maxrss));
+        children.erase(child->second);
+        child_ids.erase(child);
+    }
+}
+
+// Returns false once the client is gone.
+static bool handle_request() {
+    static std::vector<char> buffer(MAX_REQUEST);
+    char control[CMSG_SPACE(3 * sizeof(int))];
+    iovec iov = {buffer.data(), buffer.size()};
+    msghdr message = {};
+    message.msg_iov = &iov;
+    message.msg_iovlen = 1;
+    message.msg_control = control;
+    message.msg_controllen = sizeof control;
+    ssize_t size = recvmsg(CLIENT, &message, MSG_CMSG_CLOEXEC);
+    if (size < 0) return errno == EINTR || errno == EAGAIN;
+    if (size == 0) return false;
+
+    int fds[3];
+    int fd_count = 0;
+    for (cmsghdr *header = CMSG_FIRSTHDR(&message); header != nullptr;
+         header = CMSG_NXTHDR(&message, header)) {
+        if (header->cmsg_level != SOL_SOCKET || header->cmsg_type != SCM_RIGHTS) continue;
+        int count = (header->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+        for (int i = 0; i < count; i++) {
+            int fd;
+            memcpy(&fd, CMSG_DATA(header) + i * sizeof(int), sizeof fd);
+            if (fd_count < 3) {
+                fds[fd_count++] = fd;
+            } else {
+                close(fd);
+            }
+        }
+    }
+
+    std::vector<std::string> fields;
+    const char *field = buffer.data();
+    const char *end = buffer.data() + size;
+    while (field < end) {
+        size_t length = strnlen(field, end - field);
+        fields.emplace_back(field, length);
+        field += length + 1;
+    }
+
+    if (message.msg_flags & MSG_TRUNC) {
+        if (fields.size() >= 2) reply_failure(fields[1], E2BIG);
+    } else if (fields.size() >= 2 && fields[0] == "S") {
+        spawn(fields, fds, fd_count);
+    } else if (fields.size() >= 2 && fields[0] == "K") {
+        kill_child(fields);
+    }
+    for (int i = 0; i < fd_count; i++) close(fds[i]);
+    return true;
+}
+
+int main() {
+    signal(SIGPIPE, SIG_IGN);
+    sigset_t child_signals;
+    sigemptyset(&child_signals);
+    sigaddset(&child_signals, SIGCHLD);
+    sigprocmask(SIG_BLOCK, &child_signals, nullptr);
+    int signal_fd = signalfd(-1, &child_signals, SFD_CLOEXEC | SFD_NONBLOCK);
+    if (signal_fd < 0) return 1;
+
+    pollfd polled[2] = {{CLIENT, POLLIN, 0}, {signal_fd, POLLIN, 0}};
+    for (;;) {
+        if (poll(polled, 2, -1) < 0) {
+            if (errno == EINTR) continue;
+            break;
+        }
+        if (polled[1].revents & POLLIN) {
+            signalfd_siginfo info;
+            while (read(signal_fd, &info, sizeof info) > 0) {
+            }
+            reap_children();
+        }
+        if (polled[0].revents & (POLLIN | POLLHUP | POLLERR)) {
+            if (!handle_request()) break;
+        }
+    }
+
+    for (auto &child : children) kill(child.second, SIGKILL);
+    return 0;
+}
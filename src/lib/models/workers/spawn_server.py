@@ -0,0 +1,256 @@
+"""
+Client of the spawn server (see `spawn_server.cpp`), which starts the processes of a Python process
+on its behalf.
+
+A child process inherits the peak memory of the process it is forked from: when it `exec()`s,
+the kernel carries the larger of its own maximum resident set size and that of the forking
+process over to the new program, and `wait4()` reports that maximum. Children forked from Python
+(whether with `fork()`, `vfork()` or `posix_spawn()`) are thus reported to use at least as much
+memory as the Python process. The spawn server is a small native process forking the children
+instead, so that their reported peak memory is their own (give or take the server's own, about a
+megabyte). It also sets their limits right before they `exec()` their program, without running
+Python code in the forked child.
+"""
+
+import os
+import select
+import selectors
+import socket
+import sys
+import time
+from concurrent.futures import Future
+from itertools import count
+from os import PathLike
+from pathlib import Path
+from subprocess import PIPE, DEVNULL, Popen
+from threading import Lock, Thread
+
+from lib.utils.system import is_windows
+
+if not is_windows():
+    import resource
+
+PIPE_BUF = getattr(select, "PIPE_BUF", 512)  # as in `subprocess`
+
+SOURCE = Path(__file__).with_suffix(".cpp")
+"""Source of the spawn server, to be compiled (e.g. with `CppCompiler`) before use."""
+
+
+class ServedProcess:
+    """
+    A process started by a `SpawnServer`. `started` is set to its pid once its program is
+    `exec()`ed (or to the `OSError` preventing it), and `exited` to its wait status and
+    `resource.struct_rusage` once it is reaped.
+    """
+
+    def __init__(self, server: "SpawnServer", id: int, executable: str):
+        self.server = server
+        self.id = id
+        self.executable = executable
+        self.started = Future()
+        self.exited = Future()
+
+    def kill(self):
+        """Kill the process with `SIGKILL`, if it is still alive."""
+        try:
+            self.server.send(b"K\0%d" % self.id)
+        except OSError:  # the server exited, killing its children
+            pass
+
+
+class SpawnServer:
+    """
+    A spawn server, started by the Python process using it (see `get()`). Any number of threads
+    may spawn processes through it concurrently (see `spawn()`).
+    """
+
+    @staticmethod
+    def supported() -> bool:
+        return sys.platform.startswith("linux") and hasattr(socket, "send_fds")
+
+    _servers: dict[str, "SpawnServer"] = {}
+    _servers_lock = Lock()
+
+    @classmethod
+    def get(cls, executable: str | PathLike) -> "SpawnServer":
+        """The spawn server of the current Python process, started on first use."""
+        key = os.fspath(executable)
+        with cls._servers_lock:
+            server = cls._servers.get(key)
+            if server is None or server.pid != os.getpid() or server.closed:
+                server = cls._servers[key] = cls(executable)
+        return server
+
+    def __init__(self, executable: str | PathLike):
+        self.pid = os.getpid()
+        self.closed = False
+        self.socket, server_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        with server_socket:
+            self.proc = Popen([executable], stdin=server_socket)
+        self._ids = count()
+        self._processes: dict[int, ServedProcess] = {}
+        self._lock = Lock()
+        Thread(target=self._receive, name="asimon-spawn-server", daemon=True).start()
+
+    def send(self, request: bytes, fds=()):
+        socket.send_fds(self.socket, [request], fds)
+
+    def spawn(
+        self,
+        args: list,
+        fds: list[int],
+        address_space: int | None = None,
+        file_size: int | None = None,
+        cgroup_procs: Path | None = None,
+    ) -> ServedProcess:
+        """
+        Spawn `args` with the file descriptors `fds` as its stdin, stdout and stderr, its
+        address space and the size of the files it writes capped to `address_space` and
+        `file_size` bytes, in the cgroup whose `cgroup.procs` file is `cgroup_procs`.
+        """
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("The spawn server exited.")
+            process = ServedProcess(self, next(self._ids), os.fspath(args[0]))
+            self._processes[process.id] = process
+        limits = [b"-" if limit is None else b"%d" % limit for limit in (address_space, file_size)]
+        fields = [b"S", b"%d" % process.id, *limits, os.fsencode(cgroup_procs or "")]
+        fields += [os.fsencode(arg) for arg in args]
+        try:
+            self.send(b"\0".join(fields), fds)
+        except OSError:
+            with self._lock:
+                del self._processes[process.id]
+            raise
+        return process
+
+    def _receive(self):
+        while True:
+            try:
+                reply = self.socket.recv(256)
+            except OSError:
+                reply = b""
+            if not reply:
+                break
+            kind, id, *values = reply.split()
+            with self._lock:
+                process = self._processes.get(int(id))
+                if kind != b"S":
+                    self._processes.pop(int(id), None)
+            if process is None:
+                continue
+            if kind == b"S":
+                process.started.set_result(int(values[0]))
+            elif kind == b"F":
+                error = int(values[0])
+                exception = OSError(error, os.strerror(error), process.executable)
+                process.started.set_exception(exception)
+            elif kind == b"X":
+                status, user_time, system_time, peak_memory = map(int, values)
+                rusage = resource.struct_rusage(
+                    (user_time / 1e6, system_time / 1e6, peak_memory) + (0,) * 13
+                )
+                process.exited.set_result((status, rusage))
+
+        self.proc.wait()
+        with self._lock:
+            self.closed = True
+            processes, self._processes = self._processes, {}
+        for process in processes.values():
+            for future in (process.started, process.exited):
+                if not future.done():
+                    future.set_exception(RuntimeError("The spawn server exited."))
+
+
+def spawn_with_pipes(box, args: list, stdin, stdout, stderr):
+    """
+    Spawn `args` through the spawn server of the sandbox context `box` (see `RlimitSandbox`),
+    with standard streams given as for `Popen` (`PIPE`, `DEVNULL`, `None`, a file descriptor or
+    a file object). Blocks until the program is `exec()`ed, and raises the `OSError` preventing
+    it, if any.
+
+    Returns the process and the current process's ends of the pipes to its stdin, stdout and
+    stderr (`None` for streams which are not pipes).
+    """
+    child_fds: list[int] = []
+    pipes: list[int | None] = []
+    owned_fds: list[int] = []  # the child's ends of the pipes, closed once sent to the server
+    try:
+        for fd, stream in enumerate([stdin, stdout, stderr]):
+            if stream == PIPE:
+                read_end, write_end = os.pipe()
+                pipe, child_fd = (write_end, read_end) if fd == 0 else (read_end, write_end)
+                pipes.append(pipe)
+                owned_fds.append(child_fd)
+            elif stream == DEVNULL:
+                pipes.append(None)
+                child_fd = os.open(os.devnull, os.O_RDWR)
+                owned_fds.append(child_fd)
+            else:
+                pipes.append(None)
+                if stream is None:
+                    child_fd = fd  # inherited, as with `Popen`
+                else:
+                    child_fd = stream if isinstance(stream, int) else stream.fileno()
+            child_fds.append(child_fd)
+
+        process = box.spawn(args, child_fds)
+        process.started.result()
+    except BaseException:
+        for pipe in pipes:
+            if pipe is not None:
+                os.close(pipe)
+        raise
+    finally:
+        for fd in owned_fds:
+            os.close(fd)
+    return process, pipes
+
+
+def communicate(pipes: list[int | None], input: bytes | None, deadline: float | None):
+    """
+    Same as `Popen.communicate()`, for the `pipes` returned by `spawn_with_pipes()`: `input` is
+    written to the stdin pipe, then the stdout and stderr pipes are read until they are closed.
+    Raises `TimeoutError` if this lasts past `deadline` (a `time.perf_counter()` value, or
+    `None`). The pipes are closed in any case.
+
+    Returns the contents of stdout and stderr (`None` for those which are not pipes).
+    """
+    stdin_pipe, *output_pipes = pipes
+    chunks = {pipe: [] for pipe in output_pipes if pipe is not None}
+    unsent = memoryview(input or b"")
+    try:
+        with selectors.DefaultSelector() as selector:
+            if stdin_pipe is not None and unsent:
+                selector.register(stdin_pipe, selectors.EVENT_WRITE)
+            elif stdin_pipe is not None:
+                os.close(stdin_pipe)
+                stdin_pipe = None
+            for pipe in chunks:
+                selector.register(pipe, selectors.EVENT_READ)
+
+            while selector.get_map():
+                timeout = None if deadline is None else deadline - time.perf_counter()
+                if timeout is not None and timeout <= 0:
+                    raise TimeoutError
+                for key, _ in selector.select(timeout):
+                    if key.fd == stdin_pipe:
+                        try:
+                            unsent = unsent[os.write(stdin_pipe, unsent[:PIPE_BUF]) :]
+                        except BrokenPipeError:  # the child does not read its input
+                            unsent = unsent[:0]
+                        if not unsent:
+                            selector.unregister(stdin_pipe)
+                            os.close(stdin_pipe)
+                            stdin_pipe = None
+                    else:
+                        data = os.read(key.fd, 32768)
+                        if data:
+                            chunks[key.fd].append(data)
+                        else:
+                            selector.unregister(key.fd)
+    finally:
+        for pipe in [stdin_pipe, *chunks]:
+            if pipe is not None:
+                os.close(pipe)
+    return tuple(b"".join(chunks[pipe]) if pipe is not None else None for pipe in output_pipes)
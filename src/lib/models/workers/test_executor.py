@@ -2,14 +2,36 @@
 Umbrella class for running tests.
 """
 
-from subprocess import TimeoutExpired, CalledProcessError
+import threading
+from subprocess import TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
 from pathlib import Path
+from typing import Callable
 from lib.models.checkers import CheckerResult, Checker, DISCOVERED_CHECKERS
 from lib.models.ces import ContestantExecutionStatus
 from lib.utils.system import terminate_proc
-from dataclasses import dataclass
+from lib.utils.hashing import digest
+from lib.utils.bloom_filter import BloomFilter
+from lib.utils.memfile import MemFile
+from lib.utils.numeric_aggregator import StreamingAggregate
+from lib.utils.tracing import tracer, enable_tracing
+from dataclasses import dataclass, field
 
-from .anal_process import anal_process
+from .anal_process import (
+    anal_process,
+    set_engine,
+    set_sandbox,
+    ProcessResult,
+    ProcessFailed,
+    MemoryLimitExceeded,
+    OutputLimitExceeded,
+)
+from .answer_cache import AnswerCache
+from .batch_generator import BatchGenerator
+from .test_packer import TestPacker
+
+PASSED_STATUSES = [ContestantExecutionStatus.AC, ContestantExecutionStatus.JUDGE]
 
 
 @dataclass
@@ -19,15 +41,48 @@ class ContestantExecutionResult:
         - `path`: Path to the contestant's solution' executable.
         - `status`: Status of the run (AC, WA, TLE, RTE, ...)
         - `exec_time`: Execution time of contestant's solution (à la executable) in miliseconds.
+        - `cpu_time`: User + system CPU time of contestant's solution in miliseconds.
+        - `peak_memory`: Maximum resident set size of contestant's solution in kilobytes.
+        - `spawn_time`: Time taken to start contestant's solution in miliseconds, 0 if unknown.
         - `comment`: Comment on contestant's output from checker.
-        - `output`: Contestant's output.
+        - `output`: Contestant's output. `None` if the payload was dropped (see `WorkerResult`).
+        - `output_digest`: SHA256 of the contestant's output.
+        - `verdict_memoized`: whether the checker's verdict was memoized (see `Checker.evaluate()`).
     """
 
     path: Path
     status: ContestantExecutionStatus
     exec_time: int
     comment: str
-    output: bytes
+    output: bytes | None
+    output_digest: str = ""
+    cpu_time: float = 0.0
+    peak_memory: int = 0
+    verdict_memoized: bool = False
+    spawn_time: float = 0.0
+
+
+@dataclass
+class UsageSummary:
+    """
+    Resource usage of the runs of a contestant, aggregated by the worker process so that the
+    parent only merges summaries. Each field is a `StreamingAggregate` of the corresponding
+    field of its `ContestantExecutionResult`s; peak memories are in megabytes, and unknown peak
+    memories and spawn times (i.e. 0) are left out.
+    """
+
+    exec_times: StreamingAggregate = field(default_factory=StreamingAggregate)
+    cpu_times: StreamingAggregate = field(default_factory=StreamingAggregate)
+    peak_memories: StreamingAggregate = field(default_factory=StreamingAggregate)
+    spawn_times: StreamingAggregate = field(default_factory=StreamingAggregate)
+
+    def add(self, contestant_result: ContestantExecutionResult):
+        self.exec_times.add(contestant_result.exec_time)
+        self.cpu_times.add(contestant_result.cpu_time)
+        if contestant_result.peak_memory > 0:
+            self.peak_memories.add(contestant_result.peak_memory / 1024)
+        if contestant_result.spawn_time > 0:
+            self.spawn_times.add(contestant_result.spawn_time)
 
 
 @dataclass
@@ -37,11 +92,66 @@ class WorkerResult:
     - `input`: the test data
     - `answer`: the result from the judge
     - `contestant_results`: a list of `ContestantExecutionResult`.
+    - `input_digest`, `answer_digest`: SHA256 of `input` and `answer`.
+    - `answer_cached`: whether `answer` was taken from the answer cache instead of the judge.
+    - `duplicate`: whether `input` was already tested, in which case no solution was run and
+    `answer` and `contestant_results` are empty.
+    - `packed_tests`, `pack_index`: for tests run as a pack (see `TestExecutor.run_pack()`), the
+    number of tests the result covers and the index in the pack of the first of them.
+    - `tests`: for the result of a whole pack, the index in the pack and the input of each of
+    its tests (`input` being the packed input), e.g. to replay them (see `TestExecutor.replay()`).
+    - `trace`: the spans traced by the worker process while running the test, if tracing is
+    enabled (see `init_worker()`).
+    - `usage`: the resource usage of each contestant, by name, over the results sent back
+    together (see `run_test()`). Only set on the first of them.
+
+    Unless requested, the byte payloads (`input`, `answer`, `tests` and every `output`) are only
+    kept for tests which some contestant failed, and only the outputs of the failing contestants
+    are kept. Otherwise they are `None`, and the result is just a compact verdict record.
     """
 
-    input: bytes
-    answer: bytes
+    input: bytes | None
+    answer: bytes | None
     contestant_results: list[ContestantExecutionResult]
+    input_digest: str = ""
+    answer_digest: str = ""
+    answer_cached: bool = False
+    duplicate: bool = False
+    packed_tests: int = 1
+    pack_index: int = 0
+    tests: list[tuple[int, bytes]] | None = None
+    trace: list[tuple] | None = None
+    usage: dict[str, UsageSummary] | None = None
+
+    def has_failures(self) -> bool:
+        return any(
+            contestant_result.status not in PASSED_STATUSES
+            for contestant_result in self.contestant_results
+        )
+
+    def drop_payload(self, keep_failed: bool = True, keep_test: bool = False):
+        """
+        Drop the byte payloads, except those of failed contestants if `keep_failed`, and the
+        test itself (`input`, `answer` and `tests`) if `keep_test`.
+        """
+        keeps_failed = keep_failed and self.has_failures()
+        if not (keeps_failed or keep_test):
+            self.input = self.answer = self.tests = None
+        for contestant_result in self.contestant_results:
+            if not keeps_failed or contestant_result.status in PASSED_STATUSES:
+                contestant_result.output = None
+
+
+def summarize_usage(worker_results: list[WorkerResult]) -> dict[str, UsageSummary]:
+    """The resource usage of each contestant, by name, over `worker_results`."""
+    usage: dict[str, UsageSummary] = {}
+    for worker_result in worker_results:
+        for contestant_result in worker_result.contestant_results:
+            name = contestant_result.path.name
+            if name not in usage:
+                usage[name] = UsageSummary()
+            usage[name].add(contestant_result)
+    return usage
 
 
 class TestExecutor:
@@ -58,8 +168,15 @@ class TestExecutor:
     """
 
     time_limit: int
+    memory_limit: int | None
+    output_limit: int | None
     judge: Path
     contestants: list[Path]
+    parallel_solutions: bool
+    answer_cache: AnswerCache | None
+    input_filter: BloomFilter | None
+    batch_generator: BatchGenerator | None
+    packer: TestPacker | None
     checker: type[Checker]  # Checker & its subclasses
 
     def __init__(
@@ -67,46 +184,468 @@ class TestExecutor:
         judge: Path,
         contestants: list[Path],
         time_limit=5,
+        memory_limit: int | None = None,
+        output_limit: int | None = None,
         checker_type="dummy",
+        checker_options: dict | None = None,
         external_checker_path: Path | None = None,
+        external_checker_batch: bool = False,
+        parallel_solutions: bool = False,
+        answer_cache: AnswerCache | None = None,
+        input_filter: BloomFilter | None = None,
+        batch_generator: BatchGenerator | None = None,
+        packer: TestPacker | None = None,
     ):
-        """Create a worker."""
+        """
+        Create a worker.
+
+        `time_limit` is in seconds, `memory_limit` and `output_limit` (which only apply to
+        contestants) in megabytes; `None` means no limit.
+
+        `checker_options` are passed as keyword arguments to the checker's constructor.
+
+        If `external_checker_batch` is True, the external checker (if any) runs in batch mode.
+
+        If `parallel_solutions` is True, the judge and all contestants of a test are run
+        concurrently instead of one after another.
+
+        If `answer_cache` is given, it is consulted before running the judge.
+
+        If `input_filter` is given, inputs found in it are not tested again (see
+        `WorkerResult.duplicate`). Since it is a Bloom filter, a small fraction of new inputs
+        may be mistaken for duplicates.
+
+        If `batch_generator` is given, tests are generated through it instead of by running the
+        test generator's command once per test.
+
+        `packer` is needed to run tests as packs (see `run_pack()`).
+        """
+        checker_options = checker_options or {}
         if checker_type not in DISCOVERED_CHECKERS:
             terminate_proc("Fatal error: Invalid checker type.")
         elif checker_type == "external":
             # only external checker requires an argument
-            self.checker = DISCOVERED_CHECKERS[checker_type](external_checker_path)
+            self.checker = DISCOVERED_CHECKERS[checker_type](
+                external_checker_path, batch=external_checker_batch, **checker_options
+            )
         else:
             # other checkers (even user-created ones) have no argument mandatorily
-            self.checker = DISCOVERED_CHECKERS[checker_type]()
+            self.checker = DISCOVERED_CHECKERS[checker_type](**checker_options)
 
         self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.output_limit = output_limit
         self.judge = judge
         self.contestants = contestants
+        self.parallel_solutions = parallel_solutions
+        self.answer_cache = answer_cache
+        self.input_filter = input_filter
+        self.batch_generator = batch_generator
+        self.packer = packer
+        self._local = threading.local()  # see solution_pool()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def solution_pool(self, size: int) -> ThreadPoolExecutor:
+        """
+        The pool running solutions concurrently (see `parallel_solutions`), with at least `size`
+        threads. It is created once per thread running tests, then reused by its next tests; it
+        is only replaced by a larger one when a test needs more threads (e.g. as solutions join).
+        """
+        pool, pool_size = getattr(self._local, "solution_pool", (None, 0))
+        if pool is None or pool_size < size:
+            if pool is not None:
+                pool.shutdown()
+            pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="solution")
+            self._local.solution_pool = (pool, size)
+        return pool
 
-    def __call__(self, testgen_command: str | list[str]) -> WorkerResult:
+    def __call__(
+        self,
+        testgen_command: str | list[str],
+        contestants: list[Path] | None = None,
+        keep_payload: bool = True,
+        keep_failed_payload: bool = True,
+        keep_test: bool = False,
+    ) -> WorkerResult:
         """
         Execute a test case.
+
+        `contestants` overrides the list of contestants given at instantiation, so that a
+        long-lived executor can follow which solutions are still being tested.
+
+        If `keep_payload` is False, the byte payloads are dropped from the result, except those
+        of failed contestants if `keep_failed_payload`, and the input and answer if `keep_test`
+        (see `WorkerResult.drop_payload()`).
         """
-        testgen_proc = anal_process(
-            testgen_command, identity="test generator", timeout=self.time_limit
-        )
-        input = testgen_proc.stdout
+        if contestants is None:
+            contestants = self.contestants
+
+        # Test data is held in `MemFile`s, which solutions read from and write to directly.
+        with tracer.span("test", "test"), ExitStack() as stack:
+            input_file = stack.enter_context(MemFile("input"))
+            self.generate(testgen_command, input_file)
+            input_digest = digest(input_file.view())
+            if self.input_filter is not None and not self.input_filter.add(input_digest):
+                return WorkerResult(
+                    input_file.contents() if keep_payload else None,
+                    None,
+                    [],
+                    input_digest,
+                    duplicate=True,
+                )
+
+            answer_file = stack.enter_context(MemFile("answer"))
+            worker_result = self.run_solutions(
+                contestants, input_file, input_digest, answer_file, keep_payload
+            )
+
+            if keep_payload or keep_test or (keep_failed_payload and worker_result.has_failures()):
+                worker_result.input = input_file.contents()
+        if not keep_payload:
+            worker_result.drop_payload(keep_failed_payload, keep_test)
+        return worker_result
+
+    def generate(self, testgen_command: str | list[str], input_file: MemFile):
+        """Write the test generated by `testgen_command` to `input_file`."""
+        with tracer.span("generate", "generator"):
+            if self.batch_generator is not None:
+                input_file.write(self.batch_generator(testgen_command))
+            else:
+                anal_process(
+                    testgen_command,
+                    identity="test generator",
+                    timeout=self.time_limit,
+                    stdout=input_file.fileno(),
+                )
+
+    def run_pack(
+        self,
+        testgen_commands: list[str | list[str]],
+        contestants: list[Path] | None = None,
+        keep_payload: bool = True,
+        keep_failed_payload: bool = True,
+        keep_test: bool = False,
+    ) -> list[WorkerResult]:
+        """
+        Execute several test cases as a single pack (see `TestPacker`): the judge and each
+        contestant run once on the packed input, and their outputs are split back and checked
+        test by test.
+
+        Contestants failing the pack are run again on each half of it, and so on, down to the
+        failing tests (see `run_packed()`). Returns the results of the pack and of its parts,
+        whose `pack_index` and `packed_tests` tell which tests they cover. Duplicate tests are
+        left out of the pack, with a result of their own.
+
+        Arguments are the same as for `__call__()`.
+        """
+        if contestants is None:
+            contestants = self.contestants
+
+        results: list[WorkerResult] = []
+        tests: list[tuple[int, bytes]] = []  # (index in the pack, input)
+        with tracer.span("pack", "test", tests=len(testgen_commands)):
+            for pack_index, testgen_command in enumerate(testgen_commands):
+                with MemFile("input") as input_file:
+                    self.generate(testgen_command, input_file)
+                    input = input_file.contents()
+                input_digest = digest(input)
+                if self.input_filter is not None and not self.input_filter.add(input_digest):
+                    results.append(
+                        WorkerResult(
+                            input if keep_payload else None,
+                            None,
+                            [],
+                            input_digest,
+                            duplicate=True,
+                            pack_index=pack_index,
+                        )
+                    )
+                else:
+                    tests.append((pack_index, input))
+
+            if tests:
+                results.extend(self.run_packed(tests, contestants)[0])
+        if not keep_payload:
+            for worker_result in results:
+                worker_result.drop_payload(keep_failed_payload, keep_test)
+        return results
+
+    def run_packed(
+        self,
+        tests: list[tuple[int, bytes]],
+        contestants: list[Path],
+        answers: list[bytes] | None = None,
+    ) -> tuple[list[WorkerResult], set[Path]]:
+        """
+        Run `contestants` on the pack of `tests` (pairs of index in the pack and input), then
+        bisect the pack for those which failed it. Unless the `answers` of the tests are given
+        (as they are for parts of a pack), the judge runs first, with a time limit scaled by the
+        number of tests.
+
+        Returns the results, and the contestants whose failures they report. A contestant
+        failing the pack but none of its halves is reported on the whole pack, since it fails
+        only when these tests are run together; except if it ran out of time, memory or output,
+        as the limits apply to each run and not to each test.
+        """
+        packer = self.packer
+        inputs = [input for _, input in tests]
+        others = [contestant for contestant in contestants if contestant != self.judge]
+
+        with ExitStack() as stack:
+            input_file = stack.enter_context(MemFile("input"))
+            input_file.write(packer.pack(inputs))
+            input_digest = digest(input_file.view())
+            worker_result = WorkerResult(
+                input_file.contents(),
+                None,
+                [],
+                input_digest,
+                packed_tests=len(tests),
+                pack_index=tests[0][0],
+            )
+            contestant_results = worker_result.contestant_results
+
+            if answers is None:
+                worker_result.tests = tests
+                answer_file = stack.enter_context(MemFile("answer"))
+                judge_proc, worker_result.answer_cached = self.run_judge(
+                    input_file, input_digest, answer_file, timeout=self.time_limit * len(tests)
+                )
+                answers = packer.split(judge_proc.stdout, len(tests))
+                if answers is None:
+                    terminate_proc(
+                        "Fatal error: the main correct solution's answer cannot be split into "
+                        + f"the answers of {len(tests)} packed tests."
+                    )
+                if self.judge in contestants:
+                    contestant_results.append(
+                        ContestantExecutionResult(
+                            self.judge,
+                            ContestantExecutionStatus.JUDGE,
+                            judge_proc.exec_time,
+                            "This is the answer ordained by God.",
+                            output=judge_proc.stdout,
+                            output_digest=digest(judge_proc.stdout),
+                            cpu_time=judge_proc.cpu_time,
+                            peak_memory=judge_proc.peak_memory,
+                            spawn_time=judge_proc.spawn_time,
+                        )
+                    )
+            worker_result.answer = packer.join(answers)
+            worker_result.answer_digest = digest(worker_result.answer)
+
+            # The checker sees each test as a pack of its own.
+            checked_inputs = [packer.pack([input]) for input in inputs]
+            if self.parallel_solutions and len(others) > 1:
+                others_results = list(
+                    self.solution_pool(len(others)).map(
+                        lambda contestant: self.evaluate_packed(
+                            contestant, input_file, checked_inputs, answers
+                        ),
+                        others,
+                    )
+                )
+            else:
+                others_results = [
+                    self.evaluate_packed(contestant, input_file, checked_inputs, answers)
+                    for contestant in others
+                ]
+
+        failed = []
+        for contestant_result in others_results:
+            if contestant_result.status in PASSED_STATUSES:
+                contestant_results.append(contestant_result)
+            else:
+                failed.append(contestant_result)
+
+        results = [worker_result]
+        reported: set[Path] = set()
+        if failed and len(tests) > 1:
+            failing = [contestant_result.path for contestant_result in failed]
+            half = len(tests) // 2
+            for part in (slice(None, half), slice(half, None)):
+                part_results, part_reported = self.run_packed(tests[part], failing, answers[part])
+                results.extend(part_results)
+                reported |= part_reported
+
+        for contestant_result in failed:
+            if contestant_result.path in reported:
+                continue
+            if len(tests) > 1:
+                if contestant_result.status in [
+                    ContestantExecutionStatus.TLE,
+                    ContestantExecutionStatus.MLE,
+                    ContestantExecutionStatus.OLE,
+                ]:
+                    continue
+                contestant_result.comment = (
+                    f"Fails only when these {len(tests)} tests are packed together. "
+                    + contestant_result.comment
+                )
+            contestant_results.append(contestant_result)
+            reported.add(contestant_result.path)
+        return results, reported
+
+    def evaluate_packed(
+        self,
+        contestant: Path,
+        input_file: MemFile,
+        checked_inputs: list[bytes],
+        answers: list[bytes],
+    ) -> ContestantExecutionResult:
+        """
+        Run `contestant` on the packed input, then split its output and check it test by test
+        against `answers`, each test's input being given to the checker as `checked_inputs`.
+        The verdict is that of the first test not accepted, if any. Each test is checked through
+        `Checker.evaluate()`, so the verdict is memoized only if every test's was.
+        """
+        with MemFile("output") as output_file:
+            contestant_proc = self.run_contestant(contestant, input_file, output_file)
+            if isinstance(contestant_proc, ContestantExecutionResult):
+                return contestant_proc
+            output = output_file.contents()
+
+        status, comment = ContestantExecutionStatus.AC, "%d packed test(s) accepted." % len(answers)
+        memoized = False  # whether every verdict was memoized
+        outputs = self.packer.split(output, len(answers))
+        if outputs is None:
+            status = ContestantExecutionStatus.PE
+            comment = "The output cannot be split into the outputs of %d packed tests." % len(
+                answers
+            )
+        else:
+            memoized = True
+            checked_names = ("input", "answer", "output")
+            for i, checked in enumerate(zip(checked_inputs, answers, outputs)):
+                with ExitStack() as stack:
+                    files = [stack.enter_context(MemFile(name)) for name in checked_names]
+                    for file, data in zip(files, checked):
+                        file.write(data)
+                    eval: CheckerResult = self.checker.evaluate(
+                        *files, input_digest=digest(checked[0]), output_digest=digest(checked[2])
+                    )
+                memoized = memoized and eval.memoized
+                if eval.status != ContestantExecutionStatus.AC:
+                    status, comment = eval.status, eval.comment
+                    if len(answers) > 1:
+                        comment = "Test %d of the pack: %s" % (i + 1, comment)
+                    break
 
-        judge_proc = anal_process(
-            self.judge,
-            identity="main correct solution",
-            input=input,
-            timeout=self.time_limit,
+        return ContestantExecutionResult(
+            contestant,
+            status,
+            contestant_proc.exec_time,
+            comment,
+            output=output,
+            output_digest=digest(output),
+            cpu_time=contestant_proc.cpu_time,
+            peak_memory=contestant_proc.peak_memory,
+            spawn_time=contestant_proc.spawn_time,
+            verdict_memoized=memoized,
         )
+
+    def replay(
+        self, tests: list[tuple[int, bytes]], answers: list[bytes], contestants: list[Path]
+    ) -> list[WorkerResult]:
+        """
+        Run `contestants` on tests which already ran, e.g. for contestants which were not
+        compiled yet by then: `tests` are pairs of index in the pack and input (as for
+        `run_packed()`), and `answers` their answers, so the judge does not run again.
+
+        With a `packer`, the tests are run as a pack and results are those of `run_packed()`.
+        Otherwise, `tests` is a single test, and so is the result.
+        """
+        contestants = [contestant for contestant in contestants if contestant != self.judge]
+        with tracer.span("replay", "test", tests=len(tests)):
+            if self.packer is not None:
+                return self.run_packed(tests, contestants, answers)[0]
+
+            with MemFile("input") as input_file, MemFile("answer") as answer_file:
+                input_file.write(tests[0][1])
+                answer_file.write(answers[0])
+                input_digest = digest(tests[0][1])
+                contestant_results = [
+                    self.evaluate_contestant(
+                        contestant, input_file, input_digest, lambda: answer_file, False
+                    )
+                    for contestant in contestants
+                ]
+            return [
+                WorkerResult(
+                    tests[0][1], answers[0], contestant_results, input_digest, digest(answers[0])
+                )
+            ]
+
+    def run_solutions(
+        self,
+        contestants: list[Path],
+        input_file: MemFile,
+        input_digest: str,
+        answer_file: MemFile,
+        keep_outputs: bool,
+    ) -> WorkerResult:
+        """
+        Run the judge and `contestants` on `input_file`, and check their outputs. The judge
+        writes its answer to `answer_file`. The input is left out of the result.
+        """
+        others = [contestant for contestant in contestants if contestant != self.judge]
+
+        if self.parallel_solutions:
+            # The judge and every contestant only need `input`, so they all start right away;
+            # each output is checked as soon as both it and the answer are available.
+            # The judge is submitted first, so contestants waiting for its answer never hold
+            # the threads it needs.
+            solution_pool = self.solution_pool(len(others) + 1)
+            judge_future = solution_pool.submit(
+                self.run_judge, input_file, input_digest, answer_file
+            )
+
+            def get_answer() -> MemFile:
+                judge_future.result()
+                return answer_file
+
+            others_futures = [
+                solution_pool.submit(
+                    self.evaluate_contestant,
+                    contestant,
+                    input_file,
+                    input_digest,
+                    get_answer,
+                    keep_outputs,
+                )
+                for contestant in others
+            ]
+            try:
+                judge_proc, answer_cached = judge_future.result()
+            finally:
+                wait(others_futures)  # as they use `input_file` and `answer_file`
+            others_results = [future.result() for future in others_futures]
+        else:
+            judge_proc, answer_cached = self.run_judge(input_file, input_digest, answer_file)
+            others_results = [
+                self.evaluate_contestant(
+                    contestant, input_file, input_digest, lambda: answer_file, keep_outputs
+                )
+                for contestant in others
+            ]
         answer = judge_proc.stdout
 
-        worker_result = WorkerResult(input, answer, [])
+        worker_result = WorkerResult(
+            None, answer, [], input_digest, digest(answer), answer_cached=answer_cached
+        )
         contestant_results = worker_result.contestant_results
 
         # This is because an upstream policy that include the judge's statistics
         # in the result report.
-        if self.judge in self.contestants:
+        if self.judge in contestants:
             contestant_results.append(
                 ContestantExecutionResult(
                     self.judge,
@@ -114,49 +653,261 @@ class TestExecutor:
                     judge_proc.exec_time,
                     "This is the answer ordained by God.",
                     output=answer,
+                    output_digest=worker_result.answer_digest,
+                    cpu_time=judge_proc.cpu_time,
+                    peak_memory=judge_proc.peak_memory,
+                    spawn_time=judge_proc.spawn_time,
                 )
             )
-            self.contestants.remove(self.judge)
+        contestant_results.extend(others_results)
+        return worker_result
 
-        for contestant in self.contestants:
-            try:
+    def run_judge(
+        self,
+        input_file: MemFile,
+        input_digest: str,
+        answer_file: MemFile,
+        timeout: float | None = None,
+    ) -> tuple[ProcessResult, bool]:
+        """
+        Returns the judge's result on the input, and whether it was taken from the cache. In any
+        case, the answer is written to `answer_file`. `timeout` defaults to the time limit.
+        """
+        with tracer.span(self.judge.name, "judge"):
+            if self.answer_cache is not None:
+                judge_proc = self.answer_cache.get(input_digest)
+                if judge_proc is not None:
+                    answer_file.write(judge_proc.stdout)
+                    return judge_proc, True
+
+            with input_file.reader() as input_fd:
+                judge_proc = anal_process(
+                    self.judge,
+                    identity="main correct solution",
+                    stdin=input_fd,
+                    stdout=answer_file.fileno(),
+                    timeout=timeout if timeout is not None else self.time_limit,
+                )
+            judge_proc.stdout = answer_file.contents()
+            if self.answer_cache is not None:
+                self.answer_cache.put(input_digest, judge_proc)
+            return judge_proc, False
+
+    def evaluate_contestant(
+        self,
+        contestant: Path,
+        input_file: MemFile,
+        input_digest: str,
+        get_answer: Callable[[], MemFile],
+        keep_output: bool = True,
+    ) -> ContestantExecutionResult:
+        """
+        Run `contestant` using the input as `stdin`, then check its output.
+
+        `get_answer` is only called once the output is ready to be checked, and may block until
+        the judge finishes. Unless `keep_output`, the output is only kept if it is not accepted.
+        """
+        with MemFile("output") as output_file:
+            contestant_proc = self.run_contestant(contestant, input_file, output_file)
+            if isinstance(contestant_proc, ContestantExecutionResult):
+                return contestant_proc
+
+            output_digest = digest(output_file.view())
+            eval: CheckerResult = self.checker.evaluate(
+                input_file,
+                get_answer(),
+                output_file,
+                input_digest=input_digest,
+                output_digest=output_digest,
+            )
+            keeps_output = keep_output or eval.status != ContestantExecutionStatus.AC
+            return ContestantExecutionResult(
+                contestant,
+                eval.status,
+                contestant_proc.exec_time,
+                eval.comment,
+                output=output_file.contents() if keeps_output else None,
+                output_digest=output_digest,
+                cpu_time=contestant_proc.cpu_time,
+                peak_memory=contestant_proc.peak_memory,
+                spawn_time=contestant_proc.spawn_time,
+                verdict_memoized=eval.memoized,
+            )
+
+    def run_contestant(
+        self, contestant: Path, input_file: MemFile, output_file: MemFile
+    ) -> ProcessResult | ContestantExecutionResult:
+        """
+        Run `contestant` using the input as `stdin` and `output_file` as `stdout`. Returns the
+        process's result, or the contestant's result if it failed (TLE, MLE, OLE or RTE).
+        """
+        try:
+            with tracer.span(contestant.name, "contestant"), input_file.reader() as input_fd:
                 contestant_proc = anal_process(
                     contestant,
                     terminate_on_fault=False,
-                    input=input,
+                    stdin=input_fd,
+                    stdout=output_file.fileno(),
                     timeout=self.time_limit,
+                    memory_limit=(
+                        self.memory_limit * 2**20 if self.memory_limit is not None else None
+                    ),
+                    output_limit=(
+                        self.output_limit * 2**20 if self.output_limit is not None else None
+                    ),
                 )
-            except CalledProcessError as proc_error:  # RTE
-                contestant_results.append(
-                    ContestantExecutionResult(
-                        contestant,
-                        ContestantExecutionStatus.RTE,
-                        0.0,
-                        "The solution terminated with code %d" % proc_error.returncode,
-                        output=b''
-                    )
-                )
-                continue
-            except TimeoutExpired:  # TLE
-                contestant_results.append(
-                    ContestantExecutionResult(
-                        contestant,
-                        ContestantExecutionStatus.TLE,
-                        self.time_limit * 1000,
-                        "Time limit exceeded.",
-                    )
-                )
-                continue
-
-            eval: CheckerResult = self.checker.check(input, answer, output=contestant_proc.stdout)
-            contestant_results.append(
-                ContestantExecutionResult(
-                    contestant,
-                    eval.status,
-                    contestant_proc.exec_time,
-                    eval.comment,
-                    output=contestant_proc.stdout,
-                )
+        except MemoryLimitExceeded as mle_error:  # MLE
+            return self.failed_result(
+                contestant, ContestantExecutionStatus.MLE, "Memory limit exceeded.", mle_error
             )
+        except OutputLimitExceeded as ole_error:  # OLE
+            return self.failed_result(
+                contestant, ContestantExecutionStatus.OLE, "Output limit exceeded.", ole_error
+            )
+        except ProcessFailed as proc_error:  # RTE
+            return self.failed_result(
+                contestant,
+                ContestantExecutionStatus.RTE,
+                "The solution terminated with code %d" % proc_error.returncode,
+                proc_error,
+            )
+        except TimeoutExpired:  # TLE
+            return ContestantExecutionResult(
+                contestant,
+                ContestantExecutionStatus.TLE,
+                self.time_limit * 1000,
+                "Time limit exceeded.",
+                output=b"",
+                cpu_time=self.time_limit * 1000,
+            )
+        return contestant_proc
 
-        return worker_result
+    @staticmethod
+    def failed_result(
+        contestant: Path, status: ContestantExecutionStatus, comment: str, error: ProcessFailed
+    ) -> ContestantExecutionResult:
+        """Result of `contestant` failing with `error`, with the time and memory it used."""
+        return ContestantExecutionResult(
+            contestant,
+            status,
+            error.result.exec_time,
+            comment,
+            output=b"",
+            cpu_time=error.result.cpu_time,
+            peak_memory=error.result.peak_memory,
+            spawn_time=error.result.spawn_time,
+        )
+
+
+_executor: TestExecutor | None = None
+"""The executor of the current worker process, see `init_worker()`."""
+
+_tracing = False
+"""Whether the current worker process sends its traced spans back with its results."""
+
+
+def init_worker(
+    executor: TestExecutor,
+    sandbox=None,
+    worker_counter=None,
+    worker_count=1,
+    engine=None,
+    tracing: bool = False,
+):
+    """
+    Initializer of a long-lived worker process (e.g. `ProcessPoolExecutor(initializer=...)`).
+
+    `executor` is pickled once per worker process instead of once per test; tests are then
+    executed by `run_test()` or `run_test_pack()`.
+
+    If `sandbox` (e.g. a `CgroupSandbox`) is given, the worker runs its processes in it. With a
+    `worker_counter` (a shared `multiprocessing.Value`) numbering the `worker_count` workers,
+    each worker uses its own partition of the sandbox.
+
+    If `engine` (e.g. a `SpawnEngine`) is given, the worker runs its processes with it.
+
+    If `tracing`, the worker traces its tests (see `lib.utils.tracing`) and sends the spans back
+    with each result, as `WorkerResult.trace`.
+    """
+    global _executor, _tracing
+    _executor = executor
+    _tracing = tracing
+
+    if sandbox is not None and worker_counter is not None:
+        with worker_counter.get_lock():
+            worker_index = worker_counter.value
+            worker_counter.value += 1
+        sandbox = sandbox.partition(worker_index, worker_count)
+    set_sandbox(sandbox)
+    if engine is not None:
+        set_engine(engine)
+    if tracing:
+        enable_tracing()
+
+
+def run_test(
+    testgen_command: str | list[str],
+    contestants: list[Path],
+    keep_failed_payload: bool,
+    keep_test: bool = False,
+) -> WorkerResult:
+    """
+    Execute a test case using the executor given to `init_worker()`. Only the byte payloads of
+    failed contestants are sent back, and only if `keep_failed_payload`, along with the input
+    and answer if `keep_test` (e.g. to replay the test later, see `run_replay()`).
+
+    The resource usage of the contestants is sent back summarized (see `WorkerResult.usage`).
+    """
+    worker_result = _executor(
+        testgen_command,
+        contestants,
+        keep_payload=False,
+        keep_failed_payload=keep_failed_payload,
+        keep_test=keep_test,
+    )
+    worker_result.usage = summarize_usage([worker_result])
+    if _tracing:
+        worker_result.trace = tracer.drain()
+    return worker_result
+
+
+def run_test_pack(
+    testgen_commands: list[str | list[str]],
+    contestants: list[Path],
+    keep_failed_payload: bool,
+    keep_test: bool = False,
+) -> list[WorkerResult]:
+    """
+    Same as `run_test()`, for test cases run as a pack (see `TestExecutor.run_pack()`). Traced
+    spans and the summarized resource usage of all the results are sent back with the first
+    result.
+    """
+    worker_results = _executor.run_pack(
+        testgen_commands,
+        contestants,
+        keep_payload=False,
+        keep_failed_payload=keep_failed_payload,
+        keep_test=keep_test,
+    )
+    worker_results[0].usage = summarize_usage(worker_results)
+    if _tracing:
+        worker_results[0].trace = tracer.drain()
+    return worker_results
+
+
+def run_replay(
+    tests: list[tuple[int, bytes]],
+    answers: list[bytes],
+    contestants: list[Path],
+    keep_failed_payload: bool,
+) -> list[WorkerResult]:
+    """
+    Same as `run_test_pack()`, for tests which already ran (see `TestExecutor.replay()`).
+    """
+    worker_results = _executor.replay(tests, answers, contestants)
+    for worker_result in worker_results:
+        worker_result.drop_payload(keep_failed_payload)
+    worker_results[0].usage = summarize_usage(worker_results)
+    if _tracing:
+        worker_results[0].trace = tracer.drain()
+    return worker_results
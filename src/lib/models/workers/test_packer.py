@@ -0,0 +1,49 @@
+"""
+Packing of several tests into a single multi-test input.
+"""
+
+
+class TestPacker:
+    """
+    Packs tests into one input of the usual "T test cases in one input" form, so that solutions
+    run once for the whole pack, then splits their outputs back into one output per test.
+
+    A packed input is `header` (formatted with the number of tests as `count`) followed by the
+    inputs of the tests, each of them ending with a newline. In the outputs, each test's output
+    must end with `delimiter` (e.g. `"\\n"` when each test's output is a single line); trailing
+    whitespace after the last test is ignored.
+    """
+
+    def __init__(self, header: str = "{count}\n", delimiter: str = "\n"):
+        if not delimiter:
+            raise ValueError("The delimiter of packed outputs must not be empty.")
+        self.header = header
+        self.delimiter = delimiter.encode()
+
+    def pack(self, inputs: list[bytes]) -> bytes:
+        """The multi-test input made of `inputs`, in order."""
+        parts = [self.header.format(count=len(inputs)).encode()]
+        for input in inputs:
+            parts.append(input)
+            if not input.endswith(b"\n"):
+                parts.append(b"\n")
+        return b"".join(parts)
+
+    def split(self, output, count: int) -> list[bytes] | None:
+        """
+        Split `output` (any bytes-like object) into the outputs of `count` packed tests, or
+        return `None` if it does not consist of exactly `count` delimited parts. The output of a
+        single test is returned as is.
+        """
+        if count == 1:
+            return [output[:]]
+        parts = output[:].split(self.delimiter)
+        while parts and not parts[-1].strip():  # trailing whitespace
+            parts.pop()
+        return parts if len(parts) == count else None
+
+    def join(self, outputs: list[bytes]) -> bytes:
+        """The output of a pack whose tests' outputs are `outputs`; the inverse of `split()`."""
+        if len(outputs) == 1:
+            return outputs[0]
+        return b"".join(output + self.delimiter for output in outputs)
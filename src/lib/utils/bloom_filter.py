@@ -0,0 +1,38 @@
+"""Bloom filter over hex digests, shareable between processes."""
+
+from math import ceil, log
+from multiprocessing import Array
+
+
+class BloomFilter:
+    """
+    Probabilistic set of SHA256 hex digests. Membership tests may return false positives
+    (with probability about `error_rate` once `capacity` items are added), but never false
+    negatives.
+
+    The bits live in a `multiprocessing.Array`, so a filter given to worker processes at their
+    creation (e.g. through `ProcessPoolExecutor(initargs=...)`) is shared by all of them.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-4):
+        capacity = max(1, capacity)
+        self.bit_count = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.bit_count / capacity * log(2)))
+        self.bits = Array("B", (self.bit_count + 7) // 8)
+
+    def positions(self, hex_digest: str) -> list[int]:
+        # The digest is uniformly distributed already; derive the positions by double hashing.
+        h1 = int(hex_digest[:16], 16)
+        h2 = int(hex_digest[16:32], 16) | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, hex_digest: str) -> bool:
+        """Add `hex_digest` to the filter. Returns False if it was (probably) already there."""
+        positions = self.positions(hex_digest)
+        with self.bits.get_lock():
+            bits = self.bits.get_obj()
+            if all(bits[position >> 3] >> (position & 7) & 1 for position in positions):
+                return False
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+        return True
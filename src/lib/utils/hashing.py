@@ -0,0 +1,11 @@
+"""Hashing utilities."""
+
+from hashlib import sha256
+
+
+def digest(*chunks: bytes) -> str:
+    """Returns the SHA256 hex digest of the concatenation of `chunks`."""
+    hash_obj = sha256()
+    for chunk in chunks:
+        hash_obj.update(chunk)
+    return hash_obj.hexdigest()
@@ -0,0 +1,95 @@
+"""In-memory files, for handing test data to child processes without copying it."""
+
+import os
+from contextlib import contextmanager
+from mmap import mmap, ACCESS_READ
+from tempfile import mkstemp
+
+from lib.utils.system import delete_file
+
+
+class MemFile:
+    """
+    An anonymous file holding test data once, shared by reference between processes.
+
+    On Linux this is a `memfd`: children write to it or read from it through file descriptors,
+    and the Python side reads it through a read-only `mmap`, so the data is never copied into
+    Python objects unless `contents()` is called. Elsewhere, a temporary file is used instead.
+
+    Usage:
+    ```
+    with MemFile("input") as input_file:
+        anal_process(generator, stdout=input_file.fileno())
+        with input_file.reader() as fd:
+            anal_process(solution, stdin=fd)
+    ```
+    """
+
+    def __init__(self, name: str = "asimon"):
+        if hasattr(os, "memfd_create"):
+            self.fd = os.memfd_create(name, os.MFD_CLOEXEC)
+            self.path = None
+        else:
+            self.fd, self.path = mkstemp(prefix=f"asimon-{name}-")
+        self._view: mmap | None = None
+        self._contents: bytes | None = None
+
+    def fileno(self) -> int:
+        """Writable file descriptor of the file, e.g. as the `stdout` of a child process."""
+        return self.fd
+
+    @contextmanager
+    def reader(self):
+        """
+        Yields a new read-only file descriptor positioned at the start of the file, e.g. for the
+        `stdin` of a child process. Each reader has its own offset, so that processes reading
+        the file concurrently do not interfere.
+        """
+        path = self.path if self.path is not None else f"/proc/self/fd/{self.fd}"
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            yield fd
+        finally:
+            os.close(fd)
+
+    def size(self) -> int:
+        return os.fstat(self.fd).st_size
+
+    def write(self, data: bytes):
+        """Append `data` to the file."""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view) :]
+
+    def view(self) -> mmap | bytes:
+        """
+        Read-only, bytes-like view of the file's contents (an `mmap`, or `b""` if the file is
+        empty). Must only be called once the file is completely written.
+        """
+        if self._view is None:
+            if self.size() == 0:
+                return b""
+            self._view = mmap(self.fd, 0, access=ACCESS_READ)
+        return self._view
+
+    def contents(self) -> bytes:
+        """
+        The file's contents, as a `bytes` object. Like `view()`, must only be called once the
+        file is completely written; the result is kept for later calls.
+        """
+        if self._contents is None:
+            self._contents = self.view()[:]
+        return self._contents
+
+    def close(self):
+        if self._view is not None:
+            self._view.close()
+        os.close(self.fd)
+        if self.path is not None:
+            delete_file(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -1,9 +1,155 @@
+import math
 from statistics import mean, median
 
 
-def aggregate(vals: list):
-    """Takes in a Iterable of numeric values and returns a tuple `(min, max, avg, median)`."""
+class StreamingAggregate:
+    """
+    Statistics of a stream of non-negative numbers, in constant memory.
+
+    The count, minimum, maximum, mean and standard deviation are exact. So are quantiles as long
+    as at most `max_exact` values were added, since these are kept. Past that, quantiles are
+    estimated (see `estimated`) within a relative error of `relative_accuracy`, from a DDSketch:
+    values are counted in buckets whose bounds grow geometrically, so that the sketch only needs
+    one bucket per `relative_accuracy` step between the smallest and largest values. Past
+    `max_buckets`, the lowest buckets are collapsed, which only degrades the accuracy of the
+    lowest quantiles.
+
+    Aggregates with the same `relative_accuracy` can be merged (see `merge()`), e.g. so that
+    several workers aggregate values locally and only send their aggregates to the parent.
+    """
+
+    MIN_VALUE = 1e-9
+    """Values smaller than this are counted as zeros."""
+
+    def __init__(
+        self, relative_accuracy: float = 0.01, max_buckets: int = 2048, max_exact: int = 1024
+    ):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.max_exact = max_exact
+        self.values: list[float] | None = []  # all the values, until there are too many
+        self.buckets: dict[int, int] = {}  # k -> number of values in (gamma^(k-1), gamma^k]
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._mean = 0.0
+        self._squared_deviations = 0.0  # sum of the squared deviations from the mean
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, value: float):
+        if value < 0:
+            raise ValueError("StreamingAggregate only supports non-negative values.")
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        delta = value - self._mean  # Welford's algorithm
+        self._mean += delta / self.count
+        self._squared_deviations += delta * (value - self._mean)
+        if self.values is not None:
+            self.values.append(value)
+            if len(self.values) > self.max_exact:
+                self.values = None
+
+        if value < self.MIN_VALUE:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        if key in self.buckets:
+            self.buckets[key] += 1
+        else:
+            self.buckets[key] = 1
+            self._collapse()
+
+    def merge(self, other: "StreamingAggregate"):
+        """Add the values aggregated by `other` to this aggregate."""
+        if other.gamma != self.gamma:
+            raise ValueError("Only aggregates with the same relative accuracy can be merged.")
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other._mean - self._mean  # Chan et al.'s parallel algorithm
+        self._squared_deviations += (
+            other._squared_deviations + delta * delta * self.count * other.count / count
+        )
+        self._mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.values is not None and other.values is not None and count <= self.max_exact:
+            self.values.extend(other.values)
+        else:
+            self.values = None
+        self.zeros += other.zeros
+        for key, bucket_count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + bucket_count
+        self._collapse()
+
+    def _collapse(self):
+        if len(self.buckets) <= self.max_buckets:
+            return
+        keys = sorted(self.buckets)
+        excess = len(keys) - self.max_buckets
+        target = keys[excess]
+        for key in keys[:excess]:
+            self.buckets[target] += self.buckets.pop(key)
+
+    @property
+    def estimated(self) -> bool:
+        """Whether quantiles are estimated, rather than exact."""
+        return self.values is None
+
+    @property
+    def mean(self) -> float:
+        return self._mean
+
+    @property
+    def stddev(self) -> float:
+        """The (population) standard deviation."""
+        if self.count == 0:
+            return 0.0
+        return math.sqrt(max(0.0, self._squared_deviations / self.count))
+
+    def quantile(self, q: float) -> float:
+        """The `q`-quantile (e.g. 0.5 for the median), or 0 if no value was added."""
+        if self.count == 0:
+            return 0
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        if self.values is not None:  # interpolated between the closest ranks
+            values = sorted(self.values)
+            low = math.floor(rank)
+            high = min(low + 1, self.count - 1)
+            return values[low] + (values[high] - values[low]) * (rank - low)
+
+        seen = self.zeros
+        if seen > rank:
+            return self.min
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # the value with the least relative error over the bucket
+                estimate = 2 * self.gamma**key / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+
+def aggregate(vals: list | StreamingAggregate):
+    """
+    Takes in a Iterable of numeric values (or a `StreamingAggregate`) and returns a tuple
+    `(min, max, avg, median)`.
+    """
     if len(vals) == 0:
         return (0, 0, 0, 0)
 
+    if isinstance(vals, StreamingAggregate):
+        return (vals.min, vals.max, vals.mean, vals.quantile(0.5))
     return (min(vals), max(vals), mean(vals), median(vals))
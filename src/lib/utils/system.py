@@ -1,8 +1,9 @@
 """System utilities."""
 
 from pathlib import Path
-from shutil import rmtree
+from shutil import copy2, copymode, rmtree
 import os
+import sys
 from lib.utils.formatting import send_message, text_colors
 
 
@@ -28,6 +29,83 @@ def delete_folder(p: Path):
         pass
 
 
+FICLONE = 0x40049409
+"""Linux `ioctl()` request sharing the extents of a file with another (a reflink)."""
+
+
+def clone_file(src: Path, dest: Path) -> str:
+    """
+    Make `dest` a file with the same content and permissions as `src`, without copying the data
+    when possible: by reflink (Linux, on e.g. Btrfs or XFS), or else by hardlink (`dest` is then
+    the same file as `src`, so neither must be modified in place), or else by copy. `dest` must
+    not exist. Returns how it was made: `"reflink"`, `"hardlink"` or `"copy"`.
+    """
+    if sys.platform == "linux":
+        import fcntl
+
+        with open(src, "rb") as src_file, open(dest, "xb") as dest_file:
+            try:
+                fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+                cloned = True
+            except OSError:  # e.g. unsupported by the file system
+                cloned = False
+        if cloned:
+            copymode(src, dest)
+            return "reflink"
+        delete_file(dest)
+
+    try:
+        os.link(src, dest)
+        return "hardlink"
+    except OSError:
+        pass
+
+    copy2(src, dest)
+    return "copy"
+
+
+class FileLock:
+    """
+    Exclusive lock on the file `path` (created if needed), held by at most one process at a
+    time, e.g. so that runs sharing a cache do not duplicate work. Usable as a context manager,
+    which waits until the lock is acquired. The lock is released when the context is left, or
+    by the OS if the process dies.
+
+    Based on `flock()` on POSIX (also supported by NFS), and `msvcrt.locking()` on Windows.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+        if is_windows():
+            import msvcrt
+
+            while True:
+                self.file.seek(0)
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds
+                    continue
+        else:
+            import fcntl
+
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *_):
+        if is_windows():
+            import msvcrt
+
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()  # also releases the flock()
+        self.file = None
+
+
 def find_file_with_name(name: str, p: Path):
     """Find a file with name `name`.* in the directory `p`."""
 
@@ -0,0 +1,187 @@
+"""
+Opt-in tracing of where time goes, exported in the Chrome trace event format (Perfetto).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+
+DEFAULT_CAPACITY = 2**16
+"""Default number of spans kept by an enabled `Tracer`."""
+
+_NO_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ["tracer", "name", "category", "args", "start"]
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: dict | None):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *_):
+        self.tracer.record(
+            self.name, self.category, self.start, time.perf_counter_ns(), args=self.args
+        )
+
+
+class Tracer:
+    """
+    Records spans (named and categorized intervals of time) into a ring buffer: once it holds
+    `capacity` spans, the oldest ones are dropped. The total duration of each category is kept
+    for all spans recorded, dropped or not.
+
+    A disabled tracer records nothing, and `span()` then costs about a function call. Each
+    Python process has its own tracer (`tracer`). Spans recorded by worker processes are sent
+    back with their results (see `drain()`) and added to the main process's tracer with
+    `extend()`.
+
+    Timestamps are those of `time.perf_counter_ns()`, whose clock is shared by all processes
+    (on Linux, macOS and Windows), so spans of different processes line up.
+
+    Usage:
+    ```
+    tracer.enable()
+    with tracer.span("judge.cpp", "judge"):
+        ...
+    tracer.export(logdir / "trace.json")
+    ```
+    """
+
+    def __init__(self):
+        self.events: deque | None = None
+        self.totals: dict[str, list[int]] = {}  # category -> [number of spans, total duration]
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.epoch = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.events is not None
+
+    def enable(self, capacity: int = DEFAULT_CAPACITY):
+        """Start recording, dropping what was recorded so far (e.g. before a `fork()`)."""
+        self.events = deque(maxlen=capacity)
+        self.totals = {}
+        self.pid = os.getpid()
+        self.epoch = time.perf_counter_ns()
+
+    def disable(self):
+        self.events = None
+
+    def span(self, name: str, category: str, **args):
+        """
+        Context manager recording the time spent in its body as a span. `args` are shown along
+        with the span in trace viewers.
+        """
+        if self.events is None:
+            return _NO_SPAN
+        return _Span(self, name, category, args or None)
+
+    def record(
+        self,
+        name: str,
+        category: str,
+        start: int,
+        end: int,
+        pid: int | None = None,
+        tid: int | None = None,
+        args: dict | None = None,
+    ):
+        """
+        Record a span from `start` to `end` (in nanoseconds, see `time.perf_counter_ns()`) of
+        the process `pid` and thread `tid`, which default to the current ones.
+        """
+        if self.events is None:
+            return
+        if pid is None:
+            pid = self.pid
+        if tid is None:
+            tid = threading.get_native_id()
+        self._add((name, category, start, end, pid, tid, args))
+
+    def _add(self, event: tuple):
+        with self.lock:
+            self.events.append(event)
+            total = self.totals.setdefault(event[1], [0, 0])
+            total[0] += 1
+            total[1] += event[3] - event[2]
+
+    def drain(self) -> list[tuple]:
+        """Remove and return the recorded spans (e.g. to send them to the main process)."""
+        if self.events is None:
+            return []
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+            self.totals = {}
+        return events
+
+    def extend(self, events: list[tuple], **args):
+        """Add `events` (as returned by `drain()`), with `args` added to their arguments."""
+        if self.events is None:
+            return
+        for name, category, start, end, pid, tid, event_args in events:
+            if args:
+                event_args = {**event_args, **args} if event_args else args
+            self._add((name, category, start, end, pid, tid, event_args))
+
+    def recorded_spans(self) -> int:
+        """Number of spans recorded, including those dropped from the ring buffer."""
+        return sum(count for count, _ in self.totals.values())
+
+    def summary(self, categories: list[str]) -> list[tuple[str, int, float]]:
+        """The number of spans of each of `categories`, and their total duration in ms."""
+        return [
+            (category, self.totals[category][0], self.totals[category][1] / 1e6)
+            for category in categories
+            if category in self.totals
+        ]
+
+    def export(self, path: Path):
+        """
+        Write the recorded spans to `path` in the Chrome trace event format, which can be
+        opened in Perfetto (https://ui.perfetto.dev) or `chrome://tracing`.
+        """
+        trace_events = []
+        with self.lock:
+            events = list(self.events or [])
+        for pid in sorted({event[4] for event in events}):
+            name = "main process" if pid == self.pid else f"worker process {pid}"
+            trace_events.append(
+                {"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": name}}
+            )
+        for name, category, start, end, pid, tid, args in events:
+            trace_event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.epoch) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": pid,
+                "tid": tid,
+            }
+            if args:
+                trace_event["args"] = args
+            trace_events.append(trace_event)
+
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, trace_file)
+
+
+tracer = Tracer()
+"""The tracer of the current Python process, disabled unless enabled."""
+
+
+def enable_tracing(capacity: int = DEFAULT_CAPACITY):
+    """Enable `tracer`. Usable as the initializer of worker processes."""
+    tracer.enable(capacity)
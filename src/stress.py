@@ -2,9 +2,18 @@
 src/stress.py - Stress testing a problem's implementations.
 """
 
-
 import random
-from concurrent.futures import ProcessPoolExecutor, Future
+import time
+from multiprocessing import Value
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    Future,
+    wait,
+    FIRST_COMPLETED,
+)
+from contextlib import ExitStack
 from tabulate import tabulate
 from pathlib import Path
 from io import TextIOWrapper
@@ -13,19 +22,71 @@ from lib.models.workers.test_executor import (
     TestExecutor,
     WorkerResult,
     ContestantExecutionResult,
+    UsageSummary,
+    init_worker,
+    run_test,
+    run_test_pack,
+    run_replay,
 )
+from lib.models.workers.anal_process import RlimitSandbox, set_engine, set_sandbox
+from lib.models.workers.async_engine import AsyncEngine
+from lib.models.workers.spawn_engine import SpawnEngine
+from lib.models.workers.cgroup import CgroupSandbox
+from lib.models.workers import spawn_server
+from lib.models.workers.spawn_server import SpawnServer
+from lib.models.workers.answer_cache import AnswerCache
+from lib.models.workers.batch_generator import BatchGenerator
+from lib.models.workers.test_packer import TestPacker
 from lib.models.ces import ContestantExecutionStatus
 from lib.models.problem import Problem
 from lib.models.cpp_compiler import CppCompiler
 
 from lib.utils.formatting import send_message, script_split, write_prefix
 from lib.utils.system import find_file_with_name, get_dir, delete_folder, terminate_proc
-from lib.utils.numeric_aggregator import aggregate
+from lib.utils.numeric_aggregator import StreamingAggregate, aggregate
+from lib.utils.bloom_filter import BloomFilter
 from lib.utils.formatting import text_colors
+from lib.utils.tracing import tracer
 
 from lib.config.paths import *
 import config_stress as config
 
+MAX_PENDING_TESTS_PER_WORKER = 2
+"""
+Number of tests queued per worker. Keeping more than one test per worker lets a worker pick up
+its next test right away instead of waiting for the main process to submit it.
+"""
+
+MAX_BACKLOG_SIZE = 256 * 2**20
+"""
+In bytes. While some solutions are being compiled, the inputs and answers of the tests run
+without them are kept so they can replay them (see `Stresser.join()`). Past this size, no new
+test is started until they are compiled.
+"""
+
+EXECUTION_ENGINES = ["process", "spawn", "asyncio"]
+
+SPAWN_SERVER = bindir / "asimon-spawn-server"
+"""
+Executable of the spawn server (see `spawn_server.py`), compiled along with the sources where it
+is supported, so that the peak memory of every run is measured.
+"""
+
+TRACED_PHASES = [
+    ("compilation", "compilation"),
+    ("generator", "test generation"),
+    ("judge", "main correct solution"),
+    ("contestant", "other solutions"),
+    ("checker", "checker"),
+    ("ipc", "sending results"),
+    ("results", "result handling"),
+    ("logging", "logging failed tests"),
+]
+"""
+Categories of traced spans summed up in the result file, and their descriptions. Logging failed
+tests is part of result handling.
+"""
+
 
 class Stresser:
     """
@@ -35,13 +96,51 @@ class Stresser:
     def __init__(self):
         # pair of C++ source files and its executable's location
         self.source_output: list[tuple[Path, Path]] = []
-        self.workers: list[TestExecutor] = []
-        self.batch_count = config.test_count // config.cpu_workers
+        self.executor: TestExecutor | None = None
+        self.contestants: list[Path] = []  # solutions which have not failed yet
+        # executables -> whether they are compiled (see `start_compilation()`)
+        self.compiled: dict[Path, Future] = {}
+        self.compiling: dict[Future, Path] = {}  # solutions not compiled yet
+        self.joined: list[Path] = []  # solutions in the order they joined the run
+        # tests run while some solutions were not compiled yet: (index of their first test,
+        # their inputs (see `TestExecutor.replay()`) and their answers)
+        self.backlog: list[tuple[int, list[tuple[int, bytes]], list[bytes]]] = []
+        self.backlog_size = 0
+        self.replays = 0  # number of tests replayed by solutions which joined late
         self.general_status: list[tuple[str, str]] = []  # internal report form
-        self.exec_times: dict[str, list] = {}
-        self.compiler = CppCompiler(config.compilation_command, config.cpu_workers)
+        # solution -> (index, status) of its first failing test
+        self.failures: dict[str, tuple[int, ContestantExecutionStatus]] = {}
+        self.answer_cache: AnswerCache | None = None
+        self.batch_generator: BatchGenerator | None = None
+        self.processed_tests = 0
+        self.cached_answers = 0  # number of tests whose answer was taken from the cache
+        self.duplicate_tests = 0  # number of tests skipped since their input was already tested
+        self.checked_outputs = 0  # number of outputs given to the checker ...
+        self.memoized_verdicts = 0  # ... and how many of their verdicts were memoized
+        self.packs = 0  # number of packs of tests run (see `test_packing`) ...
+        self.pack_part_runs = 0  # ... and of runs of parts of them, replays included
+        self.exec_times: dict[str, StreamingAggregate] = {}
+        self.cpu_times: dict[str, StreamingAggregate] = {}
+        self.peak_memories: dict[str, StreamingAggregate] = {}
+        # time taken to start each solution, in miliseconds
+        self.spawn_times = StreamingAggregate()
+        self.compiler = CppCompiler(
+            config.compilation_command,
+            config.cpu_workers,
+            cache_max_size=config.compiler_cache_size * 2**20 or None,
+            cache_max_entries=config.compiler_cache_entries or None,
+            cache_root=config.compiler_cache_dir,
+        )
         self.testgen_name_noext, self.testgen_args = script_split(config.testgen_script)
 
+        if config.execution_engine not in EXECUTION_ENGINES:
+            terminate_proc(
+                "Fatal error: execution_engine must be one of: "
+                + ", ".join(f'"{engine}"' for engine in EXECUTION_ENGINES)
+            )
+        if config.tracing:
+            tracer.enable(config.tracing_capacity)
+
         if config.problem_name:  # source from problem
             current_problem = Problem(problems_dir / config.problem_name)
             if not current_problem.exists():
@@ -49,7 +148,14 @@ class Stresser:
 
             # TODO: dynamic import for these:
             self.checker_type = "token"  # stub
-            self.compiler = CppCompiler("$default")
+            self.checker_options = {}
+            self.compiler = CppCompiler(
+                "$default",
+                config.cpu_workers,
+                cache_max_size=config.compiler_cache_size * 2**20 or None,
+                cache_max_entries=config.compiler_cache_entries or None,
+                cache_root=config.compiler_cache_dir,
+            )
 
             # Internal (within __init__ only), temporary variables
             _judge_path = current_problem.main_correct_solution()
@@ -59,6 +165,7 @@ class Stresser:
             )
             if self.checker_type == "external":
                 _external_checker_path = None  # Path, stub
+                self.external_checker_batch = False
         else:  # source from workspace
 
             def validate_config():
@@ -77,8 +184,10 @@ class Stresser:
             _testgen_path = find_file_with_name(self.testgen_name_noext, workspace)
 
             self.checker_type = config.checker_type
+            self.checker_options = config.checker_options
             if self.checker_type == "external":
                 _external_checker_path = workspace / config.external_checker
+                self.external_checker_batch = config.external_checker_batch
 
         def _queue_compilation(p: Path):
             self.source_output.append((p, bindir / p.name))
@@ -89,104 +198,448 @@ class Stresser:
             _queue_compilation(solution)
         if self.checker_type == "external":
             _queue_compilation(_external_checker_path)
+        if SpawnServer.supported():
+            self.source_output.append((spawn_server.SOURCE, SPAWN_SERVER))
 
         # add some more variables
         self.judge_name = _judge_path.name
         self.testgen_name = _testgen_path.name
         self.all_sol_paths = _contestant_paths + [_judge_path]
-        self.exec_times = {contestant.name: [] for contestant in self.all_sol_paths}
+        self.exec_times = {
+            contestant.name: StreamingAggregate() for contestant in self.all_sol_paths
+        }
+        self.cpu_times = {
+            contestant.name: StreamingAggregate() for contestant in self.all_sol_paths
+        }
+        self.peak_memories = {
+            contestant.name: StreamingAggregate() for contestant in self.all_sol_paths
+        }
 
         if self.checker_type == "external":
             self.external_checker_name = _external_checker_path.name
 
+    def start_compilation(self, stack: ExitStack):
+        """
+        Compile all sources in a background thread, as a context of `stack`, so that tests can
+        start as soon as the executables they need are compiled. `compiled` then holds a future
+        for each executable, set once it is ready; if the compilation fails, they raise its error
+        (e.g. the `SystemExit` of `terminate_proc()`).
+        """
+        self.compiled = {output_path: Future() for _, output_path in self.source_output}
+
+        def on_ready(_, output_path: Path):
+            if not self.compiled[output_path].done():
+                self.compiled[output_path].set_result(None)
+
+        def on_done(compilation: Future):
+            for compiled in self.compiled.values():
+                if compiled.done():
+                    continue
+                if compilation.exception() is not None:
+                    compiled.set_exception(compilation.exception())
+                else:
+                    compiled.set_result(None)
+
+        compiler_thread = stack.enter_context(ThreadPoolExecutor(max_workers=1))
+        compiler_thread.submit(self.compiler, self.source_output, on_ready).add_done_callback(
+            on_done
+        )
+
     def init_workers(self):
-        for _ in range(config.cpu_workers):
-            self.workers.append(
-                TestExecutor(
-                    judge=bindir / self.judge_name,
-                    contestants=[bindir / contestant.name for contestant in self.all_sol_paths],
-                    time_limit=config.time_limit,
-                    checker_type=self.checker_type,
-                    external_checker_path=(
-                        bindir / self.external_checker_name
-                        if self.checker_type == "external"
-                        else None
-                    ),
+        """
+        Create the executor shared by all workers. It is sent once to each worker process
+        (see `init_worker()`), after which only the test generator's command and the list of
+        remaining solutions are sent per test.
+
+        Solutions which are not compiled yet join the run later (see `join()`).
+        """
+        for contestant in self.all_sol_paths:
+            executable = bindir / contestant.name
+            if self.compiled[executable].done():
+                self.compiled[executable].result()  # raises if the compilation failed
+                self.contestants.append(executable)
+            else:
+                self.compiling[self.compiled[executable]] = executable
+        self.joined = list(self.contestants)
+        if config.answer_cache_size > 0:
+            self.answer_cache = AnswerCache(
+                answer_cache_dir, bindir / self.judge_name, config.answer_cache_size * 2**20
+            )
+        input_filter = BloomFilter(config.test_count) if config.skip_duplicate_inputs else None
+        if config.testgen_batch:
+            testgen_command = [bindir / self.testgen_name] + self.testgen_args
+            if BatchGenerator.supported(testgen_command, config.time_limit):
+                self.batch_generator = BatchGenerator(testgen_command, config.time_limit)
+            else:
+                send_message(
+                    f"Test generator {self.testgen_name} does not support batch mode, "
+                    + "running it once per test.",
+                    text_colors.YELLOW,
                 )
+        self.executor = TestExecutor(
+            judge=bindir / self.judge_name,
+            contestants=list(self.contestants),
+            time_limit=config.time_limit,
+            memory_limit=config.memory_limit,
+            output_limit=config.output_limit,
+            checker_type=self.checker_type,
+            checker_options=self.checker_options,
+            external_checker_path=(
+                bindir / self.external_checker_name if self.checker_type == "external" else None
+            ),
+            external_checker_batch=self.checker_type == "external" and self.external_checker_batch,
+            parallel_solutions=config.parallel_solutions,
+            answer_cache=self.answer_cache,
+            input_filter=input_filter,
+            batch_generator=self.batch_generator,
+            packer=(
+                TestPacker(config.test_packing_header, config.test_packing_delimiter)
+                if config.test_packing > 1
+                else None
+            ),
+        )
+
+    def start_worker_pool(self, stack: ExitStack, max_pending: int) -> Executor:
+        """
+        Start the pool executing tests, as a context of `stack`.
+
+        With the `"process"` engine, each worker is a Python process blocking on its children.
+        The `"spawn"` engine is the same, except that the output of children is captured without
+        pipes (see `SpawnEngine`). With the `"asyncio"` engine, tests run as threads of this process
+        and all children are driven by a single event loop, at most `cpu_workers` of them at a
+        time.
+
+        If `use_cgroups` is set, each child runs in its own cgroup (see `CgroupSandbox`).
+        Whatever the engine, children are spawned by the spawn server where it is supported.
+        """
+        server = SPAWN_SERVER if SpawnServer.supported() else None
+        sandbox = None
+        if config.use_cgroups:
+            sandbox, reason = CgroupSandbox.create(config.cpu_workers, server)
+            if sandbox is None:
+                send_message(
+                    f"cgroup v2 isolation is unavailable ({reason}), falling back to rlimits.",
+                    text_colors.YELLOW,
+                )
+            else:
+                stack.callback(sandbox.cleanup)
+        if sandbox is None:
+            sandbox = RlimitSandbox(server)
+
+        if config.execution_engine == "asyncio":
+            engine = stack.enter_context(AsyncEngine(max_processes=config.cpu_workers))
+            set_engine(engine)
+            stack.callback(set_engine, None)
+            init_worker(self.executor, sandbox)
+            stack.callback(self.executor.checker.close)
+            if self.batch_generator is not None:
+                stack.callback(self.batch_generator.close)
+            stack.callback(set_sandbox, None)
+            return stack.enter_context(ThreadPoolExecutor(max_workers=max_pending))
+
+        engine = None
+        if config.execution_engine == "spawn":
+            if SpawnEngine.supported():
+                engine = SpawnEngine()
+            else:
+                send_message(
+                    'The "spawn" engine is unavailable on this system, falling back to "process".',
+                    text_colors.YELLOW,
+                )
+
+        # With parallel_solutions, each test occupies one CPU per solution (judge included).
+        process_workers = config.cpu_workers
+        if config.parallel_solutions:
+            process_workers = max(1, config.cpu_workers // len(self.contestants))
+
+        return stack.enter_context(
+            ProcessPoolExecutor(
+                max_workers=process_workers,
+                initializer=init_worker,
+                initargs=(
+                    self.executor,
+                    sandbox,
+                    Value("i", 0),
+                    process_workers,
+                    engine,
+                    config.tracing,
+                ),
             )
+        )
+
+    def all_solutions_failed(self) -> bool:
+        contestants = self.contestants
+        return not self.compiling and (
+            not contestants
+            or (len(contestants) == 1 and contestants[0].name == config.main_correct_solution)
+        )
 
     def run_tests(self):
-        """Run the number of tests specified by dividing them into batches \
-        the size of at most `cpu_workers`."""
-        if config.test_count % config.cpu_workers != 0:
-            self.batch_count += 1
-
-        with ProcessPoolExecutor(max_workers=config.cpu_workers) as worker_pool:
-            batch = 0
-            processed_tests = 0
-            for batch_first in range(0, config.test_count, config.cpu_workers):
-                if not self.workers[0].contestants or (
-                    len(self.workers[0].contestants) == 1
-                    and self.workers[0].contestants[0].name == config.main_correct_solution
+        """
+        Run `test_count` tests, keeping at most `MAX_PENDING_TESTS_PER_WORKER * cpu_workers`
+        of them in flight.
+
+        A new test is submitted as soon as any running test finishes (instead of waiting for a
+        whole batch), so a single slow test never leaves the other workers idle. Results are
+        handled in completion order; see `handle_test_result()` for how the index of the first
+        failing test is kept correct.
+
+        With `test_packing`, tests are submitted (and counted as in flight) by packs instead.
+
+        Solutions which are still being compiled join the run once they are (see `join()`).
+        Until then, tests are run without them, and their inputs and answers are kept in a
+        backlog, which the solutions replay when they join.
+        """
+        max_pending = MAX_PENDING_TESTS_PER_WORKER * config.cpu_workers
+        packing = config.test_packing > 1
+
+        with ExitStack() as stack:
+            worker_pool = self.start_worker_pool(stack, max_pending)
+            # tests -> index of the first of them, their number, and the number of solutions
+            # which had joined the run when they were submitted
+            pending: dict[Future, tuple[int, int, int]] = {}
+            replays: dict[Future, int] = {}  # replayed tests -> index of the first of them
+            submitted_tests = 0
+            finished_runs = 0
+            aborted = False
+
+            while True:
+                backlog_full = self.compiling and self.backlog_size > MAX_BACKLOG_SIZE
+                while (
+                    len(pending) + len(replays) < max_pending
+                    and submitted_tests < config.test_count
+                    and not backlog_full
                 ):
-                    send_message(
-                        "All solutions have failed, aborting execution...",
-                        text_colors.YELLOW,
+                    if self.all_solutions_failed():
+                        if not aborted:
+                            send_message(
+                                "All solutions have failed, aborting execution...",
+                                text_colors.YELLOW,
+                            )
+                            aborted = True
+                        break
+
+                    test_count = 1
+                    if packing:
+                        test_count = min(config.test_packing, config.test_count - submitted_tests)
+                    # a batch generator draws the seeds itself (see `BatchGenerator`)
+                    seeded = self.batch_generator is None
+                    testgen_commands = [
+                        [bindir / self.testgen_name]
+                        + self.testgen_args
+                        + ([f"--seed {random.getrandbits(31)}"] if seeded else [])
+                        for _ in range(test_count)
+                    ]
+                    proc = worker_pool.submit(
+                        run_test_pack if packing else run_test,
+                        testgen_commands if packing else testgen_commands[0],
+                        list(self.contestants),  # as solutions may join before it is sent
+                        keep_failed_payload=config.failed_test_data,
+                        keep_test=bool(self.compiling),  # for the backlog
                     )
+                    pending[proc] = (submitted_tests + 1, test_count, len(self.joined))
+                    submitted_tests += test_count
+
+                if not (pending or replays or self.compiling):
                     break
 
-                batch_last = min(batch_first + config.cpu_workers, config.test_count) - 1
-                batch_size = batch_last - batch_first + 1
-                send_message(
-                    f"Executing batch {batch+1} (test {batch_first+1} - {batch_last+1})",
-                    text_colors.BOLD,
+                finished, _ = wait(
+                    list(pending) + list(replays) + list(self.compiling),
+                    return_when=FIRST_COMPLETED,
                 )
+                for proc in finished:
+                    if proc in self.compiling:
+                        proc.result()  # raises if the compilation failed
+                        self.join(self.compiling.pop(proc), worker_pool, replays)
+                        continue
 
-                procs: list[Future[WorkerResult]] = []
-                for i in range(batch_size):
-                    test_seed = random.getrandbits(31)
-                    procs.append(
-                        worker_pool.submit(
-                            self.workers[i],
-                            [bindir / self.testgen_name]
-                            + self.testgen_args
-                            + [f"--seed {test_seed}"],
+                    # calling result() propagates the child process's terminate_proc() call, if any
+                    replayed = proc in replays
+                    test_results = proc.result() if packing or replayed else [proc.result()]
+                    received = time.perf_counter_ns()
+                    if replayed:
+                        first_index = replays.pop(proc)
+                    else:
+                        first_index, test_count, joined_count = pending.pop(proc)
+                    self.collect_trace(test_results, first_index, received)
+                    self.merge_usage(test_results[0].usage)
+                    for test_result in test_results:
+                        with tracer.span("handle result", "results"):
+                            self.handle_test_result(
+                                test_result, test_index=first_index + test_result.pack_index
+                            )
+                    if packing:
+                        # the first run is that of the whole pack, the others bisect it
+                        runs = sum(not test_result.duplicate for test_result in test_results)
+                        self.packs += runs > 0 and not replayed
+                        self.pack_part_runs += max(0, runs - 1)
+                    if replayed:
+                        continue
+
+                    # solutions which joined the run after these tests were submitted replay them
+                    entry = self.backlog_entry(test_results, first_index)
+                    if entry is not None:
+                        late = self.joined[joined_count:]
+                        if late:
+                            self.replay(entry, late, worker_pool, replays)
+                        if self.compiling:
+                            self.backlog.append(entry)
+                            self.backlog_size += sum(len(input) for _, input in entry[1])
+                            self.backlog_size += sum(len(answer) for answer in entry[2])
+
+                    self.processed_tests += test_count
+                    finished_runs += 1
+                    if finished_runs % config.cpu_workers == 0:
+                        skipped = ""
+                        if self.duplicate_tests > 0:
+                            skipped = f" ({self.duplicate_tests} duplicate(s) skipped)"
+                        send_message(
+                            f"Finished {self.processed_tests}/{config.test_count} tests{skipped}",
+                            text_colors.BOLD,
                         )
-                    )
 
-                for proc in procs:
-                    # calling result() propagates the child process's terminate_proc() call, if any
-                    test_result = proc.result()
-                    processed_tests += 1
-                    self.handle_test_result(test_result, test_index=processed_tests)
+    def backlog_entry(
+        self, test_results: list[WorkerResult], first_index: int
+    ) -> tuple[int, list[tuple[int, bytes]], list[bytes]] | None:
+        """
+        The backlog entry of tests submitted with `keep_test` (see `run_tests()`), from their
+        results; `None` if they were all duplicates.
+        """
+        if config.test_packing <= 1:
+            test_result = test_results[0]
+            if test_result.duplicate or test_result.input is None:
+                return None
+            return first_index, [(0, test_result.input)], [test_result.answer]
+
+        for test_result in test_results:
+            if test_result.tests is not None:  # the result of the whole pack
+                answers = self.executor.packer.split(test_result.answer, len(test_result.tests))
+                return first_index, test_result.tests, answers
+        return None
+
+    def replay(
+        self,
+        entry: tuple[int, list[tuple[int, bytes]], list[bytes]],
+        contestants: list[Path],
+        worker_pool: Executor,
+        replays: dict[Future, int],
+    ):
+        """
+        Submit the tests of a backlog `entry` to `worker_pool`, to be run by those of
+        `contestants` which have not failed an earlier test. The submitted tests are added to
+        `replays`.
+        """
+        first_index, tests, answers = entry
+        first_test = first_index + tests[0][0]
+        contestants = [
+            contestant
+            for contestant in contestants
+            if contestant.name not in self.failures
+            or self.failures[contestant.name][0] > first_test
+        ]
+        if not contestants:
+            return
+        proc = worker_pool.submit(
+            run_replay,
+            tests,
+            answers,
+            contestants,
+            keep_failed_payload=config.failed_test_data,
+        )
+        replays[proc] = first_index
+        self.replays += len(tests)
+
+    def join(self, contestant: Path, worker_pool: Executor, replays: dict[Future, int]):
+        """
+        Add the solution `contestant`, whose compilation just finished, to the run. It replays
+        the backlog (the tests run so far, see `run_tests()`), then runs the next tests along
+        with the other solutions.
+        """
+        self.contestants.append(contestant)
+        self.joined.append(contestant)
+        if self.backlog:
+            send_message(
+                f"Solution {contestant.name} is compiled, joining the run "
+                + f"(replaying {sum(len(tests) for _, tests, _ in self.backlog)} test(s))...",
+                text_colors.YELLOW,
+            )
+        for entry in self.backlog:
+            self.replay(entry, [contestant], worker_pool, replays)
+        if not self.compiling:
+            self.backlog = []
+            self.backlog_size = 0
+
+    def collect_trace(self, test_results: list[WorkerResult], test_index: int, received: int):
+        """
+        Add the spans traced by a worker process while running the tests from `test_index` on,
+        and a span for sending their results back (from the end of the tests until `received`).
+        """
+        for test_result in test_results:
+            if not test_result.trace:
+                continue
+            tracer.extend(test_result.trace, test=test_index)
+            for _, category, _, end, pid, _, _ in reversed(test_result.trace):
+                if category == "test":
+                    # on a track of its own, as the worker may already be running its next test
+                    tracer.record(
+                        "send result", "ipc", end, received, pid, tid=0, args={"test": test_index}
+                    )
+                    break
 
-                batch += 1
+    def merge_usage(self, usage: dict[str, UsageSummary]):
+        """Add the resource usage summarized by a worker (see `WorkerResult.usage`)."""
+        for contestant, summary in usage.items():
+            self.exec_times[contestant].merge(summary.exec_times)
+            self.cpu_times[contestant].merge(summary.cpu_times)
+            self.peak_memories[contestant].merge(summary.peak_memories)
+            self.spawn_times.merge(summary.spawn_times)
 
     def handle_test_result(self, test_result: WorkerResult, test_index: int):
+        """
+        Record the result of the test with index `test_index`.
+
+        Since results arrive in completion order, a test may report a failure after a test with a
+        greater index already did. Every test with a smaller index was submitted before that
+        first report (and thus still ran the solution), so keeping the minimum index over all
+        reports gives the exact first failing test.
+        Duplicate tests (see `skip_duplicate_inputs`) are only counted.
+
+        For tests run as a pack, `test_index` is the index of the first test the result covers.
+        Failures are only reported on single tests, or on the packs they only happen in.
+        """
+        if test_result.duplicate:
+            self.duplicate_tests += 1
+            return
+        self.cached_answers += test_result.answer_cached * test_result.packed_tests
+
         for contestant_result in test_result.contestant_results:
             contestant = contestant_result.path.name
-            self.exec_times[contestant].append(contestant_result.exec_time)
+            if contestant_result.status.value < ContestantExecutionStatus.JUDGE.value:
+                self.checked_outputs += test_result.packed_tests
+                self.memoized_verdicts += (
+                    contestant_result.verdict_memoized * test_result.packed_tests
+                )
 
-            if (
-                contestant_result.status
-                not in [ContestantExecutionStatus.AC, ContestantExecutionStatus.JUDGE]
-                and contestant_result.path in self.workers[0].contestants
-            ):
-                for worker in self.workers:
-                    worker.contestants.remove(contestant_result.path)
+            if contestant_result.status in [
+                ContestantExecutionStatus.AC,
+                ContestantExecutionStatus.JUDGE,
+            ]:
+                continue
 
-                send_message(
-                    f"Solution {contestant} failed ({contestant_result.status}, test {test_index})",
-                    text_colors.RED,
-                )
-                self.general_status.append(
-                    [
-                        contestant,
-                        f"{contestant_result.status} (test {test_index})",
-                    ]
-                )
+            if contestant in self.failures and self.failures[contestant][0] < test_index:
+                continue
+
+            if contestant_result.path in self.contestants:
+                self.contestants.remove(contestant_result.path)
+
+            send_message(
+                f"Solution {contestant} failed ({contestant_result.status}, test {test_index})",
+                text_colors.RED,
+            )
+            self.failures[contestant] = (test_index, contestant_result.status)
 
-                if config.failed_test_data:
+            if config.failed_test_data:
+                with tracer.span("log failed test", "logging"):
                     self.log_failed_test_data(contestant, test_result, contestant_result)
 
     def log_failed_test_data(
@@ -214,21 +667,58 @@ class Stresser:
             status.write(f"Comment:\n{contestant_result.comment}\n\n")
 
     def print_final_verdict(self):
-        for contestant in self.workers[0].contestants:
+        unique_tests = self.processed_tests - self.duplicate_tests
+        tested = f"{unique_tests} tests"
+        if self.duplicate_tests > 0:
+            tested = (
+                f"{unique_tests} of {self.processed_tests} tests, "
+                + f"{self.duplicate_tests} duplicate(s) skipped"
+            )
+        for contestant, (test_index, status) in self.failures.items():
+            self.general_status.append([contestant, f"{status} (test {test_index})"])
+        for contestant in self.contestants:
             contestant_name = contestant.name
             self.general_status.append(
                 [
                     contestant_name,
-                    f"{ContestantExecutionStatus.AC} ({config.test_count} tests)",
+                    f"{ContestantExecutionStatus.AC} ({tested})",
                 ]
             )
         self.general_status.sort()
 
         exec_time_stats = []
+        resource_stats = []
         for contestant, times in self.exec_times.items():
             min_time, max_time, avg_time, median_time = aggregate(times)
-            exec_time_stats.append([contestant, min_time, max_time, avg_time, median_time])
+            _, max_cpu, avg_cpu, __ = aggregate(self.cpu_times[contestant])
+            _, max_memory, avg_memory, __ = aggregate(self.peak_memories[contestant])
+            if self.peak_memories[contestant].count == 0:
+                max_memory = avg_memory = None
+            exec_time_stats.append(
+                [
+                    contestant,
+                    min_time,
+                    median_time,
+                    times.quantile(0.9),
+                    times.quantile(0.99),
+                    times.quantile(0.999),
+                    max_time,
+                    avg_time,
+                    times.stddev,
+                ]
+            )
+            resource_stats.append(
+                [
+                    contestant,
+                    avg_cpu,
+                    self.cpu_times[contestant].quantile(0.99),
+                    max_cpu,
+                    avg_memory,
+                    max_memory,
+                ]
+            )
         exec_time_stats.sort()
+        resource_stats.sort()
 
         with open(result_file_location, "w") as result_file:
             result_file.write("General status:\n\n")
@@ -246,14 +736,90 @@ class Stresser:
                     headers=[
                         "solution",
                         "min (ms)",
+                        "median (ms)",
+                        "p90 (ms)",
+                        "p99 (ms)",
+                        "p99.9 (ms)",
                         "max (ms)",
                         "average (ms)",
-                        "median (ms)",
+                        "std dev (ms)",
                     ],
                     tablefmt="simple",
                     numalign="right",
                 )
             )
+            result_file.write("\n\n\nResource usage statistics:\n\n")
+            result_file.write(
+                tabulate(
+                    resource_stats,
+                    headers=[
+                        "solution",
+                        "average CPU (ms)",
+                        "p99 CPU (ms)",
+                        "max CPU (ms)",
+                        "average memory (MB)",
+                        "max memory (MB)",
+                    ],
+                    tablefmt="simple",
+                    numalign="right",
+                    missingval="unknown",
+                )
+            )
+            percentiles = [*self.exec_times.values(), *self.cpu_times.values(), self.spawn_times]
+            if any(stats.estimated for stats in percentiles):
+                result_file.write(
+                    "\n\nPercentiles are estimated within 1%, in constant memory whatever the "
+                    + "number of tests."
+                )
+            if any(
+                self.peak_memories[contestant].count < times.count
+                for contestant, times in self.exec_times.items()
+            ):
+                result_file.write(
+                    "\nThe peak memory of a run is unknown, and left out of the memory statistics, "
+                    + "if it could not be measured (see `execution_engine`)."
+                )
+            checker_memoized = self.executor.checker.memoizable
+            packing = config.test_packing > 1
+            result_file.write("\n\n")
+            if self.spawn_times.count > 0:
+                _, max_spawn, avg_spawn, __ = aggregate(self.spawn_times)
+                result_file.write(
+                    f"\nProcess spawning: solutions took {avg_spawn:.3f} ms on average "
+                    + f"(p99: {self.spawn_times.quantile(0.99):.3f} ms, "
+                    + f"at most {max_spawn:.3f} ms) to start, over {self.spawn_times.count} "
+                    + f'run(s) with the "{config.execution_engine}" engine.\n'
+                )
+            if packing:
+                result_file.write(
+                    f"\nTest packing: tests were run in {self.packs} pack(s) of up to "
+                    + f"{config.test_packing} tests, plus {self.pack_part_runs} run(s) of parts "
+                    + "of packs to find failing tests. Statistics are per run.\n"
+                )
+            if self.replays:
+                result_file.write(
+                    f"\nLate solutions: {self.replays} test(s) were replayed by solutions whose "
+                    + "compilation finished after the tests started.\n"
+                )
+            if config.skip_duplicate_inputs:
+                result_file.write(
+                    f"\nUnique inputs: {unique_tests} of {self.processed_tests} generated "
+                    + f"test(s) were tested, {self.duplicate_tests} duplicate(s) were skipped.\n"
+                )
+            if self.answer_cache is not None:
+                result_file.write(
+                    f"\nAnswer cache: {self.cached_answers} of {unique_tests} "
+                    + "test(s) had their answer taken from the cache.\n"
+                )
+            if checker_memoized:
+                hit_rate = self.memoized_verdicts / max(1, self.checked_outputs)
+                result_file.write(
+                    f"\nChecker memo: {self.memoized_verdicts} of {self.checked_outputs} "
+                    + f"verdict(s) were memoized ({hit_rate:.1%}).\n"
+                )
+
+            if tracer.enabled:
+                self.write_trace_summary(result_file)
 
         send_message(
             f"Execution completed. Information about the result can be found at: {result_file_location}",
@@ -262,12 +828,60 @@ class Stresser:
         # send_message("Press any key to close...", color=text_colors.BOLD, end="")
         # input()
 
+    def write_trace_summary(self, result_file: TextIOWrapper):
+        """Write the time spent in each traced phase to the result file, and export the trace."""
+        summary = tracer.summary([category for category, _ in TRACED_PHASES])
+        descriptions = dict(TRACED_PHASES)
+        traced_time = sum(total for category, _, total in summary if category != "logging")
+        phase_stats = [
+            [
+                descriptions[category],
+                spans,
+                total,
+                total / spans,
+                f"{total / max(traced_time, 1e-9):.1%}",
+            ]
+            for category, spans, total in summary
+        ]
+        tracer.export(trace_file_location)
+
+        result_file.write(
+            "\nTracing: time spent in each phase, summed over all workers "
+            + f"(the trace can be found at {trace_file_location}):\n\n"
+        )
+        result_file.write(
+            tabulate(
+                phase_stats,
+                headers=["phase", "spans", "total (ms)", "average (ms)", "share"],
+                tablefmt="simple",
+                numalign="right",
+                floatfmt=".3f",
+            )
+        )
+        result_file.write("\n")
+        dropped_spans = tracer.recorded_spans() - len(tracer.events)
+        if dropped_spans > 0:
+            result_file.write(
+                f"\nThe oldest {dropped_spans} span(s) were dropped from the trace "
+                + "(see `tracing_capacity`), but are counted above.\n"
+            )
+
     def __call__(self):
         delete_folder(logdir)
         get_dir(logdir)
-        self.compiler(self.source_output)
-        self.init_workers()
-        self.run_tests()
+        with ExitStack() as stack:
+            self.start_compilation(stack)
+            # Tests start once the test generator, the judge and the checker are compiled;
+            # solutions join as soon as each of them is (see `join()`).
+            prerequisites = [bindir / self.testgen_name, bindir / self.judge_name]
+            if self.checker_type == "external":
+                prerequisites.append(bindir / self.external_checker_name)
+            if SpawnServer.supported():
+                prerequisites.append(SPAWN_SERVER)
+            for executable in prerequisites:
+                self.compiled[executable].result()  # raises if the compilation failed
+            self.init_workers()
+            self.run_tests()
         self.print_final_verdict()
 
 
@@ -4,13 +4,22 @@
  * This file redefines the original (vanilla) testlib's @c registerTestlibCmd
  * function to correspond with ASIMON's external checker protocol. In particular,
  * it initializes the three standard @c InStream objects in such a way that they
- * are fed contents from @c stdin and not files.
+ * are fed contents from @c stdin and not files. It also wraps @c registerGen to
+ * support ASIMON's batch generation protocol.
  *
  * THIS FILE DOES NOT, IN ANY WAY, IMPLEMENTS EVEN A FUNCTIONAL SUBSET OF
  * TESTLIB.H, NOR INDUCE ANY CHANGES ON THE USER'S SIDE, BUT MERELY ADD A
  * COMPATIBILITY LAYER SO THAT THE ORIGINAL VERSION OF TESTLIB.H CAN WORK WITH
  * ASIMON'S FILELESS I/O POLICY.
  *
+ * On POSIX systems, the layer also supports these extensions of the protocol:
+ *  - @c --_asimon_fd_input X (and likewise for @c answer and @c output): the stream
+ *    is read from the file descriptor X instead of @c stdin;
+ *  - @c --_asimon_batch: the checker serves test cases in a loop instead of checking
+ *    a single one (see @c __serve_batch), and the generator generates tests in a loop
+ *    instead of a single one (see @c __serve_gen_batch).
+ * They are announced to ASIMON when run with @c --_asimon_capabilities.
+ *
  *
  * It is imperative that the original testlib repository be included in the folder
  * containing this file. Do this if you have not done so after installing
@@ -30,16 +39,25 @@
 #ifndef TESTLIB_ASIMON
 #define TESTLIB_ASIMON
 
-/* Overrides vanilla testlib's registerTestlibCmd. */
+/* Overrides vanilla testlib's registerTestlibCmd and registerGen. */
 #define registerTestlibCmd __registerTestlibCmd_vanilla
+#define registerGen __registerGen_vanilla
 #include "testlib/testlib.h"
 #undef registerTestlibCmd
+#undef registerGen
+
+#ifndef _WIN32
+#include <fcntl.h>
+#include <sys/wait.h>
+#include <unistd.h>
+#endif
 
 namespace __testlib_asimon {
 
 std::string _name[] = {"input", "output", "answer"};
 std::string _content[3];  // these will be wrapped around by InStreams later
 int _sz[3];
+int _fd[3] = {-1, -1, -1};  // file descriptors to read the streams from, if any
 
 /**
  * @brief Consumes @c __n bytes from @c stdin into a string @c dest.
@@ -49,8 +67,40 @@ inline void __getstdin(std::string& dest, std::size_t __n) {
     fread(&dest[0], sizeof(char), __n, stdin);
 }
 
+#ifndef _WIN32
+/**
+ * @brief Consumes the file descriptor @c fd until its end into a string @c dest.
+ */
+inline void __getfd(std::string& dest, int fd) {
+    dest.clear();
+    char buffer[1 << 16];
+    ssize_t count;
+    while ((count = read(fd, buffer, sizeof(buffer))) > 0)
+        dest.append(buffer, count);
+    close(fd);
+}
+#endif
+
+/**
+ * @brief Consumes the contents of the three streams, from their file descriptors
+ * in @c _fd if given, or from @c stdin with the sizes in @c _sz.
+ *
+ * @note MUST be in ASIMON's input -> answer -> output order.
+ */
+void __read_streams() {
+    for (TMode mode : {_input, _answer, _output}) {
+#ifndef _WIN32
+        if (_fd[mode] >= 0) {
+            __getfd(_content[mode], _fd[mode]);
+            continue;
+        }
+#endif
+        __getstdin(_content[mode], _sz[mode]);
+    }
+}
+
 /**
- * @brief Initialize a testlib @c InStream.
+ * @brief Initialize a testlib @c InStream from the contents read by @c __read_streams.
  *
  * @param stream The @c InStream in question.
  * @param mode The @c TMode (aka type ID) of `stream`. Must be one of: `_input`, `_answer`, `_output`.
@@ -63,10 +113,134 @@ void __init_instream(InStream& stream, TMode mode) {
     stream.stdfile = true;  // all are from stdin
     stream.strict = false;  // and aren't validators
 
-    __getstdin(_content[mode], _sz[mode]);
     stream.reader = new StringInputStreamReader(_content[mode]);
 }
 
+#ifndef _WIN32
+/**
+ * @brief Serves test cases in batch mode, see ASIMON's @c ExternalChecker.check_batch.
+ *
+ * Announces itself on @c stdout, then reads test cases from @c stdin, each being a
+ * header line "X Y Z" followed by the contents of the three streams. For each of them,
+ * a child is forked and this function returns in it, so that the checker runs on the
+ * test case with pristine testlib state (@c inf, @c ans, @c ouf and everything else).
+ * Meanwhile, the parent collects the child's @c stderr (testlib's comment) and exit
+ * code, and replies with a header line "code N" followed by the N bytes of the comment.
+ *
+ * Returns in children only; the parent exits once @c stdin is exhausted.
+ */
+void __serve_batch() {
+    fputs("ASIMON-BATCH 1\n", stdout);
+    fflush(stdout);
+
+    // the reply channel is kept apart from the checker's own stdout, which is ignored
+    FILE* reply = fdopen(dup(STDOUT_FILENO), "wb");
+    int devnull = open("/dev/null", O_WRONLY);
+    dup2(devnull, STDOUT_FILENO);
+    close(devnull);
+
+    while (scanf("%d %d %d", &_sz[_input], &_sz[_answer], &_sz[_output]) == 3) {
+        getchar();  // end of the header line
+        __read_streams();
+
+        int comment_pipe[2];
+        if (pipe(comment_pipe) != 0) break;
+        fflush(stderr);
+
+        pid_t pid = fork();
+        if (pid < 0) break;
+        if (pid == 0) {
+            fclose(reply);
+            close(comment_pipe[0]);
+            dup2(comment_pipe[1], STDERR_FILENO);
+            close(comment_pipe[1]);
+            return;
+        }
+
+        close(comment_pipe[1]);
+        std::string comment;
+        char buffer[4096];
+        ssize_t count;
+        while ((count = read(comment_pipe[0], buffer, sizeof(buffer))) > 0)
+            comment.append(buffer, count);
+        close(comment_pipe[0]);
+
+        int status;
+        waitpid(pid, &status, 0);
+        int code = WIFEXITED(status) ? WEXITSTATUS(status) : 128 + WTERMSIG(status);
+
+        fprintf(reply, "%d %zu\n", code, comment.size());
+        fwrite(comment.data(), sizeof(char), comment.size(), reply);
+        fflush(reply);
+    }
+    _exit(0);  // without testlib's finalization checks, as no test case was checked here
+}
+
+/**
+ * @brief Serves test generation requests in batch mode, see ASIMON's @c BatchGenerator.
+ *
+ * Announces itself on @c stdout, then reads requests from @c stdin, each being a line
+ * with a number K followed by K lines, which are the arguments the generator would have
+ * been run with in addition to @c args (e.g. "--seed 42"). For each of them, a child is
+ * forked and this function returns in it, with these arguments appended to @c args, so
+ * that the generator runs exactly as it would have with them (testlib seeds its random
+ * generator from the arguments). Meanwhile, the parent collects the child's @c stdout
+ * (the test) and exit code, and replies with a header line "code N" followed by the N
+ * bytes of the test.
+ *
+ * Returns in children only; the parent exits once @c stdin is exhausted.
+ */
+void __serve_gen_batch(std::vector<char*>& args) {
+    fputs("ASIMON-BATCH 1\n", stdout);
+    fflush(stdout);
+    FILE* reply = fdopen(dup(STDOUT_FILENO), "wb");
+
+    int count;
+    while (scanf("%d", &count) == 1) {
+        getchar();  // end of the line
+        static std::vector<std::string> extra_args;
+        extra_args.assign(count, "");
+        for (std::string& arg : extra_args)
+            for (int c; (c = getchar()) != EOF && c != '\n';) arg.push_back(char(c));
+
+        int test_pipe[2];
+        if (pipe(test_pipe) != 0) break;
+        fflush(stderr);
+
+        pid_t pid = fork();
+        if (pid < 0) break;
+        if (pid == 0) {
+            fclose(reply);
+            close(test_pipe[0]);
+            dup2(test_pipe[1], STDOUT_FILENO);
+            close(test_pipe[1]);
+            int devnull = open("/dev/null", O_RDONLY);
+            dup2(devnull, STDIN_FILENO);
+            close(devnull);
+            for (std::string& arg : extra_args) args.push_back(&arg[0]);
+            return;
+        }
+
+        close(test_pipe[1]);
+        std::string test;
+        char buffer[1 << 16];
+        ssize_t read_count;
+        while ((read_count = read(test_pipe[0], buffer, sizeof(buffer))) > 0)
+            test.append(buffer, read_count);
+        close(test_pipe[0]);
+
+        int status;
+        waitpid(pid, &status, 0);
+        int code = WIFEXITED(status) ? WEXITSTATUS(status) : 128 + WTERMSIG(status);
+
+        fprintf(reply, "%d %zu\n", code, test.size());
+        fwrite(test.data(), sizeof(char), test.size(), reply);
+        fflush(reply);
+    }
+    _exit(0);
+}
+#endif
+
 }  // namespace __testlib_asimon
 
 /**
@@ -89,6 +263,9 @@ void registerTestlibCmd(int argc, char* argv[]) {
     using __testlib_asimon::__init_instream;
     using __testlib_asimon::_name;
     using __testlib_asimon::_sz;
+    using __testlib_asimon::_fd;
+
+    bool batch = false;
 
     for (int i = 1; i < argc; i++) {
         // Testsets and groups are handled on the Python side, no checking
@@ -100,6 +277,22 @@ void registerTestlibCmd(int argc, char* argv[]) {
             _sz[_answer] = atoi(argv[++i]);
         } else if (!strcmp("--_asimon_sz_output", argv[i])) {
             _sz[_output] = atoi(argv[++i]);
+        } else if (!strcmp("--_asimon_fd_input", argv[i])) {
+            _fd[_input] = atoi(argv[++i]);
+        } else if (!strcmp("--_asimon_fd_answer", argv[i])) {
+            _fd[_answer] = atoi(argv[++i]);
+        } else if (!strcmp("--_asimon_fd_output", argv[i])) {
+            _fd[_output] = atoi(argv[++i]);
+        } else if (!strcmp("--_asimon_batch", argv[i])) {
+            batch = true;
+        } else if (!strcmp("--_asimon_capabilities", argv[i])) {
+#ifndef _WIN32
+            puts("ASIMON fds batch");
+#else
+            puts("ASIMON");
+#endif
+            fflush(stdout);
+            std::_Exit(0);  // without testlib's finalization checks
         } else
             args.push_back(argv[i]);
     }
@@ -107,10 +300,57 @@ void registerTestlibCmd(int argc, char* argv[]) {
     argc = int(args.size());
     if (argc > 1 && "--help" == args[1]) __testlib_help();
 
-    // MUST be in ASIMON's input -> answer -> output order.
+    if (batch) {
+#ifndef _WIN32
+        __testlib_asimon::__serve_batch();
+#else
+        __testlib_fail("Batch mode is not supported on Windows.");
+#endif
+    } else
+        __testlib_asimon::__read_streams();
+
     __init_instream(inf, _input);
     __init_instream(ans, _answer);
     __init_instream(ouf, _output);
 }
 
+/**
+ * @brief Testlib register for generator programs. Same as vanilla testlib's, except
+ * for ASIMON's @c --_asimon_batch and @c --_asimon_capabilities arguments.
+ */
+void registerGen(int argc, char* argv[], int randomGeneratorVersion) {
+    static std::vector<char*> args;  // testlib may keep pointers to the arguments
+    bool batch = false;
+    for (int i = 0; i < argc; i++) {
+        if (!strcmp("--_asimon_batch", argv[i])) {
+            batch = true;
+        } else if (!strcmp("--_asimon_capabilities", argv[i])) {
+#ifndef _WIN32
+            puts("ASIMON batch");
+#else
+            puts("ASIMON");
+#endif
+            fflush(stdout);
+            std::_Exit(0);
+        } else
+            args.push_back(argv[i]);
+    }
+
+    if (batch) {
+#ifndef _WIN32
+        __testlib_asimon::__serve_gen_batch(args);
+#else
+        __testlib_fail("Batch mode is not supported on Windows.");
+#endif
+    }
+
+    int args_count = int(args.size());
+    args.push_back(nullptr);  // argv[argc] is NULL by convention
+    __registerGen_vanilla(args_count, args.data(), randomGeneratorVersion);
+}
+
+void registerGen(int argc, char* argv[]) {
+    registerGen(argc, argv, 0);
+}
+
 #endif /* TESTLIB_ASIMON */
\ No newline at end of file